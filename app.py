@@ -2,9 +2,6 @@ import streamlit as st
 import sys
 import os
 import time
-import pandas as pd
-import plotly.express as px
-from PIL import Image
 
 # Robust path handling for src
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -12,7 +9,10 @@ src_path = os.path.join(current_dir, 'src')
 if src_path not in sys.path:
     sys.path.append(src_path)
 
-from rag_pipeline import RAGPipeline
+from generation_pool import PipelineBusy
+
+# Set CREDITRUST_SERVER_URL to run as a thin client of src/server.py
+SERVER_URL = os.environ.get("CREDITRUST_SERVER_URL")
 
 # Page configuration
 st.set_page_config(
@@ -24,6 +24,8 @@ st.set_page_config(
 # Constants & Paths
 LOGO_PATH = r"C:\Users\dell\.gemini\antigravity\brain\8cb5df7c-9a97-407d-af85-f88c33c3445d\creditrust_logo_1767447836333.png"
 DATA_PATH = "data/filtered_complaints.csv"
+# Written by preprocessing and indexing (src/analytics.py); the dashboard reads nothing else
+ANALYTICS_PATH = "data/analytics.json"
 
 # Custom CSS for polished UI
 st.markdown("""
@@ -51,16 +53,37 @@ st.markdown("""
 # Initialize RAG Pipeline
 @st.cache_resource
 def load_rag():
-    return RAGPipeline()
+    if SERVER_URL:
+        from client import RemoteRAG
+        return RemoteRAG(SERVER_URL)
+    from rag_pipeline import RAGPipeline
+    # fast_start: models load in the background; the index and embedder are ready first
+    return RAGPipeline(fast_start=True)
 
-@st.cache_data
+@st.cache_data(ttl=60)
 def load_stats():
-    if os.path.exists(DATA_PATH):
-        df = pd.read_csv(DATA_PATH)
-        return df['Product'].value_counts()
-    return None
+    import pandas as pd
+    from analytics import load_analytics, read_columns
+    analytics = load_analytics(ANALYTICS_PATH) or {}
+    corpus = analytics.get("corpus")
+    if corpus is None:
+        # No sidecar yet: count products from that one column of the filtered data
+        data_path = next((p for p in (DATA_PATH, DATA_PATH.replace(".csv", ".parquet")) if os.path.exists(p)), None)
+        if data_path is None:
+            return None
+        products = read_columns(data_path, ["Product"])["Product"]
+        corpus = {"total": len(products), "by_product": products.value_counts().to_dict()}
+    return {
+        "total": corpus["total"],
+        "by_product": pd.Series(corpus["by_product"], dtype="int64"),
+        "by_month": pd.Series(corpus.get("by_month", {}), dtype="int64").drop("unknown", errors="ignore"),
+        "index": analytics.get("index"),
+    }
 
 rag = load_rag()
+# A newly published index snapshot is loaded in the background and swapped in between reruns
+if rag and hasattr(rag, "check_for_update"):
+    rag.check_for_update()
 stats = load_stats()
 
 # Sidebar: Branding and Controls
@@ -80,11 +103,55 @@ with st.sidebar:
         top_k = st.slider("Discovery Pool (K)", min_value=5, max_value=50, value=5, help="Number of complaints to initially retrieve before re-ranking.")
         st.caption("Lower K is faster; Higher K + Re-ranking is more accurate.")
         
+        filter_opts = rag.filter_options() if rag else {}
+        product_filter = st.selectbox("Product Focus", ["All products"] + list(filter_opts),
+                                      help="Search only complaints about this product.")
+        product_filter = None if product_filter == "All products" else product_filter
+        sub_product_filter = None
+        if product_filter:
+            sub_product_filter = st.selectbox("Sub-product", ["All sub-products"] + filter_opts[product_filter])
+            sub_product_filter = None if sub_product_filter == "All sub-products" else sub_product_filter
+        
         st.subheader("Model Status")
         if rag:
-            st.success("🤖 Generative AI: Online")
-            st.success("🗄️ Vector Index: Active")
-            st.success("⚖️ Re-ranker: Active")
+            # One snapshot of every counter per rerun (a single /health request in client mode)
+            health = rag.health()
+            status = health["readiness"]
+            for group, label in [("generator", "🤖 Generative AI"), ("vector_store", "🗄️ Vector Index"),
+                                 ("reranker", "⚖️ Re-ranker"), ("embeddings", "🧬 Embedder")]:
+                if status[group] == "ready":
+                    st.success(f"{label}: Online")
+                elif status[group] == "loading":
+                    st.info(f"{label}: Warming up...")
+                else:
+                    st.error(f"{label}: Failed to load")
+            if health["load_times"]:
+                st.caption("Load times: " + ", ".join(f"{k} {v:.1f}s" for k, v in health["load_times"].items()))
+            index_info = health["index"]
+            if index_info.get("version"):
+                st.caption(f"Index snapshot: {index_info['version']}"
+                           + (" (newer one loading...)" if index_info["reloading"] else ""))
+            if any(state != "ready" for state in status.values()):
+                st.button("🔄 Refresh Status", use_container_width=True)
+            cache_stats = health["embedding_cache"]
+            if cache_stats:
+                st.caption(f"Embedding cache: {cache_stats['hit_rate']:.0%} hit rate "
+                           f"({cache_stats['misses']} encoded)")
+            rerank_stats = health["reranker"]
+            if rerank_stats["scored"] or rerank_stats["skipped"]:
+                st.caption(f"Re-ranker: {rerank_stats['scored']} pairs scored, "
+                           f"{rerank_stats['skipped']} skipped")
+            
+            st.subheader("Latency")
+            latency = health["latency"]
+            stage_rows = [{"Stage": name, "p50 ms": round(v["p50_ms"], 1), "p95 ms": round(v["p95_ms"], 1),
+                           "Requests": v["count"]} for name, v in latency.items() if "p50_ms" in v]
+            if stage_rows:
+                st.dataframe(stage_rows, hide_index=True, use_container_width=True)
+                if "tokens_per_second" in latency:
+                    st.caption(f"Decode speed: {latency['tokens_per_second']['p50']:.1f} tokens/s (median)")
+            else:
+                st.caption("No requests timed yet.")
         else:
             st.error("RAG Pipeline Offline")
 
@@ -99,8 +166,7 @@ with st.sidebar:
                         history_summary += f"{m['role']}: {m['content']}\n"
                     
                     summary_prompt = f"Summarize the key financial issues and consumer concerns discussed in this conversation so far. Focus on patterns and risks.\n\nConversation:\n{history_summary}\n\nSummary:"
-                    summary_res = rag.pipe(summary_prompt, max_new_tokens=150)
-                    st.info(summary_res[0]['generated_text'])
+                    st.info(rag.generate(summary_prompt, max_new_tokens=150))
             else:
                 st.warning("Start a conversation first!")
 
@@ -122,17 +188,29 @@ with st.sidebar:
         """, unsafe_allow_html=True)
         
         if st.button("Reset Conversation", key="clear_chat", use_container_width=True, type="primary"):
+            # Stop any answer still being generated for the old conversation
+            active = st.session_state.pop("active_stream", None)
+            if active is not None and hasattr(active, "cancel"):
+                active.cancel()
             st.session_state.messages = []
             st.rerun()
 
     with sb_tab2:
         st.subheader("Complaint Distribution")
         if stats is not None:
-            fig = px.pie(values=stats.values, names=stats.index, hole=.4, 
+            import plotly.express as px
+            by_product = stats["by_product"]
+            fig = px.pie(values=by_product.values, names=by_product.index, hole=.4, 
                          color_discrete_sequence=px.colors.sequential.RdBu)
             fig.update_layout(showlegend=False, margin=dict(t=0, b=0, l=0, r=0))
             st.plotly_chart(fig, use_container_width=True)
-            st.caption("Distribution of 12,000 sampled complaints across core products.")
+            st.caption(f"Distribution of {stats['total']:,} filtered complaints across core products.")
+            if not stats["by_month"].empty:
+                st.subheader("Complaints per Month")
+                st.line_chart(stats["by_month"])
+            if stats["index"]:
+                st.caption(f"Index: {stats['index']['chunks']:,} chunks from "
+                           f"{stats['index']['complaints']:,} sampled complaints")
         else:
             st.warning("Data stats unavailable.")
 
@@ -173,15 +251,25 @@ if rag:
             placeholder = st.empty()
             full_response = ""
             
-            with st.spinner("Decoding records..."):
-                streamer, docs = rag.stream_answer(prompt, history=history_text, k=top_k)
+            try:
+                with st.spinner("Decoding records..."):
+                    streamer, docs = rag.stream_answer(prompt, history=history_text, k=top_k,
+                                                       product=product_filter, sub_product=sub_product_filter)
+            except PipelineBusy:
+                st.warning("The analyst is busy with other questions right now. Please try again in a moment.")
+                st.stop()
             
+            # A rerun (or Reset) that abandons this stream cancels its generation
+            st.session_state.active_stream = streamer
             for new_text in streamer:
                 full_response += new_text
                 placeholder.markdown(full_response + "▌")
             placeholder.markdown(full_response)
+            st.session_state.pop("active_stream", None)
             
-            formatted_sources = [{"id": d.metadata.get("complaint_id", "N/A"), "content": d.page_content} for d in docs]
+            # A de-duplicated chunk cites every complaint it was indexed for
+            formatted_sources = [{"id": ", ".join(d.metadata.get("source_ids") or [d.metadata.get("complaint_id", "N/A")]),
+                                  "content": d.page_content} for d in docs]
             
             with st.expander("🔍 Inspection: Root Context"):
                 for i, src in enumerate(formatted_sources):
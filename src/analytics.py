@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+try:
+    from .docstore import ColumnarDocstore, DOCSTORE_DIR, MISSING_ID, _replace_file
+    from .snapshots import resolve_index
+except ImportError:
+    from docstore import ColumnarDocstore, DOCSTORE_DIR, MISSING_ID, _replace_file
+    from snapshots import resolve_index
+
+ANALYTICS_NAME = "analytics.json"
+# The only columns the aggregates need; everything else (narratives) stays on disk
+AGGREGATE_COLUMNS = ["Product", "Sub-product", "Date received"]
+
+
+def analytics_path(data_path):
+    """Sidecar location for a filtered complaints file: analytics.json in the same directory."""
+    return os.path.join(os.path.dirname(data_path) or ".", ANALYTICS_NAME)
+
+
+class ComplaintAggregates:
+    """Counts of filtered complaints by product, sub-product and month, built chunk by chunk."""
+
+    def __init__(self):
+        self.total = 0
+        self.by_product = {}
+        self.by_sub_product = {}
+        self.by_month = {}
+        self.by_product_month = {}
+
+    @staticmethod
+    def _add(table, counts):
+        for key, n in counts.items():
+            table[key] = table.get(key, 0) + int(n)
+
+    def update(self, df):
+        self.total += len(df)
+        product = df['Product'].fillna("N/A").astype(str)
+        self._add(self.by_product, product.value_counts())
+        if 'Sub-product' in df:
+            sub_product = df['Sub-product'].fillna("N/A").astype(str)
+            self._add(self.by_sub_product, pd.Series(1, index=df.index).groupby([product, sub_product]).size())
+        if 'Date received' in df:
+            month = pd.to_datetime(df['Date received'], errors='coerce').dt.strftime("%Y-%m").fillna("unknown")
+            self._add(self.by_month, month.value_counts())
+            self._add(self.by_product_month, pd.Series(1, index=df.index).groupby([product, month]).size())
+        return self
+
+    @staticmethod
+    def _nested(table, order):
+        nested = {}
+        for (outer, inner), n in table.items():
+            nested.setdefault(outer, {})[inner] = n
+        return {outer: dict(sorted(inner.items(), key=order)) for outer, inner in sorted(nested.items())}
+
+    def to_dict(self):
+        return {
+            "total": self.total,
+            "by_product": dict(sorted(self.by_product.items(), key=lambda kv: -kv[1])),
+            "by_sub_product": self._nested(self.by_sub_product, lambda kv: -kv[1]),
+            "by_month": dict(sorted(self.by_month.items())),
+            "by_product_month": self._nested(self.by_product_month, lambda kv: kv[0]),
+        }
+
+
+def index_statistics(store_path):
+    """Size of a built index, from its docstore columns alone (no vectors or text are read).
+
+    Counts are of docstore rows, which include chunks superseded by
+    incremental updates.
+    """
+    store_path, version = resolve_index(store_path)
+    docstore = ColumnarDocstore(os.path.join(store_path, DOCSTORE_DIR))
+    complaint_ids = np.asarray(docstore.columns["complaint_id"])
+    products = np.bincount(np.asarray(docstore.columns["product"]), minlength=len(docstore.vocab["product"]))
+    sources = docstore.sources
+    return {
+        "path": store_path,
+        "snapshot": version,
+        "chunks": len(docstore),
+        "complaints": int(np.unique(complaint_ids[complaint_ids != MISSING_ID]).size),
+        "collapsed_duplicates": int(len(sources)) if sources is not None else 0,
+        "chunks_by_product": {name: int(n) for name, n in zip(docstore.vocab["product"], products)},
+    }
+
+
+def load_analytics(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_analytics(path, **sections):
+    """Replace the given top-level sections (e.g. corpus=..., index=...) of the sidecar atomically."""
+    analytics = load_analytics(path) or {}
+    for name, value in sections.items():
+        analytics[name] = {**value, "updated": time.time()}
+
+    def write(tmp_path):
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(analytics, f, indent=1)
+    _replace_file(path, write)
+    return analytics
+
+
+def read_columns(data_path, columns=AGGREGATE_COLUMNS, chunksize=None):
+    """Only ``columns`` of a filtered complaints file, for ad-hoc aggregations.
+
+    Parquet and Arrow files read just those column chunks; CSV still has to
+    be scanned, but narratives are never parsed. With ``chunksize`` an
+    iterator of frames is returned instead.
+    """
+    if data_path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        parquet = pq.ParquetFile(data_path)
+        present = [c for c in columns if c in parquet.schema_arrow.names]
+        if chunksize:
+            return (batch.to_pandas() for batch in parquet.iter_batches(batch_size=chunksize, columns=present))
+        return parquet.read(columns=present).to_pandas()
+    if data_path.endswith(('.arrow', '.feather')):
+        import pyarrow as pa
+        names = pa.ipc.open_file(data_path).schema.names
+        frame = pd.read_feather(data_path, columns=[c for c in columns if c in names])
+        return iter([frame]) if chunksize else frame
+    return pd.read_csv(data_path, usecols=lambda c: c in columns, dtype=str, chunksize=chunksize)
+
+
+def aggregate_file(data_path, chunksize=100_000):
+    """ComplaintAggregates of a filtered complaints file, reading only AGGREGATE_COLUMNS."""
+    aggregates = ComplaintAggregates()
+    for chunk in read_columns(data_path, chunksize=chunksize):
+        aggregates.update(chunk)
+    return aggregates
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="(Re)build the dashboard's analytics sidecar.")
+    parser.add_argument("--data", default=None,
+                        help="Filtered complaints (.csv or .parquet); defaults to data/filtered_complaints.*")
+    parser.add_argument("--store", default="vector_store/faiss_index", help="Index to add statistics for.")
+    args = parser.parse_args()
+
+    data_path = args.data or "data/filtered_complaints.csv"
+    if args.data is None and not os.path.exists(data_path) and os.path.exists("data/filtered_complaints.parquet"):
+        data_path = "data/filtered_complaints.parquet"
+    sections = {}
+    if os.path.exists(data_path):
+        sections["corpus"] = aggregate_file(data_path).to_dict()
+    if os.path.isdir(os.path.join(resolve_index(args.store)[0], DOCSTORE_DIR)):
+        sections["index"] = index_statistics(args.store)
+    write_analytics(analytics_path(data_path), **sections)
+    print(f"Wrote {', '.join(sections) or 'nothing'} to {analytics_path(data_path)}")
@@ -0,0 +1,101 @@
+import os
+import json
+import time
+import argparse
+
+import numpy as np
+import faiss
+
+try:
+    from .indexing import make_faiss_index, unwrap_index
+    from .snapshots import resolve_index
+except ImportError:
+    from indexing import make_faiss_index, unwrap_index
+    from snapshots import resolve_index
+
+# (index_type, storage, search parameter, values to sweep)
+DEFAULT_SWEEP = [
+    ("flat", "fp16", None, [None]),
+    ("flat", "int8", None, [None]),
+    ("ivf", "fp32", "nprobe", [1, 4, 16, 64]),
+    ("ivf", "int8", "nprobe", [4, 16, 64]),
+    ("hnsw", "fp32", "efSearch", [16, 32, 64, 128]),
+    ("hnsw", "fp16", "efSearch", [32, 64]),
+    ("ivfpq", "fp32", "nprobe", [4, 16, 64]),
+]
+
+
+def load_vectors(store_path):
+    """Read back the stored vectors of a saved (exact) FAISS index (or a snapshot root's current one)."""
+    store_path, _ = resolve_index(store_path)
+    index = unwrap_index(faiss.read_index(os.path.join(store_path, "index.faiss")))
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def synthetic_queries(vectors, n_queries=200, seed=42):
+    """Midpoints of random vector pairs: realistic queries that are not stored points."""
+    rng = np.random.default_rng(seed)
+    a = vectors[rng.integers(0, len(vectors), n_queries)]
+    b = vectors[rng.integers(0, len(vectors), n_queries)]
+    return np.ascontiguousarray((a + b) / 2, dtype=np.float32)
+
+
+def measure(index, queries, ground_truth, k=10):
+    """recall@k against exact results, plus per-query latency percentiles."""
+    latencies = []
+    found = np.empty((len(queries), k), dtype=np.int64)
+    for i, q in enumerate(queries):
+        start = time.perf_counter()
+        _, ids = index.search(q[None, :], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found[i] = ids[0]
+
+    hits = sum(len(set(f) & set(g)) for f, g in zip(found, ground_truth))
+    latencies = np.array(latencies)
+    return {
+        "recall_at_k": hits / ground_truth.size,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+    }
+
+
+def tune(vectors, queries, k=10, sweep=DEFAULT_SWEEP):
+    """Build each candidate index once and measure it at every search setting."""
+    exact = make_faiss_index(vectors, "flat", "fp32")
+    _, ground_truth = exact.search(queries, k)
+
+    results = [{"index_type": "flat", "storage": "fp32", "param": None, "value": None,
+                "build_s": 0.0, **measure(exact, queries, ground_truth, k)}]
+    params = faiss.ParameterSpace()
+    for index_type, storage, param, values in sweep:
+        start = time.perf_counter()
+        index = make_faiss_index(vectors, index_type, storage)
+        build_s = time.perf_counter() - start
+        for value in values:
+            if param is not None:
+                params.set_index_parameter(index, param, value)
+            row = {"index_type": index_type, "storage": storage, "param": param, "value": value,
+                   "build_s": build_s, **measure(index, queries, ground_truth, k)}
+            results.append(row)
+            print(f"{index_type:>6} {storage:>5} {param or '':>9}={value!s:<4} "
+                  f"recall@{k}={row['recall_at_k']:.3f} p50={row['p50_ms']:.3f}ms p99={row['p99_ms']:.3f}ms")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure ANN recall@k and latency against the exact index.")
+    parser.add_argument("--store", default="vector_store/faiss_index",
+                        help="Flat index to take vectors from.")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--json", default=None, help="Write results to this JSON file.")
+    args = parser.parse_args()
+
+    vectors = load_vectors(args.store)
+    print(f"Loaded {len(vectors)} vectors of dim {vectors.shape[1]}")
+    results = tune(vectors, synthetic_queries(vectors, args.queries), k=args.k)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {args.json}")
@@ -0,0 +1,156 @@
+import re
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_question(question):
+    """Case-, whitespace- and trailing-punctuation-insensitive form of a question."""
+    return " ".join(question.lower().split()).rstrip(" ?.!")
+
+
+class AnswerCache:
+    """TTL + LRU cache of RAG answers with an optional semantic tier.
+
+    Entries are keyed by the normalized question plus the retrieval
+    parameters (k, filters, chat history). When ``semantic_threshold`` is
+    set, a miss on the exact key falls back to the cached entry with the
+    same parameters whose question embedding has the highest cosine
+    similarity, if that similarity is at least the threshold. Everything is
+    dropped when the index version changes.
+    """
+
+    def __init__(self, max_entries=256, ttl=3600, semantic_threshold=None, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.semantic_threshold = semantic_threshold
+        self.clock = clock
+        self.version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def _key(self, question, params):
+        return (normalize_question(question), tuple(sorted(params.items())))
+
+    def check_version(self, version):
+        """Invalidate everything if the index version differs from the cached one."""
+        with self._lock:
+            if version != self.version:
+                self._entries.clear()
+                self.version = version
+
+    def get(self, question, params, embedding=None):
+        """Return the cached answer dict for this question, or None."""
+        key = self._key(question, params)
+        now = self.clock()
+        with self._lock:
+            # Expired entries are evicted lazily, oldest first
+            while self._entries and next(iter(self._entries.values()))["expires"] <= now:
+                self._entries.popitem(last=False)
+
+            entry = self._entries.get(key)
+            if entry is not None and entry["expires"] > now:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry["answer"]
+
+            if self.semantic_threshold is not None and embedding is not None:
+                match = self._semantic_match(key[1], embedding, now)
+                if match is not None:
+                    self._entries.move_to_end(match)
+                    self.semantic_hits += 1
+                    return self._entries[match]["answer"]
+
+            self.misses += 1
+            return None
+
+    def _semantic_match(self, params_key, embedding, now):
+        candidates = [(k, e) for k, e in self._entries.items()
+                      if k[1] == params_key and e["embedding"] is not None and e["expires"] > now]
+        if not candidates:
+            return None
+        query = _unit(embedding)
+        sims = np.stack([e["embedding"] for _, e in candidates]) @ query
+        best = int(np.argmax(sims))
+        return candidates[best][0] if sims[best] >= self.semantic_threshold else None
+
+    def put(self, question, params, answer, embedding=None, version=None):
+        """Cache ``answer``; skipped if it was built from index ``version`` and the cache has moved on."""
+        key = self._key(question, params)
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            self._entries[key] = {
+                "answer": answer,
+                "embedding": _unit(embedding) if embedding is not None else None,
+                "expires": self.clock() + self.ttl,
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+        }
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class ReplayStream:
+    """Replays a cached answer word by word, like a TextIteratorStreamer."""
+
+    def __init__(self, text):
+        self._pieces = re.findall(r"\s*\S+", text)
+
+    def __iter__(self):
+        return iter(self._pieces)
+
+    def cancel(self):
+        pass
+
+
+class RecordingStream:
+    """Passes a streamer through and hands the full text to ``on_complete`` at the end.
+
+    Nothing is recorded if the consumer stops iterating early; the
+    generation behind ``handle`` is cancelled instead.
+    """
+
+    def __init__(self, streamer, on_complete, handle=None):
+        self.streamer = streamer
+        self.on_complete = on_complete
+        self.handle = handle
+
+    def cancel(self):
+        if self.handle is not None:
+            self.handle.cancel()
+
+    def __iter__(self):
+        pieces = []
+        finished = False
+        try:
+            for text in self.streamer:
+                pieces.append(text)
+                yield text
+            finished = True
+        finally:
+            if not finished:
+                self.cancel()
+        self.on_complete("".join(pieces))
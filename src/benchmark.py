@@ -0,0 +1,274 @@
+import os
+import re
+import json
+import time
+import zlib
+import argparse
+import tempfile
+
+import numpy as np
+import pandas as pd
+from langchain_core.embeddings import Embeddings
+
+try:
+    from .preprocessing import filter_data, clean_texts
+    from .indexing import create_chunks, build_vector_store
+    from .rag_pipeline import RAGPipeline, EVAL_QUESTIONS
+except ImportError:
+    from preprocessing import filter_data, clean_texts
+    from indexing import create_chunks, build_vector_store
+    from rag_pipeline import RAGPipeline, EVAL_QUESTIONS
+
+DEFAULT_SCALES = (10_000, 100_000, 1_000_000)
+# Complaints chunked and embedded per scale (as indexing.py samples); filtering and cleaning use every row
+DEFAULT_SAMPLE_SIZE = 12_000
+DEFAULT_THRESHOLD = 0.2
+
+# Raw CFPB product names (as filter_data expects them), with sub-products and issues
+PRODUCTS = {
+    "Credit card or prepaid card": (["General-purpose credit card or charge card", "Store credit card"],
+                                    ["Problem with a purchase shown on your statement", "Fees or interest"]),
+    "Checking or savings account": (["Checking account", "Savings account"],
+                                    ["Managing an account", "Closing an account"]),
+    "Money transfer, virtual currency, or money service": (["Domestic (US) money transfer", "Mobile or digital wallet"],
+                                                           ["Fraud or scam", "Money was not available when promised"]),
+    "Payday loan, title loan, or personal loan": (["Installment loan", "Payday loan"],
+                                                  ["Charged fees or interest you didn't expect", "Getting the loan"]),
+    "Buy Now, Pay Later (BNPL)": (["Pay in four", "Pay over time"],
+                                  ["Problem with a payment", "Fees or interest"]),
+    # Not a target product: filter_data drops it
+    "Mortgage": (["Conventional home mortgage"], ["Trouble during payment process"]),
+}
+
+OPENINGS = ["I am writing to file a complaint about", "To whom it may concern, I have a problem with",
+            "Dear CFPB, I want to report", "I have been dealing with", "On XX/XX/XXXX I noticed"]
+SUBJECTS = ["a late fee", "an overdraft fee", "my zelle transfer", "a wire transfer", "my credit limit",
+            "interest charges", "an unauthorized charge", "my installment plan", "a disputed transaction",
+            "my account closure", "the annual fee", "a payment that was never applied"]
+DETAILS = ["the bank refused to refund the money", "customer service kept transferring me",
+           "they reported it to the credit bureaus", "the merchant denied receiving the payment",
+           "my balance was sent to collections", "I was charged twice for the same purchase",
+           "the funds were held for ten business days", "nobody explained the fee schedule",
+           "the app showed a different amount", "I never authorized this withdrawal"]
+CLOSINGS = ["Please help me resolve this.", "I want my money back!!", "This is unacceptable.",
+            "I have attached my statements.", ""]
+
+
+def synthetic_complaints(n_rows, seed=0):
+    """Deterministic CFPB-shaped complaints: raw product names, some empty narratives."""
+    rng = np.random.default_rng(seed)
+    products = list(PRODUCTS)
+    product_idx = rng.integers(0, len(products), n_rows)
+    sub_idx = rng.integers(0, 2, n_rows)
+    parts = [rng.integers(0, len(words), (n_rows, n)) for words, n in
+             ((OPENINGS, 1), (SUBJECTS, 2), (DETAILS, 4), (CLOSINGS, 1))]
+
+    narratives = []
+    for i in range(n_rows):
+        sentences = [f"{OPENINGS[parts[0][i, 0]]} {SUBJECTS[parts[1][i, 0]]}."]
+        sentences += [f"Also {SUBJECTS[parts[1][i, 1]]}: {DETAILS[j]}." for j in parts[2][i]]
+        sentences.append(CLOSINGS[parts[3][i, 0]])
+        narratives.append(" ".join(sentences))
+    narratives = pd.Series(narratives)
+    narratives[rng.random(n_rows) < 0.1] = None
+
+    subs = [PRODUCTS[products[p]][0][min(s, len(PRODUCTS[products[p]][0]) - 1)] for p, s in zip(product_idx, sub_idx)]
+    issues = [PRODUCTS[products[p]][1][min(s, len(PRODUCTS[products[p]][1]) - 1)] for p, s in zip(product_idx, sub_idx)]
+    return pd.DataFrame({
+        "Date received": pd.Timestamp("2023-01-01") + pd.to_timedelta(rng.integers(0, 365, n_rows), unit="D"),
+        "Product": [products[p] for p in product_idx],
+        "Sub-product": subs,
+        "Issue": issues,
+        "Consumer complaint narrative": narratives,
+        "Complaint ID": np.arange(1, n_rows + 1),
+    })
+
+
+class HashingEmbeddings(Embeddings):
+    """Offline stand-in embedder: unit-norm signed hashing of word unigrams."""
+
+    _token_re = re.compile(r"[a-z0-9]+")
+
+    def __init__(self, size=384):
+        self.size = size
+
+    def _embed(self, text):
+        vector = np.zeros(self.size, dtype=np.float32)
+        for token in self._token_re.findall(text.lower()):
+            h = zlib.crc32(token.encode("utf-8"))
+            vector[h % self.size] += 1.0 if h & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+class OverlapReranker:
+    """Offline stand-in cross-encoder: scores pairs by query-term overlap."""
+
+    def predict(self, pairs, batch_size=32):
+        scores = []
+        for query, text in pairs:
+            query_terms = set(query.lower().split())
+            text_terms = text.lower().split()
+            scores.append(sum(t in query_terms for t in text_terms) / (1 + len(text_terms)) ** 0.5)
+        return np.asarray(scores, dtype=np.float32)
+
+
+def offline_models(prefer_real=True):
+    """(embeddings, reranker, description) using locally cached models, else the stand-ins."""
+    if prefer_real:
+        try:
+            from langchain_huggingface import HuggingFaceEmbeddings
+            from sentence_transformers import CrossEncoder
+            embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2",
+                                               model_kwargs={"local_files_only": True})
+            reranker = CrossEncoder("cross-encoder/ms-marco-MiniLM-L-6-v2", local_files_only=True)
+            return embeddings, reranker, "all-MiniLM-L6-v2 + ms-marco-MiniLM-L-6-v2"
+        except Exception:
+            pass
+    return HashingEmbeddings(), OverlapReranker(), "hashing + term-overlap stand-ins"
+
+
+class _BenchmarkPipeline(RAGPipeline):
+    """RAGPipeline with injected retrieval models and no generator."""
+
+    def __init__(self, store_path, embeddings, reranker):
+        self._bench_models = (embeddings, reranker)
+        super().__init__(store_path, answer_cache_size=0)
+
+    def _load_embeddings(self):
+        return self._bench_models[0]
+
+    def _load_reranker(self):
+        return self._bench_models[1]
+
+    def _load_tokenizer(self):
+        return None
+
+    def _load_model(self):
+        return None
+
+
+def _timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def _latencies(fn, items, repeat=3):
+    samples = []
+    for _ in range(repeat):
+        for item in items:
+            start = time.perf_counter()
+            fn(item)
+            samples.append((time.perf_counter() - start) * 1000)
+    return {"p50_ms": float(np.percentile(samples, 50)), "p99_ms": float(np.percentile(samples, 99))}
+
+
+def benchmark_scale(n_rows, workdir, embeddings, reranker, k=20, sample_size=None, seed=0):
+    """Time every stage on a synthetic corpus of ``n_rows`` complaints; returns {stage: {metric: value}}."""
+    raw = synthetic_complaints(n_rows, seed)
+    filtered, seconds = _timed(filter_data, raw)
+    results = {"filter_data": {"seconds": seconds, "rows_per_s": n_rows / seconds}}
+
+    cleaned, seconds = _timed(clean_texts, filtered["Consumer complaint narrative"], n_jobs=1)
+    filtered["cleaned_narrative"] = cleaned
+    results["clean_text"] = {"seconds": seconds, "rows_per_s": len(filtered) / seconds}
+
+    if sample_size is not None and sample_size < len(filtered):
+        filtered = filtered.sample(sample_size, random_state=seed)
+    docs, seconds = _timed(create_chunks, filtered)
+    results["create_chunks"] = {"seconds": seconds, "rows_per_s": len(filtered) / seconds}
+
+    store = os.path.join(workdir, f"store_{n_rows}")
+    _, seconds = _timed(build_vector_store, docs, store, embeddings)
+    results["build_vector_store"] = {"seconds": seconds, "chunks_per_s": len(docs) / seconds}
+
+    rag = _BenchmarkPipeline(store, embeddings, reranker)
+    questions = list(EVAL_QUESTIONS)
+    results["retrieval"] = _latencies(lambda q: rag._retrieve(q, k), questions)
+    candidates = {q: rag._retrieve_many([(q, k, None, None)], with_distances=True)[0] for q in questions}
+
+    def rerank(q):
+        rag.rerank_cache.clear()
+        labels, distances = candidates[q]
+        rag._rerank(q, labels, distances=distances)
+    results["rerank"] = _latencies(rerank, questions)
+    return results
+
+
+def run_benchmarks(scales=DEFAULT_SCALES, k=20, sample_size=DEFAULT_SAMPLE_SIZE, prefer_real=True, workdir=None,
+                   seed=0):
+    """Benchmark all scales; returns a JSON-serialisable report."""
+    embeddings, reranker, models = offline_models(prefer_real)
+    report = {"meta": {"models": models, "k": k, "sample_size": sample_size, "seed": seed,
+                       "timestamp": time.time()}, "results": {}}
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        for n_rows in scales:
+            print(f"Benchmarking {n_rows:,} rows ({models})...")
+            report["results"][str(n_rows)] = benchmark_scale(n_rows, tmp, embeddings, reranker, k, sample_size, seed)
+            for stage, metrics in report["results"][str(n_rows)].items():
+                print(f"  {stage:<20} " + "  ".join(f"{name}={value:,.3f}" for name, value in metrics.items()))
+    return report
+
+
+def _lower_is_better(metric):
+    return metric == "seconds" or metric.endswith("_ms")
+
+
+def compare(report, baseline, threshold=DEFAULT_THRESHOLD):
+    """Metrics that regressed by more than ``threshold`` (relative) against ``baseline``.
+
+    Returns a list of (scale, stage, metric, baseline value, current value).
+    Only scales and stages present in both reports are compared.
+    """
+    regressions = []
+    for scale, stages in report["results"].items():
+        for stage, metrics in stages.items():
+            base_metrics = baseline.get("results", {}).get(scale, {}).get(stage, {})
+            for metric, value in metrics.items():
+                base = base_metrics.get(metric)
+                if not base:
+                    continue
+                change = (value - base) / base if _lower_is_better(metric) else (base - value) / base
+                if change > threshold:
+                    regressions.append((scale, stage, metric, base, value))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline performance benchmarks on a synthetic complaint corpus.")
+    parser.add_argument("--scales", type=int, nargs="+", default=list(DEFAULT_SCALES))
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--sample-size", type=int, default=DEFAULT_SAMPLE_SIZE,
+                        help="Chunk and index at most this many complaints per scale (0: all of them).")
+    parser.add_argument("--stand-ins", action="store_true",
+                        help="Use the hashing embedder and term-overlap reranker even if real models are cached.")
+    parser.add_argument("--output", default="reports/benchmark.json")
+    parser.add_argument("--baseline", default=None, help="Earlier report to compare against.")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Fail when a metric is this much (relative) worse than the baseline.")
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.scales, args.k, args.sample_size or None, prefer_real=not args.stand_ins)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline["meta"].get("models") != report["meta"]["models"]:
+            print(f"Warning: baseline used {baseline['meta'].get('models')}, this run {report['meta']['models']}")
+        regressions = compare(report, baseline, args.threshold)
+        for scale, stage, metric, base, value in regressions:
+            print(f"REGRESSION {scale} {stage}.{metric}: {base:,.3f} -> {value:,.3f}")
+        if regressions:
+            raise SystemExit(1)
+        print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}")
@@ -0,0 +1,138 @@
+import json
+
+import requests
+from langchain_core.documents import Document
+
+try:
+    from .generation_pool import PipelineBusy
+except ImportError:
+    from generation_pool import PipelineBusy
+
+
+def _documents(sources):
+    documents = []
+    for s in sources:
+        metadata = {"complaint_id": s["complaint_id"], "product": s["product"], "sub_product": s["sub_product"]}
+        if s.get("source_ids"):
+            metadata["source_ids"] = s["source_ids"]
+        documents.append(Document(page_content=s["content"], metadata=metadata))
+    return documents
+
+
+def _sse_events(response):
+    """Yield (event, data) pairs from a server-sent-events response."""
+    event, data = None, []
+    for line in response.iter_lines(decode_unicode=True):
+        if line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+        elif not line and event is not None:
+            yield event, json.loads("\n".join(data))
+            event, data = None, []
+
+
+class RemoteStream:
+    """Token stream of a /stream response.
+
+    cancel() (or abandoning the iterator) closes the connection, which makes
+    the server stop the generation.
+    """
+
+    def __init__(self, response, events):
+        self.response = response
+        self.events = events
+
+    def cancel(self):
+        self.response.close()
+
+    def __iter__(self):
+        try:
+            for name, data in self.events:
+                if name == "token":
+                    yield data
+                elif name == "error":
+                    raise RuntimeError(data)
+        finally:
+            self.response.close()
+
+
+class RemoteRAG:
+    """Thin HTTP client for src/server.py with the RAGPipeline interface the app uses."""
+
+    def __init__(self, base_url="http://127.0.0.1:8000", timeout=300):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    @staticmethod
+    def _check(response):
+        # The server answers 503 when its queues are full, like a local pipeline raising PipelineBusy
+        if response.status_code == 503:
+            message = response.text or "server busy"
+            response.close()
+            raise PipelineBusy(message)
+        response.raise_for_status()
+        return response
+
+    def _get(self, path):
+        return self._check(self.session.get(self.base_url + path, timeout=self.timeout)).json()
+
+    def _post(self, path, payload, **kwargs):
+        return self._check(self.session.post(self.base_url + path, json=payload, timeout=self.timeout, **kwargs))
+
+    def health(self):
+        return self._get("/health")
+
+    def readiness(self):
+        return self.health()["readiness"]
+
+    def is_ready(self, *groups):
+        status = self.readiness()
+        return all(status[g] == "ready" for g in (groups or status))
+
+    @property
+    def load_times(self):
+        return self.health()["load_times"]
+
+    def embedding_cache_stats(self):
+        return self.health()["embedding_cache"]
+
+    def generation_stats(self):
+        return self.health()["generation_pool"]
+
+    def rerank_stats(self):
+        return self.health()["reranker"]
+
+    def latency_summary(self):
+        return self.health()["latency"]
+
+    def index_info(self):
+        return self.health()["index"]
+
+    def filter_options(self):
+        return self._get("/filters")
+
+    def generate(self, prompt, **kwargs):
+        return self._post("/generate", {"prompt": prompt, **kwargs}).json()["result"]
+
+    @staticmethod
+    def _payload(question, history, k, product, sub_product):
+        return {"question": question, "history": history, "k": k, "product": product, "sub_product": sub_product}
+
+    def answer_question(self, question, history="", k=20, product=None, sub_product=None):
+        body = self._post("/answer", self._payload(question, history, k, product, sub_product)).json()
+        return {"result": body["result"], "source_documents": _documents(body["sources"])}
+
+    def stream_answer(self, question, history="", k=20, product=None, sub_product=None):
+        """Same contract as RAGPipeline.stream_answer: (text stream with cancel(), source documents)."""
+        response = self._post("/stream", self._payload(question, history, k, product, sub_product), stream=True)
+        try:
+            events = _sse_events(response)
+            name, sources = next(events)
+            if name != "sources":
+                raise RuntimeError(f"Unexpected first event from server: {name}")
+        except BaseException:
+            response.close()
+            raise
+        return RemoteStream(response, events), _documents(sources)
@@ -0,0 +1,98 @@
+import zlib
+
+import numpy as np
+
+try:
+    from .lexical import tokenize
+except ImportError:
+    from lexical import tokenize
+
+# Hash arithmetic modulo a Mersenne prime; (a * x + b) stays below 2**62
+_PRIME = (1 << 31) - 1
+
+
+def shingles(text, n=3):
+    """Hashes of the word ``n``-grams of ``text``, normalized as for BM25 (no stopwords or masks)."""
+    words = tokenize(text) or text.lower().split() or [text]
+    grams = [" ".join(words[i:i + n]) for i in range(max(1, len(words) - n + 1))]
+    return np.fromiter({zlib.crc32(g.encode("utf-8")) % _PRIME for g in grams}, dtype=np.uint64)
+
+
+class MinHashDeduplicator:
+    """Streaming near-duplicate detection with MinHash signatures and LSH banding.
+
+    Each chunk gets a ``num_perm``-value MinHash signature of its word
+    shingles, split into ``bands`` bands. Chunks sharing a band with an
+    earlier representative are candidates, and a candidate whose signatures
+    agree on at least ``threshold`` of the values (the estimated Jaccard
+    similarity) is a duplicate of it. Only representatives are remembered,
+    so memory grows with the distinct chunks. Chunks are only compared
+    within the same ``group`` (e.g. product), so filters keep working.
+    """
+
+    def __init__(self, threshold=0.8, num_perm=128, bands=16, shingle_size=3, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.bands = bands
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, _PRIME, num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _PRIME, num_perm, dtype=np.uint64)
+        self._buckets = {}
+        self._signatures = []
+
+    def signature(self, text):
+        hashes = shingles(text, self.shingle_size)
+        return ((np.outer(self._a, hashes) + self._b[:, None]) % _PRIME).min(axis=1).astype(np.uint32)
+
+    def add(self, text, group=None):
+        """Register a chunk; returns the number of the representative it duplicates, or None.
+
+        Representatives are numbered 0, 1, ... in the order they were added.
+        """
+        signature = self.signature(text)
+        keys = [(group, band, part.tobytes()) for band, part in enumerate(np.split(signature, self.bands))]
+        candidates = {self._buckets[key] for key in keys if key in self._buckets}
+        best, best_similarity = None, self.threshold
+        for candidate in sorted(candidates):
+            similarity = float(np.mean(self._signatures[candidate] == signature))
+            if similarity >= best_similarity:
+                best, best_similarity = candidate, similarity
+        if best is not None:
+            return best
+        number = len(self._signatures)
+        self._signatures.append(signature)
+        for key in keys:
+            self._buckets.setdefault(key, number)
+        return None
+
+
+def dedup_documents(documents, duplicates, threshold=0.8, **minhash_kwargs):
+    """Yield the chunks of ``documents`` that are not near-duplicates of an earlier one.
+
+    Collapsed chunks are recorded in ``duplicates``, a dict filled as the
+    generator runs: {number of the yielded representative: [complaint ids of
+    its duplicates]}. Chunks are only merged within the same product and
+    sub-product. ``threshold=None`` yields every chunk.
+    """
+    dedup = MinHashDeduplicator(threshold, **minhash_kwargs) if threshold is not None else None
+    for doc in documents:
+        if dedup is not None:
+            group = (doc.metadata.get("product"), doc.metadata.get("sub_product"))
+            original = dedup.add(doc.page_content, group)
+            if original is not None:
+                duplicates.setdefault(original, []).append(doc.metadata.get("complaint_id", "N/A"))
+                continue
+        yield doc
+
+
+def with_sources(documents, duplicates):
+    """Add ``source_ids`` (own complaint id first) to the metadata of representatives that absorbed duplicates."""
+    for number, doc in enumerate(documents):
+        if number in duplicates:
+            own = doc.metadata.get("complaint_id", "N/A")
+            sources = [own] + [cid for cid in dict.fromkeys(duplicates[number]) if cid != own]
+            if len(sources) > 1:
+                doc.metadata = {**doc.metadata, "source_ids": sources}
+        yield doc
@@ -0,0 +1,355 @@
+import os
+import json
+from collections.abc import Mapping
+
+import numpy as np
+from langchain_community.docstore.base import Docstore
+from langchain_core.documents import Document
+
+DOCSTORE_DIR = "docstore"
+MISSING_ID = -1
+
+
+def _replace_file(path, write):
+    """Write a file next to ``path`` and atomically move it into place.
+
+    Readers that have the old file memory-mapped keep a valid mapping.
+    """
+    tmp_path = path + ".tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _save_array(path, array):
+    def write(tmp_path):
+        with open(tmp_path, "wb") as f:
+            np.save(f, array)
+    _replace_file(path, write)
+
+
+def _complaint_id_to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return MISSING_ID
+
+
+class ColumnarDocstore(Docstore):
+    """Read-only, memory-mapped docstore with one row per indexed chunk.
+
+    Row ``i`` holds the chunk stored under FAISS label ``i``. Chunk text lives
+    in one contiguous UTF-8 buffer addressed by an offsets array; product and
+    sub-product are dictionary-encoded integer columns and complaint ids an
+    int64 column. Everything is opened with mmap, so load time is constant
+    and worker processes share the same pages. Documents are only built on
+    demand, via document().
+
+    Layout of the directory::
+
+        meta.json        row count and the product/sub-product dictionaries
+        text.bin         concatenated chunk text
+        offsets.npy      int64[n + 1] byte offsets into text.bin
+        <column>.npy     one array per column in COLUMNS
+        sources.npy      int64 complaint ids of near-duplicate chunks collapsed into a row
+        source_offsets.npy  int64[n + 1] start of each row's slice of sources.npy
+    """
+
+    COLUMNS = {
+        "complaint_id": np.int64,
+        "chunk_no": np.int32,
+        "product": np.int32,
+        "sub_product": np.int32,
+    }
+    ENCODED = ("product", "sub_product")
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.n_rows = meta["n_rows"]
+        self.vocab = meta["vocab"]
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        text_path = os.path.join(path, "text.bin")
+        self._text = np.memmap(text_path, dtype=np.uint8, mode="r") if os.path.getsize(text_path) else np.empty(0, np.uint8)
+        self.columns = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in self.COLUMNS}
+        # Older stores (and builds without de-duplication) have no sources
+        sources_path = os.path.join(path, "sources.npy")
+        if os.path.exists(sources_path):
+            self.sources = np.load(sources_path, mmap_mode="r")
+            self.source_offsets = np.load(os.path.join(path, "source_offsets.npy"), mmap_mode="r")
+        else:
+            self.sources = self.source_offsets = None
+
+    def __len__(self):
+        return self.n_rows
+
+    def text(self, row):
+        start, end = self.offsets[row], self.offsets[row + 1]
+        return self._text[start:end].tobytes().decode("utf-8")
+
+    def doc_id(self, row):
+        cid = int(self.columns["complaint_id"][row])
+        return f"{cid if cid != MISSING_ID else 'N/A'}-{int(self.columns['chunk_no'][row])}"
+
+    def source_ids(self, row):
+        """Complaint ids of the near-duplicate chunks collapsed into ``row`` at index time."""
+        if self.sources is None or row + 1 >= len(self.source_offsets):
+            return []
+        start, end = self.source_offsets[row], self.source_offsets[row + 1]
+        return [str(cid) if cid != MISSING_ID else "N/A" for cid in self.sources[start:end].tolist()]
+
+    def metadata(self, row):
+        cid = int(self.columns["complaint_id"][row])
+        metadata = {
+            "complaint_id": str(cid) if cid != MISSING_ID else "N/A",
+            "product": self.vocab["product"][self.columns["product"][row]],
+            "sub_product": self.vocab["sub_product"][self.columns["sub_product"][row]],
+        }
+        duplicates = self.source_ids(row)
+        if duplicates:
+            metadata["source_ids"] = [metadata["complaint_id"]] + duplicates
+        return metadata
+
+    def document(self, row):
+        row = int(row)
+        return Document(id=self.doc_id(row), page_content=self.text(row), metadata=self.metadata(row))
+
+    def search(self, search):
+        """LangChain Docstore lookup by row number (the FAISS label)."""
+        row = int(search)
+        if not 0 <= row < self.n_rows:
+            return f"ID {search} not found."
+        return self.document(row)
+
+    @classmethod
+    def write(cls, path, documents, append=False):
+        """Write ``documents`` as rows of a docstore at ``path``; returns their row numbers.
+
+        With ``append`` the rows are added after the existing ones. Chunk text
+        is appended to text.bin in place; the (small) integer columns are
+        rewritten. Files are replaced atomically, so a process that has the
+        docstore open keeps reading the rows it knows about.
+        """
+        os.makedirs(path, exist_ok=True)
+        text_path = os.path.join(path, "text.bin")
+        if append and os.path.exists(os.path.join(path, "meta.json")):
+            existing = cls(path)
+            n_old, vocab = existing.n_rows, {k: list(v) for k, v in existing.vocab.items()}
+            offsets = [np.array(existing.offsets)]
+            columns = {name: [np.array(col)] for name, col in existing.columns.items()}
+            if existing.sources is not None:
+                sources, source_offsets = [np.array(existing.sources)], [np.array(existing.source_offsets)]
+            else:
+                sources, source_offsets = [], [np.zeros(n_old + 1, dtype=np.int64)]
+            del existing
+            # Drop any bytes left behind by an interrupted append
+            with open(text_path, "r+b") as f:
+                f.truncate(int(offsets[0][-1]))
+            write_path = text_path
+        else:
+            n_old, vocab = 0, {name: [] for name in cls.ENCODED}
+            offsets = [np.zeros(1, dtype=np.int64)]
+            columns = {name: [] for name in cls.COLUMNS}
+            sources, source_offsets = [], [np.zeros(1, dtype=np.int64)]
+            write_path = text_path + ".tmp"
+            open(write_path, "wb").close()
+
+        codes = {name: {v: i for i, v in enumerate(vocab[name])} for name in cls.ENCODED}
+        new_cols = {name: [] for name in cls.COLUMNS}
+        lengths, n_sources, new_sources = [], [], []
+        chunk_no = {}
+        with open(write_path, "ab") as f:
+            for doc in documents:
+                data = doc.page_content.encode("utf-8")
+                f.write(data)
+                lengths.append(len(data))
+
+                meta = doc.metadata
+                cid = meta.get("complaint_id", "N/A")
+                suffix = doc.id[len(cid) + 1:] if doc.id and doc.id.startswith(f"{cid}-") else ""
+                n = int(suffix) if suffix.isdigit() else chunk_no.get(cid, 0)
+                chunk_no[cid] = n + 1
+                new_cols["complaint_id"].append(_complaint_id_to_int(cid))
+                new_cols["chunk_no"].append(n)
+                duplicates = meta.get("source_ids", [])[1:]
+                new_sources.extend(_complaint_id_to_int(d) for d in duplicates)
+                n_sources.append(len(duplicates))
+                for name in cls.ENCODED:
+                    value = str(meta.get(name, "N/A"))
+                    if value not in codes[name]:
+                        codes[name][value] = len(vocab[name])
+                        vocab[name].append(value)
+                    new_cols[name].append(codes[name][value])
+
+        if write_path != text_path:
+            os.replace(write_path, text_path)
+
+        offsets.append(offsets[0][-1] + np.cumsum(lengths, dtype=np.int64))
+        _save_array(os.path.join(path, "offsets.npy"), np.concatenate(offsets))
+        for name, dtype in cls.COLUMNS.items():
+            _save_array(os.path.join(path, f"{name}.npy"),
+                        np.concatenate(columns[name] + [np.asarray(new_cols[name], dtype=dtype)]))
+        source_offsets.append(source_offsets[0][-1] + np.cumsum(n_sources, dtype=np.int64))
+        _save_array(os.path.join(path, "sources.npy"),
+                    np.concatenate(sources + [np.asarray(new_sources, dtype=np.int64)]))
+        _save_array(os.path.join(path, "source_offsets.npy"), np.concatenate(source_offsets))
+        n_rows = n_old + len(lengths)
+
+        def write_meta(tmp_path):
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"n_rows": n_rows, "vocab": vocab}, f)
+        _replace_file(os.path.join(path, "meta.json"), write_meta)
+        return np.arange(n_old, n_rows, dtype=np.int64)
+
+
+    @classmethod
+    def drop_sources(cls, path, complaint_ids):
+        """Remove ``complaint_ids`` (ints) from the near-duplicate sources of every row."""
+        existing = cls(path)
+        if existing.sources is None:
+            return
+        sources, source_offsets = np.array(existing.sources), np.array(existing.source_offsets)
+        del existing
+        keep = ~np.isin(sources, np.asarray(list(complaint_ids), dtype=np.int64))
+        if keep.all():
+            return
+        kept_before = np.concatenate([[0], np.cumsum(keep, dtype=np.int64)])
+        _save_array(os.path.join(path, "sources.npy"), sources[keep])
+        _save_array(os.path.join(path, "source_offsets.npy"), kept_before[source_offsets])
+
+class RowIds(Mapping):
+    """index_to_docstore_id for a ColumnarDocstore: FAISS label i maps to row i."""
+
+    def __init__(self, docstore):
+        self.docstore = docstore
+
+    def __getitem__(self, label):
+        if not 0 <= label < len(self.docstore):
+            raise KeyError(label)
+        return int(label)
+
+    def __iter__(self):
+        return iter(range(len(self.docstore)))
+
+    def __len__(self):
+        return len(self.docstore)
+
+
+class ChunkTokens:
+    """Per-row token counts (and optionally token ids) of docstore chunks.
+
+    Computed once at index time with the generator's tokenizer, so prompts
+    can be packed to a token budget without re-tokenizing chunk text.
+    Counts exclude special tokens. Rows follow the docstore; rows past
+    ``n_rows`` (added without tokenizing) have no entry.
+
+    Layout of the directory::
+
+        meta.json        tokenizer name, row count and token id dtype
+        counts.npy       int32[n] tokens per chunk
+        ids.bin          concatenated token ids (optional)
+        id_offsets.npy   int64[n + 1] offsets into ids.bin (with ids.bin)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.tokenizer_name = meta["tokenizer"]
+        self.n_rows = meta["n_rows"]
+        self.counts = np.load(os.path.join(path, "counts.npy"), mmap_mode="r")
+        self.has_ids = meta["id_dtype"] is not None
+        if self.has_ids:
+            self.id_offsets = np.load(os.path.join(path, "id_offsets.npy"), mmap_mode="r")
+            ids_path = os.path.join(path, "ids.bin")
+            dtype = np.dtype(meta["id_dtype"])
+            self._ids = np.memmap(ids_path, dtype=dtype, mode="r") if os.path.getsize(ids_path) else np.empty(0, dtype)
+
+    def __len__(self):
+        return self.n_rows
+
+    def count(self, row):
+        """Token count of a row, or None if it was not tokenized."""
+        return int(self.counts[row]) if 0 <= row < self.n_rows else None
+
+    def ids(self, row):
+        """Token ids of a row, or None if ids were not stored for it."""
+        if not self.has_ids or not 0 <= row < self.n_rows:
+            return None
+        return np.array(self._ids[self.id_offsets[row]:self.id_offsets[row + 1]])
+
+    @classmethod
+    def write(cls, path, texts, tokenizer, tokenizer_name, with_ids=False, append=False, batch_size=1024):
+        """Tokenize ``texts`` (in docstore row order) into a directory at ``path``.
+
+        With ``append`` the rows are added after the existing ones; whether
+        ids are stored is then taken from the existing directory.
+        """
+        os.makedirs(path, exist_ok=True)
+        ids_path = os.path.join(path, "ids.bin")
+        if append and os.path.exists(os.path.join(path, "meta.json")):
+            existing = cls(path)
+            n_old, with_ids = existing.n_rows, existing.has_ids
+            counts = [np.array(existing.counts)]
+            id_offsets = [np.array(existing.id_offsets)] if with_ids else None
+            del existing
+        else:
+            n_old, counts = 0, []
+            id_offsets = [np.zeros(1, dtype=np.int64)] if with_ids else None
+            if os.path.exists(ids_path):
+                os.remove(ids_path)
+        id_dtype = ("uint16" if len(tokenizer) <= 65536 else "int32") if with_ids else None
+        if with_ids:
+            # Drop any ids left behind by an interrupted append
+            with open(ids_path, "ab") as f:
+                f.truncate(int(id_offsets[0][-1]) * np.dtype(id_dtype).itemsize)
+
+        texts = list(texts)
+        new_counts = []
+        for start in range(0, len(texts), batch_size):
+            batch = tokenizer(texts[start:start + batch_size], add_special_tokens=False)["input_ids"]
+            new_counts.extend(len(ids) for ids in batch)
+            if with_ids:
+                with open(ids_path, "ab") as f:
+                    for ids in batch:
+                        f.write(np.asarray(ids, dtype=id_dtype).tobytes())
+
+        counts.append(np.asarray(new_counts, dtype=np.int32))
+        _save_array(os.path.join(path, "counts.npy"), np.concatenate(counts))
+        if with_ids:
+            id_offsets.append(id_offsets[0][-1] + np.cumsum(new_counts, dtype=np.int64))
+            _save_array(os.path.join(path, "id_offsets.npy"), np.concatenate(id_offsets))
+        n_rows = n_old + len(new_counts)
+
+        def write_meta(tmp_path):
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"tokenizer": tokenizer_name, "n_rows": n_rows, "id_dtype": id_dtype}, f)
+        _replace_file(os.path.join(path, "meta.json"), write_meta)
+
+    @classmethod
+    def take(cls, path, rows):
+        """Keep only ``rows`` (ascending), renumbered from 0, without re-tokenizing."""
+        existing = cls(path)
+        rows = np.asarray(rows, dtype=np.int64)
+        rows = rows[rows < existing.n_rows]
+        counts = np.array(existing.counts[rows])
+        id_dtype = None
+        if existing.has_ids:
+            ids, old_offsets = existing._ids, existing.id_offsets
+            id_dtype = ids.dtype.name
+
+            def write_ids(tmp_path):
+                with open(tmp_path, "wb") as f:
+                    for row in rows:
+                        f.write(ids[old_offsets[row]:old_offsets[row + 1]].tobytes())
+            _replace_file(os.path.join(path, "ids.bin"), write_ids)
+            id_offsets = np.concatenate([[0], np.cumsum(counts, dtype=np.int64)])
+            _save_array(os.path.join(path, "id_offsets.npy"), id_offsets)
+        _save_array(os.path.join(path, "counts.npy"), counts)
+        tokenizer_name = existing.tokenizer_name
+        del existing
+
+        def write_meta(tmp_path):
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"tokenizer": tokenizer_name, "n_rows": len(rows), "id_dtype": id_dtype}, f)
+        _replace_file(os.path.join(path, "meta.json"), write_meta)
@@ -0,0 +1,220 @@
+import os
+import json
+import hashlib
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends are only serialized within this process
+    fcntl = None
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+DEFAULT_CACHE_DIR = "vector_store/embedding_cache"
+KEY_BYTES = 20  # sha1 digest
+
+
+class CachedEmbeddings(Embeddings):
+    """Content-addressed embedding cache wrapped around another Embeddings.
+
+    Vectors are keyed by a hash of (kind, text) and stored per model in an
+    append-only float32 matrix that is memory-mapped for reads, with a
+    bounded in-memory LRU in front of it. Documents and queries are cached
+    separately because some models embed them differently.
+    """
+
+    def __init__(self, base, model_name, cache_dir=DEFAULT_CACHE_DIR, lru_size=10_000, read_only=False):
+        self.base = base
+        self.read_only = read_only
+        self.model_name = model_name
+        self.lru_size = lru_size
+        self.dir = os.path.join(cache_dir, model_name.replace("/", "__"))
+        self._vectors_path = os.path.join(self.dir, "vectors.f32")
+        self._keys_path = os.path.join(self.dir, "keys.bin")
+        self._meta_path = os.path.join(self.dir, "meta.json")
+        self._lock_path = os.path.join(self.dir, "lock")
+
+        self._lock = threading.Lock()
+        self._lru = OrderedDict()
+        self._rows = {}
+        self._n_rows = 0
+        self._dim = None
+        self._mmap = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        os.makedirs(self.dir, exist_ok=True)
+        if not os.path.exists(self._meta_path):
+            return
+        with open(self._meta_path, encoding="utf-8") as f:
+            self._dim = json.load(f)["dim"]
+        with self._file_lock():
+            self._sync()
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive lock on the cache files, shared with other processes using the same cache."""
+        with open(self._lock_path, "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _sync(self):
+        """Index the rows on disk that this instance has not seen yet; returns the row count.
+
+        An interrupted append can leave keys and vectors out of step, so
+        both files are truncated to the rows that are complete in each
+        before anything is appended after them. Call with the file lock held.
+        """
+        key_size = os.path.getsize(self._keys_path) if os.path.exists(self._keys_path) else 0
+        vector_size = os.path.getsize(self._vectors_path) if os.path.exists(self._vectors_path) else 0
+        n = min(key_size // KEY_BYTES, vector_size // (4 * self._dim))
+        for path, size, row_bytes in ((self._keys_path, key_size, KEY_BYTES),
+                                      (self._vectors_path, vector_size, 4 * self._dim)):
+            if size > n * row_bytes:
+                os.truncate(path, n * row_bytes)
+        known = self._n_rows
+        if n > known:
+            with open(self._keys_path, "rb") as f:
+                f.seek(known * KEY_BYTES)
+                keys = f.read((n - known) * KEY_BYTES)
+            for i in range(n - known):
+                self._rows.setdefault(keys[i * KEY_BYTES:(i + 1) * KEY_BYTES], known + i)
+        self._n_rows = n
+        return n
+
+    def _key(self, kind, text):
+        return hashlib.sha1(f"{kind}\x00{text}".encode("utf-8")).digest()
+
+    def _read_row(self, row):
+        if self._mmap is None or row >= self._mmap.shape[0]:
+            self._mmap = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(self._n_rows, self._dim))
+        return np.array(self._mmap[row])
+
+    def _remember(self, key, vector):
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def _append(self, keys, vectors):
+        with self._file_lock():
+            if self._dim is None:
+                if os.path.exists(self._meta_path):
+                    with open(self._meta_path, encoding="utf-8") as f:
+                        self._dim = json.load(f)["dim"]
+                else:
+                    self._dim = vectors.shape[1]
+                    with open(self._meta_path, "w", encoding="utf-8") as f:
+                        json.dump({"model_name": self.model_name, "dim": self._dim}, f)
+            # Rows are numbered from the file itself: another process may have appended since
+            start = self._sync()
+            first = {}
+            for i, key in enumerate(keys):
+                if key not in self._rows:
+                    first.setdefault(key, i)
+            new = list(first.values())
+            if not new:
+                return
+            with open(self._vectors_path, "ab") as f:
+                f.write(np.ascontiguousarray(vectors[new], dtype=np.float32).tobytes())
+            with open(self._keys_path, "ab") as f:
+                f.write(b"".join(keys[i] for i in new))
+            for row, i in enumerate(new, start):
+                self._rows[keys[i]] = row
+            self._n_rows = start + len(new)
+
+    def _embed(self, kind, texts, compute):
+        keys = [self._key(kind, t) for t in texts]
+        results = [None] * len(texts)
+        missing = OrderedDict()
+
+        with self._lock:
+            for i, key in enumerate(keys):
+                if key in self._lru:
+                    self._lru.move_to_end(key)
+                    results[i] = self._lru[key]
+                    self.memory_hits += 1
+                elif key in self._rows:
+                    results[i] = self._read_row(self._rows[key])
+                    self._remember(key, results[i])
+                    self.disk_hits += 1
+                else:
+                    missing.setdefault(key, []).append(i)
+
+        if missing:
+            miss_keys = list(missing)
+            miss_texts = [texts[missing[k][0]] for k in miss_keys]
+            vectors = np.asarray(compute(miss_texts), dtype=np.float32)
+            with self._lock:
+                self.misses += len(miss_keys)
+                new = [(k, v) for k, v in zip(miss_keys, vectors) if k not in self._rows]
+                if new and not self.read_only:
+                    self._append([k for k, _ in new], np.stack([v for _, v in new]))
+                for key, vector in zip(miss_keys, vectors):
+                    self._remember(key, vector)
+                    for i in missing[key]:
+                        results[i] = vector
+
+        return [r.tolist() for r in results]
+
+    def store_documents(self, texts, vectors):
+        """Cache document vectors computed elsewhere, such as by worker processes."""
+        keys = [self._key("d", t) for t in texts]
+        with self._lock:
+            self._append(keys, np.asarray(vectors, dtype=np.float32))
+
+    def embed_documents(self, texts):
+        return self._embed("d", texts, self.base.embed_documents)
+
+    def embed_query(self, text):
+        return self._embed("q", [text], lambda ts: [self.base.embed_query(t) for t in ts])[0]
+
+    def embed_queries(self, texts):
+        """Embed several queries, computing all cache misses in one batch.
+
+        Misses go through embed_documents, which for the sentence-transformers
+        models used here produces the same vectors as embed_query.
+        """
+        return self._embed("q", texts, self.base.embed_documents)
+
+    def stats(self):
+        """Hit/miss counters for the cache."""
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "cached_vectors": len(self._rows),
+        }
+
+
+def cached_embeddings(model_name="all-MiniLM-L6-v2", cache_dir=DEFAULT_CACHE_DIR, lru_size=10_000,
+                      quantize=False):
+    """HuggingFace embeddings behind the shared on-disk cache.
+
+    With ``quantize`` the encoder runs int8-quantized; its vectors differ
+    slightly from fp32 ones, so they are cached under a separate name.
+    """
+    from langchain_huggingface import HuggingFaceEmbeddings
+    base = HuggingFaceEmbeddings(model_name=model_name)
+    if quantize:
+        try:
+            from .quantization import quantize_int8
+        except ImportError:
+            from quantization import quantize_int8
+        quantize_int8(getattr(base, "_client", None) or base.client)
+        model_name = f"{model_name}-int8"
+    return CachedEmbeddings(base, model_name, cache_dir=cache_dir, lru_size=lru_size)
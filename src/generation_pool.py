@@ -0,0 +1,143 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PipelineBusy(RuntimeError):
+    """Too many generations are already waiting; try again shortly."""
+
+
+class GenerationHandle:
+    """Cancel handle and deadline for one queued or running generation."""
+
+    def __init__(self, timeout=None):
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.future = None
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def expired(self):
+        return self.deadline is not None and time.monotonic() > self.deadline
+
+    def should_stop(self):
+        return self.cancelled or self.expired
+
+    def result(self, timeout=None):
+        return self.future.result(timeout)
+
+
+class BatchHandle(GenerationHandle):
+    """Handle for one batched generate() call; it stops once every request in the batch has stopped."""
+
+    def __init__(self, handles):
+        super().__init__()
+        self.handles = handles
+
+    def cancel(self):
+        for handle in self.handles:
+            handle.cancel()
+
+    @property
+    def cancelled(self):
+        return all(handle.cancelled for handle in self.handles)
+
+    @property
+    def expired(self):
+        return not self.cancelled and all(handle.should_stop() for handle in self.handles)
+
+
+class StopOnHandle:
+    """generate() stopping criterion that ends generation once its handle is cancelled or expired.
+
+    Given one handle per prompt of a batched generate(), each prompt's rows stop on its own handle.
+    """
+
+    def __init__(self, *handles):
+        self.handles = handles
+
+    def __call__(self, input_ids, scores, **kwargs):
+        import torch
+        stop = torch.tensor([handle.should_stop() for handle in self.handles], dtype=torch.bool)
+        return stop.repeat_interleave(input_ids.shape[0] // len(stop)).to(input_ids.device)
+
+
+class GenerationPool:
+    """Fixed-size executor for generate() calls with queue-depth accounting.
+
+    At most ``workers`` generations run at once; at most ``max_pending``
+    may wait for a worker, beyond which submit() raises PipelineBusy.
+    Requests cancelled or past their deadline while still queued are
+    skipped without touching the model.
+    """
+
+    def __init__(self, workers=1, max_pending=8):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rag-generate")
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.expired = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def submit(self, generate, handle, on_abort=None):
+        """Run ``generate()`` on a worker; ``on_abort()`` runs if it is skipped or fails."""
+        with self._lock:
+            if self.queued >= self.max_pending:
+                self.rejected += 1
+                raise PipelineBusy(f"{self.queued} generations already queued")
+            self.queued += 1
+
+        def run():
+            with self._lock:
+                self.queued -= 1
+                self.in_flight += 1
+            failed = False
+            try:
+                if handle.should_stop():
+                    if on_abort:
+                        on_abort()
+                    return None
+                return generate()
+            except Exception:
+                failed = True
+                if on_abort:
+                    on_abort()
+                raise
+            finally:
+                with self._lock:
+                    self.in_flight -= 1
+                    if failed:
+                        self.failed += 1
+                    elif handle.cancelled:
+                        self.cancelled += 1
+                    elif handle.expired:
+                        self.expired += 1
+                    else:
+                        self.completed += 1
+
+        handle.future = self._executor.submit(run)
+        return handle
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queued": self.queued,
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "cancelled": self.cancelled,
+                "expired": self.expired,
+                "failed": self.failed,
+                "rejected": self.rejected,
+            }
@@ -1,86 +1,884 @@
 import pandas as pd
 import numpy as np
-from sklearn.model_selection import train_test_split
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_community.vectorstores import FAISS
 from langchain_core.documents import Document
+import faiss
 import os
+import argparse
+import json
+import hashlib
+import shutil
 
-def load_and_sample(file_path, sample_size=12000):
-    """Load filtered complaints and perform stratified sampling."""
-    print("Loading filtered data...")
-    df = pd.read_csv(file_path)
-    
-    print(f"Total available records: {len(df)}")
-    
-    # Stratified sampling
-    # We want sample_size total. We use train_test_split as a convenient way to stratify.
-    _, df_sample = train_test_split(
-        df, 
-        test_size=sample_size / len(df), 
-        stratify=df['Product'], 
-        random_state=42
-    )
+try:
+    from .embedding_cache import CachedEmbeddings, DEFAULT_CACHE_DIR, cached_embeddings
+    from .docstore import (ColumnarDocstore, ChunkTokens, RowIds, DOCSTORE_DIR, MISSING_ID, _complaint_id_to_int,
+                           _replace_file, _save_array)
+    from .lexical import BM25Index, LEXICAL_DIR
+    from .dedup import dedup_documents, with_sources
+    from .snapshots import prepare_snapshot, publish_snapshot
+    from .analytics import analytics_path, index_statistics, write_analytics
+except ImportError:
+    from embedding_cache import CachedEmbeddings, DEFAULT_CACHE_DIR, cached_embeddings
+    from docstore import (ColumnarDocstore, ChunkTokens, RowIds, DOCSTORE_DIR, MISSING_ID, _complaint_id_to_int,
+                          _replace_file, _save_array)
+    from lexical import BM25Index, LEXICAL_DIR
+    from dedup import dedup_documents, with_sources
+    from snapshots import prepare_snapshot, publish_snapshot
+    from analytics import analytics_path, index_statistics, write_analytics
+
+MANIFEST_NAME = "manifest.json"
+TOKENS_DIR = "tokens"
+# Estimated Jaccard similarity above which chunks are collapsed at index time
+DEDUP_THRESHOLD = 0.8
+# Prompts are packed for this model's tokenizer (see RAGPipeline)
+GENERATOR_MODEL_ID = "google/flan-t5-small"
+
+# ANN index types offered by build_vector_store. "flat" is exact search;
+# the others trade a little recall for sub-linear query cost.
+INDEX_TYPES = ("flat", "ivf", "hnsw", "ivfpq")
+# Vector storage for flat/ivf/hnsw: full floats, half floats or 8-bit scalar quantization
+STORAGE_TYPES = {"fp32": None, "fp16": "SQfp16", "int8": "SQ8"}
+
+QUOTAS = ("proportional", "capped")
+# Incremental updates compact the store once superseded rows exceed this share of the docstore
+COMPACT_RATIO = 0.25
+# BM25 segments appended by incremental updates before the postings are rebuilt in one piece
+MAX_LEXICAL_SEGMENTS = 16
+
+def iter_frames(file_path, chunksize=100_000):
+    """Yield a CSV, Parquet or Arrow/Feather file as DataFrames of at most ``chunksize`` rows.
+
+    Each frame is indexed by the rows' positions in the file.
+    """
+    start = 0
+    if file_path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        frames = (batch.to_pandas() for batch in pq.ParquetFile(file_path).iter_batches(batch_size=chunksize))
+    elif file_path.endswith(('.arrow', '.feather')):
+        import pyarrow as pa
+        reader = pa.ipc.open_file(file_path)
+        frames = (reader.get_batch(i).to_pandas() for i in range(reader.num_record_batches))
+    else:
+        frames = pd.read_csv(file_path, chunksize=chunksize, low_memory=False)
+    for frame in frames:
+        frame.index = pd.RangeIndex(start, start + len(frame))
+        start += len(frame)
+        yield frame
+
+def _proportional_quotas(counts, sample_size):
+    """Largest-remainder allocation of ``sample_size`` over products, at least one row each."""
+    total = sum(counts.values())
+    if total <= sample_size:
+        return dict(counts)
+    products = sorted(counts)
+    exact = np.array([sample_size * counts[p] / total for p in products])
+    quotas = np.floor(exact).astype(int)
+    for i in np.argsort(-(exact - quotas), kind="stable")[:sample_size - quotas.sum()]:
+        quotas[i] += 1
+    # Rare products keep one row, taken from the largest quotas
+    if len(products) <= sample_size:
+        for i in np.flatnonzero(quotas == 0):
+            quotas[np.argmax(quotas)] -= 1
+            quotas[i] = 1
+    return {p: int(q) for p, q in zip(products, quotas)}
+
+class ProductReservoirs:
+    """Seeded bottom-k reservoirs per product, filled one DataFrame at a time.
+
+    Every row gets a seeded uniform random key and each product keeps only
+    the rows with the smallest keys, so a product's quota is taken from a
+    uniform sample of it. A reservoir never holds more rows than its product
+    can end up with: ``sample_size`` for "proportional", and for "capped"
+    ``max_per_product`` or, by default, ``sample_size`` divided by the
+    products seen so far (which can only shrink). len() is the number of
+    rows held.
+    """
+
+    def __init__(self, sample_size=12000, quota="proportional", max_per_product=None, seed=42,
+                 stratify="Product"):
+        if quota not in QUOTAS:
+            raise ValueError(f"Unknown quota {quota!r}; choose from {QUOTAS}")
+        self.sample_size = sample_size
+        self.quota = quota
+        self.max_per_product = max_per_product
+        self.stratify = stratify
+        self._rng = np.random.default_rng(seed)
+        self.reservoirs, self.counts = {}, {}
+
+    def __len__(self):
+        return sum(len(part) for part in self.reservoirs.values())
+
+    def capacity(self):
+        if self.quota == "proportional":
+            return self.sample_size
+        return self.max_per_product or max(1, int(np.ceil(self.sample_size / max(1, len(self.counts)))))
+
+    def update(self, frame):
+        keys = pd.Series(self._rng.random(len(frame)), index=frame.index)
+        groups = frame.groupby(self.stratify, sort=False).groups
+        for product, rows in groups.items():
+            self.counts[product] = self.counts.get(product, 0) + len(rows)
+        capacity = self.capacity()
+        for product, rows in groups.items():
+            part = frame.loc[rows].assign(_key=keys[rows])
+            if product in self.reservoirs:
+                part = pd.concat([self.reservoirs[product], part])
+            self.reservoirs[product] = part
+        # New products lower the default cap, so earlier reservoirs are trimmed as well
+        for product, part in self.reservoirs.items():
+            if len(part) > capacity:
+                self.reservoirs[product] = part.nsmallest(capacity, "_key")
+        return self
+
+    def sample(self):
+        """The sample in random order."""
+        if not self.reservoirs:
+            return pd.DataFrame()
+        if self.quota == "proportional":
+            quotas = _proportional_quotas(self.counts, self.sample_size)
+        else:
+            quotas = {product: min(n, self.capacity()) for product, n in self.counts.items()}
+        sample = pd.concat([self.reservoirs[p].nsmallest(quotas[p], "_key") for p in sorted(self.reservoirs)])
+        return sample.sort_values("_key").drop(columns="_key")
+
+def stratified_sample(frames, sample_size=12000, quota="proportional", max_per_product=None,
+                      seed=42, stratify="Product"):
+    """Single-pass stratified sample from an iterable of DataFrames.
+
+    Memory is bounded by the per-product reservoirs (see ProductReservoirs),
+    not the input. ``quota`` is "proportional" (``sample_size`` split by
+    product share, every product keeping at least one row) or "capped" (up
+    to ``max_per_product`` rows per product, default ``sample_size`` divided
+    evenly). The result is in random order.
+    """
+    reservoirs = ProductReservoirs(sample_size, quota, max_per_product, seed, stratify)
+    for frame in frames:
+        reservoirs.update(frame)
+    return reservoirs.sample()
+
+def load_and_sample(file_path, sample_size=12000, quota="proportional", max_per_product=None,
+                    seed=42, chunksize=100_000):
+    """Stream filtered complaints and draw a stratified sample (see stratified_sample)."""
+    print("Streaming filtered data...")
+    counter = {"rows": 0}
+
+    def frames():
+        for frame in iter_frames(file_path, chunksize):
+            counter["rows"] += len(frame)
+            yield frame
+
+    df_sample = stratified_sample(frames(), sample_size, quota, max_per_product, seed)
+    print(f"Total available records: {counter['rows']}")
     
     print(f"Sampled {len(df_sample)} records across products:")
     print(df_sample['Product'].value_counts())
     
     return df_sample
 
-def create_chunks(df_sample, chunk_size=500, chunk_overlap=50):
-    """Split narratives into chunks using LangChain."""
-    print(f"Creating chunks (size={chunk_size}, overlap={chunk_overlap})...")
-    text_splitter = RecursiveCharacterTextSplitter(
+def _splitter(chunk_size=500, chunk_overlap=50):
+    return RecursiveCharacterTextSplitter(
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,
         length_function=len,
         separators=["\n\n", "\n", " ", ""]
     )
-    
-    documents = []
-    for _, row in df_sample.iterrows():
+
+def iter_chunks(df_sample, chunk_size=500, chunk_overlap=50):
+    """Yield the chunk Documents of ``df_sample`` lazily, complaint by complaint.
+
+    Columns are read as whole arrays rather than row by row, and narratives
+    that already fit in one chunk skip the text splitter.
+    """
+    text_splitter = _splitter(chunk_size, chunk_overlap)
+    ids = df_sample['Complaint ID'].astype(str) if 'Complaint ID' in df_sample else pd.Series('N/A', index=df_sample.index)
+    sub_products = df_sample['Sub-product'].astype(str) if 'Sub-product' in df_sample else pd.Series('N/A', index=df_sample.index)
+    narratives = df_sample['cleaned_narrative']
+    # Use the cleaned_narrative column from Task 1; skip empty ones up front
+    keep = (narratives.notna() & (narratives != "")).to_numpy()
+    for complaint_id, product, sub_product, narrative in zip(
+        ids.to_numpy()[keep], df_sample['Product'].to_numpy()[keep],
+        sub_products.to_numpy()[keep], narratives.to_numpy()[keep]
+    ):
         # metadata includes original ID and product
-        metadata = {
-            "complaint_id": str(row.get('Complaint ID', 'N/A')),
-            "product": row['Product'],
-            "sub_product": str(row.get('Sub-product', 'N/A'))
-        }
-        
-        # Use the cleaned_narrative column from Task 1
-        narrative = row['cleaned_narrative']
-        if pd.isna(narrative) or narrative == "":
-            continue
-            
-        chunks = text_splitter.split_text(narrative)
-        for chunk in chunks:
-            documents.append(Document(page_content=chunk, metadata=metadata))
-            
+        metadata = {"complaint_id": complaint_id, "product": product, "sub_product": sub_product}
+        if len(narrative) <= chunk_size:
+            chunks = [narrative.strip()] if narrative.strip() else []
+        else:
+            chunks = text_splitter.split_text(narrative)
+        for i, chunk in enumerate(chunks):
+            # Stable ids let incremental updates find and replace a complaint's chunks
+            doc_id = chunk_id(complaint_id, i) if complaint_id != 'N/A' else None
+            yield Document(id=doc_id, page_content=chunk, metadata=metadata)
+
+def create_chunks(df_sample, chunk_size=500, chunk_overlap=50):
+    """Split narratives into chunks using LangChain."""
+    print(f"Creating chunks (size={chunk_size}, overlap={chunk_overlap})...")
+    documents = list(iter_chunks(df_sample, chunk_size, chunk_overlap))
     print(f"Generated {len(documents)} document chunks.")
     return documents
 
-def build_vector_store(documents, store_path="vector_store/faiss_index"):
-    """Generate embeddings and build FAISS index."""
-    print("Initializing embedding model (all-MiniLM-L6-v2)...")
-    embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+def chunk_id(complaint_id, i):
+    """Docstore id of the i-th chunk of a complaint."""
+    return f"{complaint_id}-{i}"
+
+def content_hashes(df, chunk_size=500, chunk_overlap=50):
+    """Hash everything that determines a complaint's chunks, keyed by Complaint ID."""
+    params = f"{chunk_size}|{chunk_overlap}"
+    hashes = {}
+    for cid, product, sub_product, narrative in zip(
+        df['Complaint ID'].astype(str),
+        df['Product'].astype(str),
+        df.get('Sub-product', pd.Series('N/A', index=df.index)).astype(str),
+        df['cleaned_narrative'].fillna("")
+    ):
+        key = "\x1f".join([params, product, sub_product, narrative])
+        hashes[cid] = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    return hashes
+
+def load_manifest(store_path):
+    """Read the {complaint_id: [content_hash, n_chunks]} manifest next to the index."""
+    manifest_path = os.path.join(store_path, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, encoding="utf-8") as f:
+        return json.load(f)
+
+def write_manifest(store_path, hashes, documents, chunk_size=500, chunk_overlap=50, base=None):
+    """Record content hashes and chunk counts for the complaints in ``documents``.
+
+    ``base`` is an existing manifest to update; complaints already in it keep
+    their entry unless they appear in ``hashes``.
+    """
+    complaints = dict(base["complaints"]) if base else {}
+    n_chunks = {}
+    for doc in documents:
+        # A de-duplicated chunk also counts for the complaints it absorbed
+        for cid in doc.metadata.get("source_ids") or [doc.metadata.get("complaint_id", "N/A")]:
+            n_chunks[cid] = n_chunks.get(cid, 0) + 1
+    for cid, n in n_chunks.items():
+        if cid in hashes:
+            complaints[cid] = [hashes[cid], n]
+
+    manifest = {"chunk_size": chunk_size, "chunk_overlap": chunk_overlap, "complaints": complaints}
+    manifest_path = os.path.join(store_path, MANIFEST_NAME)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+    return manifest
+
+def index_factory_string(dim, n_vectors, index_type="flat", storage="fp32", nlist=None, hnsw_m=32, pq_m=None):
+    """Translate an index type and storage choice into a FAISS index_factory string."""
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {index_type!r}; choose from {INDEX_TYPES}")
+    if storage not in STORAGE_TYPES:
+        raise ValueError(f"Unknown storage {storage!r}; choose from {tuple(STORAGE_TYPES)}")
+    codec = STORAGE_TYPES[storage]
+
+    if nlist is None:
+        # ~4*sqrt(n) lists, but keep at least ~39 training points per list
+        nlist = max(1, min(int(4 * np.sqrt(n_vectors)), n_vectors // 39))
+
+    if index_type == "flat":
+        return codec or "Flat"
+    if index_type == "ivf":
+        return f"IVF{nlist},{codec or 'Flat'}"
+    if index_type == "hnsw":
+        return f"HNSW{hnsw_m}_{codec}" if codec else f"HNSW{hnsw_m}"
+    # ivfpq: product quantization already compresses the vectors
+    if pq_m is None:
+        pq_m = next(m for m in (48, 32, 24, 16, 12, 8, 4, 2, 1) if dim % m == 0)
+    # 8-bit codebooks need ~10k training points; use smaller ones for small corpora
+    pq_bits = int(max(1, min(8, np.log2(max(2, n_vectors // 39)))))
+    return f"IVF{nlist},PQ{pq_m}x{pq_bits}"
+
+def make_faiss_index(vectors, index_type="flat", storage="fp32", ids=None, **index_kwargs):
+    """Build, train and fill a FAISS index over an (n, dim) float32 matrix.
+
+    The index is wrapped in an IndexIDMap2 so labels stay stable (row ``i``
+    of the docstore by default) when vectors are later removed or added.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n_vectors, dim = vectors.shape
+    spec = index_factory_string(dim, n_vectors, index_type, storage, **index_kwargs)
+    base = faiss.index_factory(dim, spec)
+    if not base.is_trained:
+        base.train(vectors)
+    index = faiss.IndexIDMap2(base)
+    index.add_with_ids(vectors, np.arange(n_vectors, dtype=np.int64) if ids is None else ids)
+    return index
+
+def unwrap_index(index):
+    """The underlying ANN index of a (possibly id-mapped) FAISS index."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        index = faiss.downcast_index(index.index)
+    return index
+
+def selector_bitmap(docstore, product=None, sub_product=None):
+    """Bitmap over docstore rows (FAISS labels) matching a product/sub-product filter.
+
+    Each filter may be a single value or a list of values. Returns the
+    little-endian packed bitmap expected by faiss.IDSelectorBitmap and the
+    number of matching rows.
+    """
+    mask = np.ones(len(docstore), dtype=bool)
+    for name, wanted in (("product", product), ("sub_product", sub_product)):
+        if wanted is None:
+            continue
+        if isinstance(wanted, str):
+            wanted = [wanted]
+        vocab = docstore.vocab[name]
+        codes = [vocab.index(v) for v in wanted if v in vocab]
+        mask &= np.isin(docstore.columns[name], codes)
+    return np.packbits(mask, bitorder="little"), int(mask.sum())
+
+def filtered_search_params(index, bitmap, n_rows):
+    """SearchParameters restricting a search to the rows set in ``bitmap``.
+
+    The index's current nprobe/efSearch are carried over, since per-call
+    parameters replace the index-level ones.
+    """
+    selector = faiss.IDSelectorBitmap(n_rows, faiss.swig_ptr(bitmap))
+    base = unwrap_index(index)
+    if isinstance(base, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=base.nprobe)
+    elif isinstance(base, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=base.hnsw.efSearch)
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    # The selector only points at the bitmap; keep both alive with the params
+    params.referenced_objects = [selector, bitmap]
+    return params
+
+def filter_options(docstore):
+    """{product: [sub_products]} present in the docstore, for filter selectors."""
+    pairs = np.unique(np.stack([docstore.columns["product"], docstore.columns["sub_product"]], axis=1), axis=0)
+    options = {}
+    for product_code, sub_code in pairs:
+        product = docstore.vocab["product"][product_code]
+        options.setdefault(product, []).append(docstore.vocab["sub_product"][sub_code])
+    return {product: sorted(subs) for product, subs in sorted(options.items())}
+
+def index_version(store_path):
+    """Identifier that changes whenever the saved index is rewritten."""
+    index_file = os.path.join(store_path, "index.faiss")
+    if not os.path.exists(index_file):
+        return None
+    stat = os.stat(index_file)
+    return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+def write_index(index, store_path):
+    """Atomically (re)write index.faiss, so a running reader keeps its mapping."""
+    index_file = os.path.join(store_path, "index.faiss")
+    faiss.write_index(index, index_file + ".tmp")
+    os.replace(index_file + ".tmp", index_file)
+
+def write_lexical_index(store_path, rows=None):
+    """(Re)build the BM25 index next to the vectors from the docstore.
+
+    ``rows`` are the docstore rows to index (default: all); tombstoned rows
+    are left out so lexical search only returns live chunks.
+    """
+    docstore = ColumnarDocstore(os.path.join(store_path, DOCSTORE_DIR))
+    rows = range(len(docstore)) if rows is None else np.sort(rows)
+    BM25Index.write(os.path.join(store_path, LEXICAL_DIR),
+                    ((int(row), docstore.text(row)) for row in rows), n_rows=len(docstore))
+
+def append_lexical_index(store_path, new_rows, removed_rows=(), live_rows=None):
+    """Add BM25 postings for ``new_rows`` and unindex ``removed_rows``, tokenizing only the new text.
+
+    Falls back to a full rebuild over ``live_rows`` when the store has no
+    BM25 index yet or has accumulated MAX_LEXICAL_SEGMENTS segments.
+    """
+    lexical = load_lexical_index(store_path)
+    if lexical is None or len(lexical.segments) > MAX_LEXICAL_SEGMENTS:
+        del lexical
+        write_lexical_index(store_path, live_rows)
+        return
+    del lexical
+    docstore = ColumnarDocstore(os.path.join(store_path, DOCSTORE_DIR))
+    BM25Index.append(os.path.join(store_path, LEXICAL_DIR),
+                     ((int(row), docstore.text(row)) for row in new_rows), len(docstore), removed_rows)
+
+def load_lexical_index(store_path):
+    """Open the BM25 index saved with a vector store, or None if it has none."""
+    path = os.path.join(store_path, LEXICAL_DIR)
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        return None
+    return BM25Index(path)
+
+def generator_tokenizer(model_id=GENERATOR_MODEL_ID):
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(model_id)
+
+def write_chunk_tokens(store_path, documents, tokenizer, tokenizer_name=GENERATOR_MODEL_ID,
+                       with_ids=False, append=False):
+    """Precompute generator token counts (and optionally ids) for the docstore rows of ``documents``."""
+    ChunkTokens.write(os.path.join(store_path, TOKENS_DIR), (d.page_content for d in documents),
+                      tokenizer, tokenizer_name, with_ids=with_ids, append=append)
+
+def load_chunk_tokens(store_path, tokenizer_name=GENERATOR_MODEL_ID):
+    """Open the chunk token counts saved with a vector store, if they match ``tokenizer_name``."""
+    path = os.path.join(store_path, TOKENS_DIR)
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        return None
+    tokens = ChunkTokens(path)
+    return tokens if tokens.tokenizer_name == tokenizer_name else None
+
+def load_vector_store(store_path, embeddings, mmap=False):
+    """Open a saved index with its columnar docstore.
+
+    Stores written before the columnar docstore existed (index.pkl) are
+    still loaded through FAISS.load_local. With ``mmap`` the FAISS index is
+    memory-mapped read-only where the index type allows it.
+    """
+    docstore_path = os.path.join(store_path, DOCSTORE_DIR)
+    if not os.path.isdir(docstore_path):
+        return FAISS.load_local(store_path, embeddings, allow_dangerous_deserialization=True)
+
+    index_file = os.path.join(store_path, "index.faiss")
+    index = None
+    if mmap:
+        try:
+            index = faiss.read_index(index_file, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            index = None
+    if index is None:
+        index = faiss.read_index(index_file)
+    docstore = ColumnarDocstore(docstore_path)
+    return FAISS(embeddings, index, docstore, RowIds(docstore))
+
+def dedup_chunks(documents, threshold=DEDUP_THRESHOLD):
+    """Collapse near-duplicate chunks (MinHash/LSH, within a product) into one.
+
+    The kept chunk lists every complaint it stands for in ``source_ids``.
+    """
+    duplicates = {}
+    kept = list(dedup_documents(documents, duplicates, threshold))
+    n_removed = sum(len(d) for d in duplicates.values())
+    if n_removed:
+        print(f"Collapsed {n_removed} near-duplicate chunks into {len(duplicates)}.")
+    return list(with_sources(kept, duplicates))
+
+def build_vector_store(documents, store_path="vector_store/faiss_index", embeddings=None,
+                       index_type="flat", storage="fp32", tokenizer=None, token_ids=False,
+                       dedup_threshold=DEDUP_THRESHOLD, **index_kwargs):
+    """Generate embeddings and build FAISS index.
+
+    ``index_type`` is one of INDEX_TYPES and ``storage`` one of STORAGE_TYPES;
+    extra keyword arguments (nlist, hnsw_m, pq_m) are passed to
+    index_factory_string. With a generator ``tokenizer`` each chunk's token
+    count (and, with ``token_ids``, its token ids) is stored as well.
+    Near-duplicate chunks are embedded once (see dedup_chunks);
+    ``dedup_threshold=None`` keeps them all.
+    """
+    if embeddings is None:
+        print("Initializing embedding model (all-MiniLM-L6-v2)...")
+        embeddings = cached_embeddings("all-MiniLM-L6-v2")
+    if dedup_threshold is not None:
+        documents = dedup_chunks(documents, dedup_threshold)
     
-    print("Building FAISS index (this may take a few minutes)...")
-    vector_store = FAISS.from_documents(documents, embeddings)
+    print("Generating embeddings (this may take a few minutes)...")
+    vectors = np.asarray(embeddings.embed_documents([d.page_content for d in documents]), dtype=np.float32)
+    
+    print(f"Building FAISS index (type={index_type}, storage={storage})...")
+    index = make_faiss_index(vectors, index_type, storage, **index_kwargs)
+    if hasattr(embeddings, "stats"):
+        print(f"Embedding cache: {embeddings.stats()}")
     
     print(f"Saving vector store to {store_path}...")
+    _save_vector_store(store_path, documents, index, tokenizer, token_ids)
+    return load_vector_store(store_path, embeddings)
+
+def _save_vector_store(store_path, documents, index, tokenizer=None, token_ids=False):
+    """Write the docstore, FAISS index, BM25 index and (with a tokenizer) chunk token counts."""
     # Create directory if not exists
-    os.makedirs(os.path.dirname(store_path), exist_ok=True)
-    vector_store.save_local(store_path)
+    os.makedirs(store_path, exist_ok=True)
+    docstore_path = os.path.join(store_path, DOCSTORE_DIR)
+    ColumnarDocstore.write(docstore_path, documents)
+    write_index(index, store_path)
+    print("Building BM25 lexical index...")
+    write_lexical_index(store_path)
+    tokens_path = os.path.join(store_path, TOKENS_DIR)
+    if tokenizer is not None:
+        print("Precomputing chunk token counts...")
+        docstore = ColumnarDocstore(docstore_path)
+        write_chunk_tokens(store_path, (docstore.document(row) for row in range(len(docstore))),
+                           tokenizer, with_ids=token_ids)
+    elif os.path.exists(tokens_path):
+        # Counts from an earlier build no longer line up with the rows
+        shutil.rmtree(tokens_path)
+    # The pickled docstore of older builds is superseded by the columnar one
+    legacy_pickle = os.path.join(store_path, "index.pkl")
+    if os.path.exists(legacy_pickle):
+        os.remove(legacy_pickle)
     print("Vector store saved successfully.")
-    return vector_store
+
+SHARDS_DIR = "shards"
+
+def _shard_fingerprint(documents):
+    # Metadata counts too: a resumed build must not keep a shard whose docstore columns went stale
+    digest = hashlib.sha1()
+    for doc in documents:
+        metadata = json.dumps(doc.metadata, sort_keys=True, default=str)
+        digest.update(f"{doc.id}\x1f{doc.page_content}\x1f{metadata}\x1e".encode("utf-8"))
+    return digest.hexdigest()
+
+def _shard_done(shard_path, fingerprint):
+    done_path = os.path.join(shard_path, "done.json")
+    if not os.path.exists(done_path):
+        return False
+    try:
+        with open(done_path, encoding="utf-8") as f:
+            return json.load(f)["fingerprint"] == fingerprint
+    except (ValueError, KeyError):
+        # A marker torn by a crash means the shard is embedded again
+        return False
+
+def _embed_shard(shard_path, texts, fingerprint, embeddings=None, batch_size=256):
+    """Embed one shard and checkpoint its vectors; the done marker is written last."""
+    embeddings = embeddings or _worker_embeddings
+    vectors = np.concatenate([
+        np.asarray(embeddings.embed_documents(texts[i:i + batch_size]), dtype=np.float32)
+        for i in range(0, len(texts), batch_size)
+    ])
+    vectors_path = os.path.join(shard_path, "vectors.npy")
+    _save_array(vectors_path, vectors)
+
+    def write_done(tmp_path):
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"fingerprint": fingerprint, "n": len(texts)}, f)
+    _replace_file(os.path.join(shard_path, "done.json"), write_done)
+    return shard_path
+
+_worker_embeddings = None
+
+def _init_embed_worker(embeddings, model_name, threads, cache_dir=DEFAULT_CACHE_DIR):
+    """Process-pool initializer: one embedder per worker, sharing the cores evenly.
+
+    Workers loading ``model_name`` read the shared embedding cache but do not
+    append to it; the parent stores each shard's vectors once it is done.
+    """
+    global _worker_embeddings
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    if embeddings is None:
+        from langchain_huggingface import HuggingFaceEmbeddings
+        embeddings = CachedEmbeddings(HuggingFaceEmbeddings(model_name=model_name), model_name,
+                                      cache_dir=cache_dir, read_only=True)
+    _worker_embeddings = embeddings
+
+def build_vector_store_sharded(df, store_path="vector_store/faiss_index", embeddings=None,
+                               model_name="all-MiniLM-L6-v2", shard_size=20_000, workers=None,
+                               chunk_size=500, chunk_overlap=50, index_type="flat", storage="fp32",
+                               tokenizer=None, token_ids=False, dedup_threshold=DEDUP_THRESHOLD,
+                               cache_dir=DEFAULT_CACHE_DIR, **index_kwargs):
+    """Chunk, embed and index ``df`` in resumable shards on a process pool.
+
+    Chunks are generated lazily and cut into shards of ``shard_size``; each
+    shard's docstore is written as soon as it is full and its embedding is
+    handed to one of ``workers`` processes (default: one per core), so
+    chunking overlaps embedding. Every embedded shard is checkpointed under
+    ``shards/``; an interrupted build skips shards whose chunks are unchanged
+    and already embedded. The shards are merged into one store at the end,
+    which also writes the manifest for incremental updates.
+
+    Near-duplicate chunks are dropped before sharding, as in
+    build_vector_store; the complaints they came from are attached to the
+    kept chunks when the shards are merged.
+
+    ``embeddings`` must be picklable to be used by the workers; by default
+    each worker loads ``model_name`` and looks chunks up in the shared
+    embedding cache first, so unchanged text is not embedded again. The
+    vectors of each finished shard are added to the cache by this process.
+    ``workers=0`` embeds in this process instead.
+    """
+    from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+    shards_path = os.path.join(store_path, SHARDS_DIR)
+    os.makedirs(shards_path, exist_ok=True)
+    workers = (os.cpu_count() or 1) if workers is None else workers
+    pool = cache = None
+    if workers > 0:
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        pool = ProcessPoolExecutor(workers, initializer=_init_embed_worker,
+                                   initargs=(embeddings, model_name, threads, cache_dir))
+        if embeddings is None:
+            # Only the cache files are needed here; the workers hold the models
+            cache = CachedEmbeddings(None, model_name, cache_dir=cache_dir)
+    elif embeddings is None:
+        embeddings = cached_embeddings(model_name, cache_dir=cache_dir)
+
+    duplicates = {}
+
+    def shards():
+        batch = []
+        for doc in dedup_documents(iter_chunks(df, chunk_size, chunk_overlap), duplicates, dedup_threshold):
+            batch.append(doc)
+            if len(batch) == shard_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    shard_texts = {}
+
+    def finish_shard(future):
+        shard_path, texts = future.result(), shard_texts.pop(future)
+        if cache is not None:
+            cache.store_documents(texts, np.load(os.path.join(shard_path, "vectors.npy")))
+        print(f"Embedded {os.path.basename(shard_path)}")
+
+    shard_paths, pending, resumed = [], set(), 0
+    try:
+        for n, docs in enumerate(shards()):
+            shard_path = os.path.join(shards_path, f"shard_{n:05d}")
+            shard_paths.append(shard_path)
+            fingerprint = _shard_fingerprint(docs)
+            if _shard_done(shard_path, fingerprint):
+                resumed += 1
+                continue
+            if os.path.exists(shard_path):
+                shutil.rmtree(shard_path)
+            ColumnarDocstore.write(os.path.join(shard_path, DOCSTORE_DIR), docs)
+            texts = [d.page_content for d in docs]
+            if pool is None:
+                _embed_shard(shard_path, texts, fingerprint, embeddings)
+                print(f"Embedded shard {n} ({len(texts)} chunks)")
+                continue
+            # Bound the shards held in memory while the workers catch up
+            while len(pending) >= 2 * workers:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    finish_shard(future)
+            future = pool.submit(_embed_shard, shard_path, texts, fingerprint)
+            shard_texts[future] = texts
+            pending.add(future)
+        for future in pending:
+            finish_shard(future)
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+    if resumed:
+        print(f"Resumed: {resumed} of {len(shard_paths)} shards were already embedded.")
+    if duplicates:
+        print(f"Collapsed {sum(len(d) for d in duplicates.values())} near-duplicate chunks into {len(duplicates)}.")
+
+    if not shard_paths:
+        raise ValueError("No narratives to index.")
+    print(f"Merging {len(shard_paths)} shards (type={index_type}, storage={storage})...")
+    # Stale shards from a longer earlier run do not belong to this build
+    for name in os.listdir(shards_path):
+        if os.path.join(shards_path, name) not in shard_paths:
+            shutil.rmtree(os.path.join(shards_path, name))
+    vectors = np.concatenate([np.load(os.path.join(p, "vectors.npy"), mmap_mode="r") for p in shard_paths])
+    index = make_faiss_index(vectors, index_type, storage, **index_kwargs)
+    del vectors
+
+    def shard_documents():
+        for shard_path in shard_paths:
+            docstore = ColumnarDocstore(os.path.join(shard_path, DOCSTORE_DIR))
+            for row in range(len(docstore)):
+                yield docstore.document(row)
+
+    def merged_documents():
+        return with_sources(shard_documents(), duplicates)
+
+    print(f"Saving vector store to {store_path}...")
+    _save_vector_store(store_path, merged_documents(), index, tokenizer, token_ids)
+    write_manifest(store_path, content_hashes(df, chunk_size, chunk_overlap), merged_documents(),
+                   chunk_size, chunk_overlap)
+    shutil.rmtree(shards_path)
+    return load_vector_store(store_path, embeddings)
+
+def compact_vector_store(store_path):
+    """Drop superseded (tombstoned) rows from a store, without re-embedding anything.
+
+    Live rows are renumbered in order: the docstore is rewritten, the FAISS
+    labels are remapped in place, and BM25 postings and chunk token counts
+    are rebuilt for the new rows. Returns the number of rows dropped.
+    """
+    index_file = os.path.join(store_path, "index.faiss")
+    docstore_path = os.path.join(store_path, DOCSTORE_DIR)
+    index = faiss.read_index(index_file)
+    labels = faiss.vector_to_array(index.id_map)
+    live = np.sort(labels)
+    docstore = ColumnarDocstore(docstore_path)
+    n_dropped = len(docstore) - len(live)
+    if n_dropped <= 0:
+        return 0
+
+    print(f"Compacting: dropping {n_dropped} superseded rows...")
+    ColumnarDocstore.write(docstore_path, (docstore.document(row) for row in live))
+    del docstore
+    faiss.copy_array_to_vector(np.searchsorted(live, labels).astype(np.int64), index.id_map)
+    if hasattr(index, "construct_rev_map"):
+        index.construct_rev_map()
+    write_index(index, store_path)
+    write_lexical_index(store_path)
+    tokens_path = os.path.join(store_path, TOKENS_DIR)
+    if os.path.exists(os.path.join(tokens_path, "meta.json")):
+        ChunkTokens.take(tokens_path, live)
+    return n_dropped
+
+def _stale_rows(docstore, live_rows, complaint_ids):
+    """Live rows of ``complaint_ids`` and the complaint ids collapsed into them.
+
+    Ids that are not numbers all share MISSING_ID in the docstore, so they
+    cannot pick out their rows and are skipped.
+    """
+    stale = {_complaint_id_to_int(cid) for cid in complaint_ids} - {MISSING_ID}
+    live_rows = np.sort(live_rows)
+    rows = live_rows[np.isin(np.asarray(docstore.columns["complaint_id"])[live_rows], list(stale))]
+    absorbed = {cid for row in rows for cid in docstore.source_ids(row)} - set(complaint_ids) - {"N/A"}
+    return rows, absorbed
+
+def update_vector_store(df, store_path="vector_store/faiss_index", chunk_size=500,
+                        chunk_overlap=50, prune_missing=False, embeddings=None, tokenizer=None,
+                        compact_ratio=COMPACT_RATIO):
+    """Incrementally bring an existing index in line with ``df``.
+
+    Only complaints whose content hash is new or changed are chunked and
+    embedded; the chunks they supersede are deleted from the index. With
+    ``prune_missing`` complaints absent from ``df`` are removed as well.
+    Falls back to a full build when there is no index or manifest yet.
+    Stored chunk token counts are extended for the new chunks, loading the
+    tokenizer they were built with unless ``tokenizer`` is given. New chunks
+    are not de-duplicated against the existing index; a full build does that.
+    When a chunk that absorbed near-duplicates is superseded, the complaints
+    it stood for are chunked and embedded again.
+    Once superseded rows make up more than ``compact_ratio`` of the docstore
+    the store is compacted (see compact_vector_store); None never compacts.
+    """
+    df = df.drop_duplicates(subset='Complaint ID', keep='last')
+    hashes = content_hashes(df, chunk_size, chunk_overlap)
+    manifest = load_manifest(store_path)
+    index_file = os.path.join(store_path, "index.faiss")
+
+    docstore_path = os.path.join(store_path, DOCSTORE_DIR)
+
+    if manifest is None or not os.path.exists(index_file) or not os.path.isdir(docstore_path):
+        print("No existing index/manifest found; running a full build.")
+        docs = create_chunks(df, chunk_size, chunk_overlap)
+        vector_store = build_vector_store(docs, store_path, embeddings, tokenizer=tokenizer)
+        write_manifest(store_path, hashes, docs, chunk_size, chunk_overlap)
+        return vector_store
+
+    known = manifest["complaints"]
+    changed = [cid for cid, h in hashes.items() if cid != 'N/A' and known.get(cid, [None])[0] != h]
+    removed = [cid for cid in known if cid not in hashes] if prune_missing else []
+    print(f"Index delta: {len(changed)} new/changed, {len(removed)} removed, "
+          f"{len(hashes) - len(changed)} unchanged.")
+    if not changed and not removed:
+        print("Index is up to date.")
+        return None
+
+    if embeddings is None:
+        embeddings = cached_embeddings("all-MiniLM-L6-v2")
+    index = faiss.read_index(index_file)
+    docstore = ColumnarDocstore(docstore_path)
+
+    # Superseded rows stay in the docstore as tombstones; only their vectors go
+    gone, rechunk = set(changed) | set(removed), set(changed)
+    stale_rows, absorbed = _stale_rows(docstore, faiss.vector_to_array(index.id_map), gone)
+    while absorbed:
+        # A stale row stood for the near-duplicates collapsed into it; they are chunked again
+        gone |= absorbed
+        rechunk |= absorbed & set(hashes)
+        stale_rows, absorbed = _stale_rows(docstore, faiss.vector_to_array(index.id_map), gone)
+    del docstore
+    if stale_rows.size:
+        if isinstance(unwrap_index(index), faiss.IndexHNSW):
+            raise ValueError("HNSW indexes do not support removing vectors; run a full build instead.")
+        print(f"Removing {stale_rows.size} superseded chunks...")
+        index.remove_ids(stale_rows)
+    # Surviving rows no longer stand for complaints that are re-chunked or removed
+    ColumnarDocstore.drop_sources(docstore_path, {_complaint_id_to_int(cid) for cid in gone} - {MISSING_ID})
+
+    new_docs = create_chunks(df[df['Complaint ID'].astype(str).isin(rechunk)], chunk_size, chunk_overlap)
+    rows = np.empty(0, dtype=np.int64)
+    if new_docs:
+        print(f"Embedding {len(new_docs)} new chunks...")
+        vectors = np.asarray(embeddings.embed_documents([d.page_content for d in new_docs]), dtype=np.float32)
+        rows = ColumnarDocstore.write(docstore_path, new_docs, append=True)
+        index.add_with_ids(vectors, rows)
+        tokens = load_chunk_tokens(store_path)
+        if tokens is not None and len(tokens) == rows[0]:
+            write_chunk_tokens(store_path, new_docs, tokenizer or generator_tokenizer(tokens.tokenizer_name),
+                               tokens.tokenizer_name, append=True)
+
+    write_index(index, store_path)
+    append_lexical_index(store_path, rows, stale_rows, faiss.vector_to_array(index.id_map))
+    base = {"complaints": {cid: v for cid, v in known.items() if cid not in gone}}
+    n_live, n_rows = index.ntotal, len(ColumnarDocstore(docstore_path))
+    if compact_ratio is not None and n_rows and (n_rows - n_live) / n_rows > compact_ratio:
+        compact_vector_store(store_path)
+    write_manifest(store_path, hashes, new_docs, chunk_size, chunk_overlap, base=base)
+    print("Vector store updated successfully.")
+    return load_vector_store(store_path, embeddings)
 
 if __name__ == "__main__":
-    input_file = "data/filtered_complaints.csv"
-    output_store = "vector_store/faiss_index"
+    parser = argparse.ArgumentParser(description="Chunk, embed and index the filtered complaints.")
+    parser.add_argument("--input", default=None,
+                        help="Filtered complaints (.csv or .parquet); defaults to data/filtered_complaints.*")
+    parser.add_argument("--output", default="vector_store/faiss_index")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only embed new or changed complaints into the existing index.")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="flat")
+    parser.add_argument("--storage", choices=tuple(STORAGE_TYPES), default="fp32")
+    parser.add_argument("--nlist", type=int, default=None, help="IVF lists (default ~4*sqrt(n)).")
+    parser.add_argument("--hnsw-m", type=int, default=32, help="HNSW neighbours per node.")
+    parser.add_argument("--no-token-counts", action="store_true",
+                        help="Skip precomputing generator token counts for prompt packing.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Embedding processes for a full build (default: one per core; 0 embeds in-process).")
+    parser.add_argument("--shard-size", type=int, default=20_000,
+                        help="Chunks per checkpointed shard; an interrupted build resumes from the last full shard.")
+    parser.add_argument("--token-ids", action="store_true",
+                        help="Also store chunk token ids, so the last packed chunk can be cut to fit.")
+    parser.add_argument("--dedup-threshold", type=float, default=DEDUP_THRESHOLD,
+                        help="Collapse chunks at least this similar (estimated Jaccard of word 3-grams).")
+    parser.add_argument("--no-dedup", action="store_true", help="Index near-duplicate chunks separately.")
+    parser.add_argument("--sample-size", type=int, default=12000)
+    parser.add_argument("--quota", choices=QUOTAS, default="proportional",
+                        help="Split the sample by product share, or cap rows per product.")
+    parser.add_argument("--max-per-product", type=int, default=None,
+                        help="Cap for --quota capped (default: sample size / number of products).")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--snapshot", action="store_true",
+                        help="Build into a new versioned snapshot under --output and publish it when complete; "
+                             "running pipelines swap to it without a restart.")
+    parser.add_argument("--keep-snapshots", type=int, default=3, help="Published snapshots to keep (the one being replaced is always kept).")
+    args = parser.parse_args()
+
+    input_file = args.input or "data/filtered_complaints.csv"
+    if args.input is None and not os.path.exists(input_file) and os.path.exists("data/filtered_complaints.parquet"):
+        input_file = "data/filtered_complaints.parquet"
+    output_store = prepare_snapshot(args.output, copy_current=args.incremental) if args.snapshot else args.output
     
     if os.path.exists(input_file):
-        df_sample = load_and_sample(input_file)
-        docs = create_chunks(df_sample)
-        build_vector_store(docs, output_store)
+        df_sample = load_and_sample(input_file, args.sample_size, args.quota, args.max_per_product, args.seed)
+        tokenizer = None if args.no_token_counts else generator_tokenizer()
+        if args.incremental:
+            built = update_vector_store(df_sample, output_store, tokenizer=tokenizer)
+        else:
+            built = build_vector_store_sharded(df_sample, output_store, shard_size=args.shard_size,
+                                               workers=args.workers, index_type=args.index_type,
+                                               storage=args.storage, tokenizer=tokenizer, token_ids=args.token_ids,
+                                               dedup_threshold=None if args.no_dedup else args.dedup_threshold,
+                                               nlist=args.nlist, hnsw_m=args.hnsw_m)
+        if args.snapshot and built is not None:
+            publish_snapshot(args.output, output_store, keep=args.keep_snapshots)
+            print(f"Published snapshot {os.path.basename(output_store)}")
+        elif args.snapshot:
+            # Nothing changed: drop the unpublished copy
+            shutil.rmtree(output_store)
+        if built is not None:
+            write_analytics(analytics_path(input_file), index=index_statistics(args.output))
     else:
         print(f"Error: {input_file} not found. Run Task 1 first.")
@@ -0,0 +1,203 @@
+import os
+import re
+import json
+import shutil
+
+import numpy as np
+
+try:
+    from .docstore import _replace_file, _save_array
+except ImportError:
+    from docstore import _replace_file, _save_array
+
+LEXICAL_DIR = "bm25"
+SEGMENTS_DIR = "segments"
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset("""
+a an and are as at be but by for from had has have i if in into is it its me my of on or our so that
+the their them then there they this to was we were with you your xxxx xx
+""".split())
+
+
+def tokenize(text):
+    """Lowercase alphanumeric terms of ``text`` without stopwords or redaction masks."""
+    return [t for t in _TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+class BM25Index:
+    """Read-only, memory-mapped BM25 inverted index over docstore rows.
+
+    Row ``i`` is the chunk under FAISS label ``i``, so lexical and dense hits
+    share one id space. Each term's posting list is a slice of two flat
+    arrays: ascending uint32 rows and uint16 term frequencies. Incremental
+    updates append a segment with the postings of the new rows instead of
+    re-indexing the corpus. Rows that are not indexed (tombstones left by
+    incremental updates) have length 0 and never score, even if an older
+    segment still lists them.
+
+    Layout of the directory::
+
+        meta.json        row count, average length, k1/b, the sorted term list and segment count
+        offsets.npy      int64[n_terms + 1] start of each term's postings
+        rows.npy         uint32 posting rows
+        tfs.npy          uint16 term frequencies, aligned with rows.npy
+        lengths.npy      int32[n_rows] document lengths in terms
+        segments/<i>/    appended segments: terms.json, offsets.npy, rows.npy, tfs.npy
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.n_rows = meta["n_rows"]
+        self.avg_length = meta["avg_length"]
+        self.k1, self.b = meta["k1"], meta["b"]
+        self.lengths = np.load(os.path.join(path, "lengths.npy"), mmap_mode="r")
+        self.segments = [self._load_segment(path, meta["terms"])]
+        for i in range(meta.get("segments", 0)):
+            segment_path = os.path.join(path, SEGMENTS_DIR, str(i))
+            with open(os.path.join(segment_path, "terms.json"), encoding="utf-8") as f:
+                self.segments.append(self._load_segment(segment_path, json.load(f)))
+        self.n_docs = int(np.count_nonzero(self.lengths))
+        # Length normalization is fixed per row; unindexed rows get an infinite norm and so score 0
+        lengths = np.asarray(self.lengths, dtype=np.float32)
+        with np.errstate(divide="ignore"):
+            self.norm = np.where(lengths > 0, self.k1 * (1 - self.b + self.b * lengths / max(self.avg_length, 1e-9)),
+                                 np.inf).astype(np.float32)
+
+    @staticmethod
+    def _load_segment(path, terms):
+        load = lambda name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+        return ({term: i for i, term in enumerate(terms)},) + tuple(load(n) for n in ("offsets", "rows", "tfs"))
+
+    def __len__(self):
+        return self.n_rows
+
+    def _postings(self, term):
+        postings = []
+        for terms, offsets, rows, tfs in self.segments:
+            i = terms.get(term)
+            if i is not None:
+                start, end = offsets[i], offsets[i + 1]
+                postings.append((rows[start:end], tfs[start:end]))
+        return postings
+
+    def scores(self, query):
+        """BM25 score of every row for ``query`` (float32[n_rows])."""
+        scores = np.zeros(self.n_rows, dtype=np.float32)
+        for term in set(tokenize(query)):
+            postings = self._postings(term)
+            if not postings:
+                continue
+            df = sum(len(rows) for rows, _ in postings)
+            idf = np.log(1 + max(self.n_docs - df + 0.5, 0.5) / (df + 0.5))
+            for rows, tfs in postings:
+                tfs = tfs.astype(np.float32)
+                scores[rows] += idf * tfs * (self.k1 + 1) / (tfs + self.norm[rows])
+        return scores
+
+    def search(self, query, k=20, mask=None):
+        """Top-``k`` rows for ``query``, best first; ``mask`` restricts to rows set in a boolean array."""
+        scores = self.scores(query)
+        if mask is not None:
+            scores[~mask[:self.n_rows]] = 0
+        candidates = np.flatnonzero(scores > 0)
+        if candidates.size > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        return candidates[np.argsort(-scores[candidates], kind="stable")].astype(np.int64)
+
+    @staticmethod
+    def _write_postings(path, texts):
+        """Write the posting arrays of ``texts`` ((row, text) pairs) to ``path``; returns (terms, rows, lengths)."""
+        os.makedirs(path, exist_ok=True)
+        terms, postings = {}, []
+        row_ids, lengths = [], []
+        for row, text in texts:
+            tokens = tokenize(text)
+            row_ids.append(row)
+            lengths.append(len(tokens))
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                postings.append((terms.setdefault(token, len(terms)), row, min(tf, 65535)))
+
+        # Renumber terms alphabetically and sort postings by (term, row)
+        sorted_terms = sorted(terms)
+        remap = np.empty(len(terms), dtype=np.int64)
+        remap[[terms[t] for t in sorted_terms]] = np.arange(len(terms))
+        postings = np.asarray(postings, dtype=np.int64).reshape(-1, 3)
+        term_ids = remap[postings[:, 0]]
+        order = np.lexsort((postings[:, 1], term_ids))
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(term_ids, minlength=len(terms)))
+
+        _save_array(os.path.join(path, "offsets.npy"), offsets)
+        _save_array(os.path.join(path, "rows.npy"), postings[order, 1].astype(np.uint32))
+        _save_array(os.path.join(path, "tfs.npy"), postings[order, 2].astype(np.uint16))
+        return sorted_terms, np.asarray(row_ids, dtype=np.int64), np.asarray(lengths, dtype=np.int32)
+
+    @staticmethod
+    def _write_meta(path, meta):
+        def write(tmp_path):
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+        _replace_file(os.path.join(path, "meta.json"), write)
+
+    @staticmethod
+    def _avg_length(lengths):
+        indexed = lengths[lengths > 0]
+        return float(indexed.mean()) if indexed.size else 0.0
+
+    @classmethod
+    def write(cls, path, texts, n_rows=None, k1=1.5, b=0.75):
+        """Index ``texts``, an iterable of (row, text) pairs, into a BM25 directory at ``path``.
+
+        ``n_rows`` is the docstore size; rows not in ``texts`` are left out of
+        the index. Files are replaced atomically, and earlier segments are dropped.
+        """
+        sorted_terms, row_ids, lengths = cls._write_postings(path, texts)
+        n_rows = n_rows if n_rows is not None else (int(row_ids.max()) + 1 if row_ids.size else 0)
+        doc_lengths = np.zeros(n_rows, dtype=np.int32)
+        doc_lengths[row_ids] = lengths
+        _save_array(os.path.join(path, "lengths.npy"), doc_lengths)
+        cls._write_meta(path, {"n_rows": n_rows, "avg_length": cls._avg_length(doc_lengths),
+                               "k1": k1, "b": b, "terms": sorted_terms, "segments": 0})
+        shutil.rmtree(os.path.join(path, SEGMENTS_DIR), ignore_errors=True)
+
+    @classmethod
+    def append(cls, path, texts, n_rows, removed=()):
+        """Add the (row, text) pairs of new rows as a segment, and unindex the ``removed`` rows.
+
+        Only the new texts are tokenized; the per-row lengths (and with them
+        the average) are rewritten, which is O(rows) integers. Returns the
+        number of segments.
+        """
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        n_segments = meta.get("segments", 0)
+        sorted_terms, row_ids, lengths = cls._write_postings(os.path.join(path, SEGMENTS_DIR, str(n_segments)), texts)
+        with open(os.path.join(path, SEGMENTS_DIR, str(n_segments), "terms.json"), "w", encoding="utf-8") as f:
+            json.dump(sorted_terms, f)
+
+        doc_lengths = np.zeros(n_rows, dtype=np.int32)
+        old = np.load(os.path.join(path, "lengths.npy"))
+        doc_lengths[:len(old)] = old[:n_rows]
+        doc_lengths[np.asarray(removed, dtype=np.int64)] = 0
+        doc_lengths[row_ids] = lengths
+        _save_array(os.path.join(path, "lengths.npy"), doc_lengths)
+        # meta.json goes last: readers see the new segment only once it is complete
+        cls._write_meta(path, {**meta, "n_rows": n_rows, "avg_length": cls._avg_length(doc_lengths),
+                               "segments": n_segments + 1})
+        return n_segments + 1
+
+
+def reciprocal_rank_fusion(rankings, k=60, limit=None):
+    """Fuse ranked id lists: each id scores sum(1 / (k + rank)); returns ids best first."""
+    fused = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            fused[item] = fused.get(item, 0.0) + 1.0 / (k + rank + 1)
+    ranked = sorted(fused, key=lambda item: -fused[item])
+    return ranked if limit is None else ranked[:limit]
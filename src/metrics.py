@@ -0,0 +1,207 @@
+import json
+import time
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+_current_trace = contextvars.ContextVar("rag_trace", default=None)
+
+
+class RollingHistogram:
+    """The last ``window`` observations of one metric, bucketed on export."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS, window=1000):
+        self.buckets = buckets
+        self._values = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.total_count = 0
+
+    def observe(self, value):
+        with self._lock:
+            self._values.append(value)
+            self.total_count += 1
+
+    def snapshot(self):
+        """Counts per bucket (cumulative, Prometheus-style), sum, count and percentiles of the window."""
+        with self._lock:
+            values = np.array(self._values, dtype=np.float64)
+        counts = [int(np.count_nonzero(values <= bound)) for bound in self.buckets]
+        percentiles = np.percentile(values, [50, 95, 99]) if values.size else [0.0, 0.0, 0.0]
+        return {
+            "buckets": dict(zip(self.buckets, counts)),
+            "count": int(values.size),
+            "sum": float(values.sum()),
+            "p50": float(percentiles[0]),
+            "p95": float(percentiles[1]),
+            "p99": float(percentiles[2]),
+        }
+
+
+class Trace:
+    """Timings of one request: seconds per stage plus free-form attributes."""
+
+    def __init__(self, kind, **attrs):
+        self.kind = kind
+        self.attrs = attrs
+        self.stages = {}
+        self.start = time.perf_counter()
+        self.wall_start = time.time()
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def to_dict(self):
+        return {"kind": self.kind, "start": self.wall_start, "total_s": self.elapsed(),
+                "stages": self.stages, **self.attrs}
+
+
+class GenerationClock:
+    """generate() stopping criterion that timestamps decoding steps and never stops.
+
+    The first call happens once the first new token exists, so it marks
+    time to first token; later calls count tokens for the decode rate.
+    """
+
+    def __init__(self):
+        self.first = None
+        self.last = None
+        self.steps = 0
+
+    def __call__(self, input_ids, scores, **kwargs):
+        import torch
+        now = time.perf_counter()
+        self.first = self.first or now
+        self.last = now
+        self.steps += 1
+        return torch.zeros((input_ids.shape[0],), dtype=torch.bool, device=input_ids.device)
+
+    def tokens_per_second(self):
+        if self.steps < 2 or self.last <= self.first:
+            return None
+        return (self.steps - 1) / (self.last - self.first)
+
+
+class Metrics:
+    """Per-stage latency histograms for the RAG pipeline, with per-request traces.
+
+    Stages are timed with ``stage()``; the time goes to that stage's rolling
+    histogram and, when a request is being traced on this thread, to its
+    Trace. Finished traces are optionally appended to ``trace_log`` as JSON
+    lines. Everything can be exported as Prometheus text or JSON lines.
+    """
+
+    def __init__(self, window=1000, trace_log=None, prefix="rag"):
+        self.window = window
+        self.trace_log = trace_log
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._rates = {}
+
+    def _histogram(self, table, name, buckets):
+        with self._lock:
+            if name not in table:
+                table[name] = RollingHistogram(buckets, self.window)
+            return table[name]
+
+    def observe(self, stage, seconds, trace=None):
+        self._histogram(self._latency, stage, LATENCY_BUCKETS).observe(seconds)
+        trace = trace or _current_trace.get()
+        if trace is not None:
+            trace.add(stage, seconds)
+
+    def observe_rate(self, name, value, trace=None):
+        self._histogram(self._rates, name, RATE_BUCKETS).observe(value)
+        trace = trace or _current_trace.get()
+        if trace is not None:
+            trace.attrs[name] = value
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def start_trace(self, kind, **attrs):
+        """Begin tracing a request on this thread; returns (trace, token for end_trace)."""
+        trace = Trace(kind, **attrs)
+        return trace, _current_trace.set(trace)
+
+    def end_trace(self, token):
+        """Stop attributing stages on this thread to the trace started with ``token``."""
+        _current_trace.reset(token)
+
+    def finish_trace(self, trace):
+        """Record a trace's end-to-end time and append it to the trace log."""
+        self.observe(f"{trace.kind}_total", trace.elapsed(), trace=trace)
+        if self.trace_log:
+            line = json.dumps(trace.to_dict())
+            with self._lock, open(self.trace_log, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    @contextmanager
+    def trace(self, kind, **attrs):
+        """Trace a request that completes inside the with block."""
+        trace, token = self.start_trace(kind, **attrs)
+        try:
+            yield trace
+        finally:
+            self.end_trace(token)
+            self.finish_trace(trace)
+
+    def summary(self):
+        """{stage: {"count", "p50_ms", "p95_ms", "p99_ms"}} plus rate percentiles, for dashboards."""
+        with self._lock:
+            latency, rates = dict(self._latency), dict(self._rates)
+        out = {}
+        for name, hist in latency.items():
+            snap = hist.snapshot()
+            out[name] = {"count": snap["count"], "p50_ms": snap["p50"] * 1000,
+                         "p95_ms": snap["p95"] * 1000, "p99_ms": snap["p99"] * 1000}
+        for name, hist in rates.items():
+            snap = hist.snapshot()
+            out[name] = {"count": snap["count"], "p50": snap["p50"], "p95": snap["p95"], "p99": snap["p99"]}
+        return out
+
+    def to_json_lines(self):
+        """One JSON object per histogram: name, kind, bucket counts, sum and percentiles."""
+        with self._lock:
+            tables = [("latency_seconds", dict(self._latency)), ("rate", dict(self._rates))]
+        lines = []
+        for kind, table in tables:
+            for name, hist in sorted(table.items()):
+                snap = hist.snapshot()
+                snap["buckets"] = {str(bound): count for bound, count in snap["buckets"].items()}
+                lines.append(json.dumps({"name": name, "kind": kind, **snap}))
+        return "\n".join(lines) + ("\n" if lines else "")
+
+    def to_prometheus(self):
+        """Prometheus text exposition of the rolling windows."""
+        with self._lock:
+            tables = [(f"{self.prefix}_stage_seconds", "stage", dict(self._latency)),
+                      (f"{self.prefix}_rate", "name", dict(self._rates))]
+        lines = []
+        for metric, label, table in tables:
+            if not table:
+                continue
+            lines.append(f"# TYPE {metric} histogram")
+            for name, hist in sorted(table.items()):
+                snap = hist.snapshot()
+                for bound, count in snap["buckets"].items():
+                    lines.append(f'{metric}_bucket{{{label}="{name}",le="{bound}"}} {count}')
+                lines.append(f'{metric}_bucket{{{label}="{name}",le="+Inf"}} {snap["count"]}')
+                lines.append(f'{metric}_sum{{{label}="{name}"}} {snap["sum"]}')
+                lines.append(f'{metric}_count{{{label}="{name}"}} {snap["count"]}')
+        return "\n".join(lines) + ("\n" if lines else "")
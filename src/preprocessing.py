@@ -1,10 +1,41 @@
 import pandas as pd
 import re
+import os
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from .analytics import ComplaintAggregates, analytics_path, write_analytics
+except ImportError:
+    from analytics import ComplaintAggregates, analytics_path, write_analytics
+
+# Columns the downstream indexing and dashboard steps actually use.
+# Streaming mode reads only these, which keeps each chunk small.
+NEEDED_COLUMNS = [
+    'Date received',
+    'Product',
+    'Sub-product',
+    'Issue',
+    'Consumer complaint narrative',
+    'Complaint ID'
+]
 
 def load_data(file_path):
     """Load the complaint dataset."""
     return pd.read_csv(file_path, low_memory=False)
 
+def iter_data(file_path, chunksize=100_000, columns=NEEDED_COLUMNS):
+    """Yield the complaint dataset in bounded-size chunks of the needed columns."""
+    # Read everything as strings so every chunk has the same schema,
+    # regardless of which values happen to be missing in it.
+    return pd.read_csv(
+        file_path,
+        usecols=lambda c: c in columns,
+        dtype=str,
+        chunksize=chunksize
+    )
+
 def filter_data(df):
     """Filter dataset by products and non-empty narratives."""
     target_products_map = {
@@ -39,6 +70,20 @@ def filter_data(df):
     
     return df_filtered
 
+# Boilerplate snippets (example). They are plain phrases, so removing them
+# in order with str.replace gives exactly what the old per-pattern re.sub did.
+BOILERPLATE_PHRASES = (
+    "i am writing to file a complaint",
+    "to whom it may concern",
+    "dear cfpb",
+    "thank you for your time"
+)
+
+# Remove special characters but keep some punctuation for context.
+_SPECIAL_CHARS_RE = re.compile(r'[^a-zA-Z0-9\s.,!?]')
+# The same character class as a translate table, for the (common) ASCII-only case.
+_ASCII_DELETE_TABLE = {c: None for c in range(128) if _SPECIAL_CHARS_RE.match(chr(c))}
+
 def clean_text(text):
     """Clean the text narrative."""
     if not isinstance(text, str):
@@ -47,26 +92,77 @@ def clean_text(text):
     # Lowercasing
     text = text.lower()
     
-    # Remove boilerplate snippets (example)
-    boilerplate = [
-        r"i am writing to file a complaint",
-        r"to whom it may concern",
-        r"dear cfpb",
-        r"thank you for your time"
-    ]
-    for pattern in boilerplate:
-        text = re.sub(pattern, "", text)
+    for phrase in BOILERPLATE_PHRASES:
+        if phrase in text:
+            text = text.replace(phrase, "")
     
-    # Remove special characters but keep some punctuation for context if needed?
-    # For RAG, keeping some structure is often good, but let's remove excessive symbols.
-    text = re.sub(r'[^a-zA-Z0-9\s.,!?]', '', text)
+    if text.isascii():
+        text = text.translate(_ASCII_DELETE_TABLE)
+    else:
+        text = _SPECIAL_CHARS_RE.sub('', text)
     
-    # Remove multiple spaces
-    text = re.sub(r'\s+', ' ', text).strip()
-    
-    return text
+    # Collapse whitespace runs and strip (str.split uses the same
+    # whitespace definition as the regex \s)
+    return ' '.join(text.split())
+
+def _clean_batch(texts):
+    return [clean_text(t) for t in texts]
+
+class TextCleaner:
+    """Batch cleaning engine that fans clean_text out over a process pool.
+
+    Inputs smaller than two batches are cleaned in-process, since starting
+    workers would cost more than it saves. Output is identical to applying
+    clean_text row by row.
+    """
+
+    def __init__(self, n_jobs=None, batch_size=5000):
+        self.n_jobs = n_jobs or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.rows = 0
+        self.seconds = 0.0
+        self._pool = None
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def clean(self, texts):
+        """Clean an array, Series or list of narratives; returns a list of str."""
+        if hasattr(texts, 'tolist'):
+            texts = texts.tolist()
+        else:
+            texts = list(texts)
+
+        start = time.perf_counter()
+        if self.n_jobs == 1 or len(texts) < 2 * self.batch_size:
+            cleaned = _clean_batch(texts)
+        else:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.n_jobs)
+            batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+            cleaned = [t for batch in self._pool.map(_clean_batch, batches) for t in batch]
+        self.seconds += time.perf_counter() - start
+        self.rows += len(texts)
+        return cleaned
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def clean_texts(texts, n_jobs=None, batch_size=5000):
+    """Clean many narratives at once (see TextCleaner)."""
+    with TextCleaner(n_jobs=n_jobs, batch_size=batch_size) as cleaner:
+        return cleaner.clean(texts)
 
-def preprocess_pipeline(input_path, output_path):
+def preprocess_pipeline(input_path, output_path, n_jobs=None):
     """Full pipeline for Task 1."""
     print("Loading data...")
     df = load_data(input_path)
@@ -82,13 +178,115 @@ def preprocess_pipeline(input_path, output_path):
     print(f"Filtered complaints (Target products + non-empty narrative): {len(df_filtered)}")
     
     print("Cleaning text...")
-    df_filtered['cleaned_narrative'] = df_filtered['Consumer complaint narrative'].apply(clean_text)
+    with TextCleaner(n_jobs=n_jobs) as cleaner:
+        df_filtered['cleaned_narrative'] = cleaner.clean(df_filtered['Consumer complaint narrative'])
+    print(f"Cleaned {cleaner.rows} narratives ({cleaner.rows_per_second:,.0f} rows/s)")
     
     print(f"Saving to {output_path}...")
     df_filtered.to_csv(output_path, index=False)
+    # Dashboard aggregates, so the app never has to read the full file
+    write_analytics(analytics_path(output_path), corpus={
+        **ComplaintAggregates().update(df_filtered).to_dict(),
+        "raw_total": total_complaints, "raw_with_narrative": int(complaints_with_narrative)})
     print("Done!")
     return df_filtered
 
+class ChunkWriter:
+    """Append DataFrame chunks to a Parquet, Arrow IPC or CSV file."""
+
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self.format = os.path.splitext(output_path)[1].lower().lstrip('.')
+        self._writer = None
+        self._schema = None
+        self._header_written = False
+
+    def write(self, df):
+        if self.format == 'csv':
+            df.to_csv(self.output_path, mode='a' if self._header_written else 'w',
+                      header=not self._header_written, index=False)
+            self._header_written = True
+            return
+
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if self._schema is None:
+            self._schema = pa.schema([(c, pa.string()) for c in df.columns])
+            if self.format == 'parquet':
+                self._writer = pq.ParquetWriter(self.output_path, self._schema)
+            elif self.format in ('arrow', 'feather'):
+                self._writer = pa.ipc.new_file(self.output_path, self._schema)
+            else:
+                raise ValueError(f"Unsupported output format: {self.output_path}")
+
+        table = pa.Table.from_pandas(df.astype(object), schema=self._schema, preserve_index=False)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+def preprocess_pipeline_streaming(input_path, output_path, chunksize=100_000, n_jobs=None):
+    """Out-of-core version of the Task 1 pipeline.
+
+    Reads the raw export in chunks of ``chunksize`` rows, filters and cleans
+    each chunk and appends it to ``output_path`` (.parquet, .arrow or .csv),
+    so peak memory depends on the chunk size rather than the file size.
+    """
+    print(f"Streaming data in chunks of {chunksize} rows...")
+    total_complaints = 0
+    complaints_with_narrative = 0
+    filtered_complaints = 0
+
+    writer = ChunkWriter(output_path)
+    cleaner = TextCleaner(n_jobs=n_jobs)
+    aggregates = ComplaintAggregates()
+    try:
+        for chunk in iter_data(input_path, chunksize=chunksize):
+            total_complaints += len(chunk)
+            complaints_with_narrative += int(chunk['Consumer complaint narrative'].notnull().sum())
+
+            df_filtered = filter_data(chunk)
+            if df_filtered.empty:
+                continue
+            df_filtered['cleaned_narrative'] = cleaner.clean(df_filtered['Consumer complaint narrative'])
+            filtered_complaints += len(df_filtered)
+            aggregates.update(df_filtered)
+            writer.write(df_filtered)
+    finally:
+        writer.close()
+        cleaner.close()
+
+    print(f"Total complaints: {total_complaints}")
+    print(f"Complaints with narrative: {complaints_with_narrative}")
+    print(f"Filtered complaints (Target products + non-empty narrative): {filtered_complaints}")
+    print(f"Cleaned text at {cleaner.rows_per_second:,.0f} rows/s")
+    print(f"Saved to {output_path}")
+    write_analytics(analytics_path(output_path), corpus={
+        **aggregates.to_dict(), "raw_total": total_complaints, "raw_with_narrative": complaints_with_narrative})
+    print("Done!")
+    return {
+        "total_complaints": total_complaints,
+        "complaints_with_narrative": complaints_with_narrative,
+        "filtered_complaints": filtered_complaints
+    }
+
 if __name__ == "__main__":
-    # For testing or direct script run
-    preprocess_pipeline('data/complaints.csv', 'data/filtered_complaints.csv')
+    parser = argparse.ArgumentParser(description="Filter and clean the CFPB complaint export.")
+    parser.add_argument("--input", default="data/complaints.csv")
+    parser.add_argument("--output", default=None,
+                        help="Output file (.csv, .parquet or .arrow).")
+    parser.add_argument("--stream", action="store_true",
+                        help="Process the input in bounded-size chunks (for multi-GB exports).")
+    parser.add_argument("--chunksize", type=int, default=100_000)
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="Worker processes for text cleaning (default: all cores).")
+    args = parser.parse_args()
+
+    if args.stream:
+        output = args.output or 'data/filtered_complaints.parquet'
+        preprocess_pipeline_streaming(args.input, output, chunksize=args.chunksize, n_jobs=args.jobs)
+    else:
+        preprocess_pipeline(args.input, args.output or 'data/filtered_complaints.csv', n_jobs=args.jobs)
@@ -0,0 +1,132 @@
+import json
+import time
+import argparse
+
+import numpy as np
+
+
+def quantize_int8(module):
+    """Dynamically quantize a torch module's Linear layers to int8, in place.
+
+    Weights are stored as int8 and activations quantized on the fly, which
+    speeds up the matmul-bound transformer layers on CPU without calibration.
+    """
+    import torch
+    return torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def pin_threads(n_threads):
+    """Pin torch's intra-op (and, where still allowed, inter-op) thread counts."""
+    import torch
+    torch.set_num_threads(n_threads)
+    try:
+        torch.set_num_interop_threads(max(1, n_threads // 2))
+    except RuntimeError:
+        # Only settable before the first parallel op ran
+        pass
+
+
+def _token_f1(a, b):
+    a, b = a.lower().split(), b.lower().split()
+    common = sum(min(a.count(t), b.count(t)) for t in set(a))
+    if not common:
+        return float(a == b)
+    precision, recall = common / len(a), common / len(b)
+    return 2 * precision * recall / (precision + recall)
+
+
+class _TokenClock:
+    """generate() streamer that records time to first new token and the token count."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.first = None
+        self.tokens = 0
+        self._puts = 0
+
+    def put(self, value):
+        self._puts += 1
+        # The first put is the prompt (or the decoder start token)
+        if self._puts == 1:
+            return
+        if self.first is None:
+            self.first = time.perf_counter()
+        self.tokens += int(np.prod(value.shape)) if hasattr(value, "shape") else 1
+
+    def end(self):
+        self.end_time = time.perf_counter()
+
+
+def _timed_generation(rag, prompt, max_new_tokens=256):
+    """Greedy generation (so fp32 and int8 are comparable) with TTFT and tokens/s."""
+    inputs = rag.tokenizer(prompt, return_tensors="pt", truncation=True, max_length=rag.prompt_tokens)
+    clock = _TokenClock()
+    output = rag.model.generate(**inputs, streamer=clock, max_new_tokens=max_new_tokens, do_sample=False)
+    text = rag.tokenizer.decode(output[0], skip_special_tokens=True)
+    decode_s = clock.end_time - (clock.first or clock.end_time)
+    return text, {
+        "ttft_ms": ((clock.first or clock.end_time) - clock.start) * 1000,
+        "tokens_per_s": (clock.tokens - 1) / decode_s if decode_s > 0 and clock.tokens > 1 else 0.0,
+    }
+
+
+def compare_with_fp32(fp32_rag, int8_rag, questions, top_n=5):
+    """Per-question agreement and speed of an int8 pipeline against the fp32 one.
+
+    Reports the cosine similarity of the question embeddings, the overlap of
+    the re-ranked top ``top_n`` chunks, the token F1 between the greedy
+    answers and each side's time to first token and tokens per second.
+    """
+    rows = []
+    for question in questions:
+        e32 = np.asarray(fp32_rag.embeddings.embed_query(question))
+        e8 = np.asarray(int8_rag.embeddings.embed_query(question))
+        cosine = float(e32 @ e8 / (np.linalg.norm(e32) * np.linalg.norm(e8)))
+
+        labels32, docs = fp32_rag._retrieve_and_rerank(question)
+        labels8, _ = int8_rag._retrieve_and_rerank(question)
+        overlap = len(set(labels32[:top_n]) & set(labels8[:top_n])) / max(1, min(top_n, len(labels32)))
+
+        prompt, _ = fp32_rag._build_prompt(question, "", docs, labels32)
+        text32, speed32 = _timed_generation(fp32_rag, prompt)
+        text8, speed8 = _timed_generation(int8_rag, prompt)
+        row = {
+            "question": question,
+            "embedding_cosine": cosine,
+            "rerank_overlap": overlap,
+            "answer_f1": _token_f1(text32, text8),
+            "fp32": speed32,
+            "int8": speed8,
+        }
+        rows.append(row)
+        print(f"{question[:50]:<50} cos={cosine:.4f} overlap={overlap:.2f} f1={row['answer_f1']:.2f} "
+              f"ttft {speed32['ttft_ms']:.0f}->{speed8['ttft_ms']:.0f}ms "
+              f"tok/s {speed32['tokens_per_s']:.1f}->{speed8['tokens_per_s']:.1f}")
+    return rows
+
+
+if __name__ == "__main__":
+    try:
+        from .rag_pipeline import RAGPipeline, EVAL_QUESTIONS
+    except ImportError:
+        from rag_pipeline import RAGPipeline, EVAL_QUESTIONS
+
+    parser = argparse.ArgumentParser(description="Check int8 inference quality and speed against fp32.")
+    parser.add_argument("--store", default="vector_store/faiss_index")
+    parser.add_argument("--threads", type=int, default=None, help="Pin torch to this many threads.")
+    parser.add_argument("--json", default=None, help="Write per-question results to this JSON file.")
+    args = parser.parse_args()
+
+    fp32 = RAGPipeline(args.store, torch_threads=args.threads, answer_cache_size=0)
+    int8 = RAGPipeline(args.store, torch_threads=args.threads, answer_cache_size=0, quantize=True)
+    results = compare_with_fp32(fp32, int8, EVAL_QUESTIONS)
+
+    mean = lambda key, side=None: float(np.mean([r[side][key] if side else r[key] for r in results]))
+    print(f"\nMean: embedding cosine {mean('embedding_cosine'):.4f}, rerank overlap {mean('rerank_overlap'):.2f}, "
+          f"answer F1 {mean('answer_f1'):.2f}")
+    print(f"TTFT {mean('ttft_ms', 'fp32'):.0f}ms -> {mean('ttft_ms', 'int8'):.0f}ms, "
+          f"tokens/s {mean('tokens_per_s', 'fp32'):.1f} -> {mean('tokens_per_s', 'int8'):.1f}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {args.json}")
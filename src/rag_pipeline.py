@@ -1,43 +1,101 @@
 import os
+import numpy as np
 import pandas as pd
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
+import time
+import contextvars
 from langchain_core.prompts import PromptTemplate
-from transformers import pipeline, AutoModelForSeq2SeqLM, AutoTokenizer, TextIteratorStreamer
-from threading import Thread
-from sentence_transformers import CrossEncoder
+from threading import Lock
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import faiss
+
+try:
+    from .embedding_cache import cached_embeddings
+    from .docstore import ColumnarDocstore
+    from .indexing import (load_vector_store, load_lexical_index, load_chunk_tokens, unwrap_index, selector_bitmap, filtered_search_params,
+                           filter_options, index_version, GENERATOR_MODEL_ID)
+    from .lexical import reciprocal_rank_fusion
+    from .reranking import ScoreCache, prune_candidates
+    from .quantization import quantize_int8, pin_threads
+    from .metrics import Metrics, GenerationClock
+    from .answer_cache import AnswerCache, ReplayStream, RecordingStream
+    from .generation_pool import GenerationPool, GenerationHandle, StopOnHandle
+    from .snapshots import IndexSnapshot, resolve_index
+except ImportError:
+    from embedding_cache import cached_embeddings
+    from docstore import ColumnarDocstore
+    from indexing import (load_vector_store, load_lexical_index, load_chunk_tokens, unwrap_index, selector_bitmap, filtered_search_params,
+                          filter_options, index_version, GENERATOR_MODEL_ID)
+    from lexical import reciprocal_rank_fusion
+    from reranking import ScoreCache, prune_candidates
+    from quantization import quantize_int8, pin_threads
+    from metrics import Metrics, GenerationClock
+    from answer_cache import AnswerCache, ReplayStream, RecordingStream
+    from generation_pool import GenerationPool, GenerationHandle, StopOnHandle
+    from snapshots import IndexSnapshot, resolve_index
+
+RERANKER_MODEL_ID = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+# (pipeline, IndexSnapshot) pinned by the request running in this context
+_pinned_index = contextvars.ContextVar("rag_index", default=None)
+
+EVAL_QUESTIONS = [
+    "What are the common issues reported for Credit cards?",
+    "How do customers describe problems with money transfers?",
+    "Are there complaints about savings account interest rates?",
+    "What are the main sub-products in the Personal Loan category?",
+    "Does the data contain any Buy Now Pay Later (BNPL) complaints?"
+]
+
+class _Component:
+    """RAGPipeline attribute that resolves to a background-loaded component.
+
+    Reading it waits for the component's loader if it is not ready yet;
+    assigning it replaces the component outright.
+    """
+
+    def __init__(self, name=None):
+        self.name = name
+
+    def __set_name__(self, owner, name):
+        self.name = self.name or name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return obj._get_component(self.name)
+
+    def __set__(self, obj, value):
+        obj._components[self.name] = value
+
+class _IndexAttribute:
+    """RAGPipeline attribute that lives on the index snapshot the current request is pinned to."""
+
+    def __init__(self, field=None):
+        self.field = field
+
+    def __set_name__(self, owner, name):
+        self.field = self.field or name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return getattr(obj._current_index(), self.field)
+
+    def __set__(self, obj, value):
+        setattr(obj._current_index(), self.field, value)
 
 class RAGPipeline:
-    def __init__(self, vector_store_path="vector_store/faiss_index", model_name="all-MiniLM-L6-v2"):
-        print(f"Loading embedding model: {model_name}...")
-        self.embeddings = HuggingFaceEmbeddings(model_name=model_name)
-        
-        print(f"Loading vector store from: {vector_store_path}...")
-        self.vector_store = FAISS.load_local(
-            vector_store_path, 
-            self.embeddings, 
-            allow_dangerous_deserialization=True
-        )
-        
-        # Generator Setup
-        model_id = "google/flan-t5-small"
-        print(f"Loading local LLM: {model_id}...")
-        self.tokenizer = AutoTokenizer.from_pretrained(model_id)
-        self.model = AutoModelForSeq2SeqLM.from_pretrained(model_id)
-        
-        # Re-ranker Setup
-        print("Loading Cross-Encoder for re-ranking...")
-        self.reranker = CrossEncoder('cross-encoder/ms-marco-MiniLM-L-6-v2')
-        
-        self.pipe = pipeline(
-            "text2text-generation", 
-            model=self.model, 
-            tokenizer=self.tokenizer,
-            max_new_tokens=256, 
-            device=-1 # CPU
-        )
-        
-        self.template = """You are 'CrediTrust AI', a sophisticated financial analyst assistant. 
+    # Sampling settings shared by every generation path
+    GENERATION_KWARGS = dict(
+        max_new_tokens=256,
+        min_new_tokens=20,
+        repetition_penalty=1.2,
+        do_sample=True,
+        temperature=0.7
+    )
+
+    template = """You are 'CrediTrust AI', a sophisticated financial analyst assistant. 
 
 Your Goal:
 1. Be helpful, professional, and descriptive.
@@ -55,6 +113,319 @@ User Question: {question}
 
 Helpful Response:"""
 
+    embeddings = _Component()
+    # The live IndexSnapshot, loaded as the "vector_store" component
+    index = _Component("vector_store")
+    tokenizer = _Component()
+    model = _Component()
+    reranker = _Component()
+
+    # Everything tied to one version of the index lives on its IndexSnapshot
+    vector_store = _IndexAttribute()
+    lexical_index = _IndexAttribute()
+    chunk_tokens = _IndexAttribute()
+    index_version = _IndexAttribute("version")
+    _selectors = _IndexAttribute("selectors")
+
+    # Readiness groups shown in the UI, and the components each one needs
+    READINESS_GROUPS = {
+        "embeddings": ("embeddings",),
+        "vector_store": ("vector_store",),
+        "generator": ("tokenizer", "model"),
+        "reranker": ("reranker",),
+    }
+
+    def __init__(self, vector_store_path="vector_store/faiss_index", model_name="all-MiniLM-L6-v2",
+                 nprobe=None, ef_search=None, answer_cache_size=256, answer_cache_ttl=3600,
+                 semantic_cache_threshold=None, fast_start=False, generation_workers=1,
+                 max_pending_generations=8, generation_timeout=120, hybrid=True, rrf_k=60,
+                 rerank_batch_size=64, rerank_prune_margin=0.25, rerank_early_stop=None,
+                 rerank_cache_size=50_000, prompt_tokens=512, history_tokens=128, quantize=False,
+                 torch_threads=None, metrics_window=1000, trace_log=None, refresh_interval=5):
+        """Start loading all components concurrently on a thread pool.
+
+        The embedder and index come first so retrieval is ready early. With
+        ``fast_start`` the constructor returns at once and components are
+        awaited on first use. The other options (caches, generation pool,
+        hybrid search, re-ranking, prompt budget, quantization, metrics and
+        snapshot refresh) are described in the README; ``prompt_tokens=None``
+        disables prompt packing and ``refresh_interval=None`` auto-reloading.
+        """
+        self.vector_store_path = vector_store_path
+        self.model_name = model_name
+        self._search_params = {"nprobe": nprobe, "ef_search": ef_search}
+        self._index_lock = Lock()
+        self._reloader = None
+        self._reloading = None
+        self.refresh_interval = refresh_interval
+        self._last_update_check = time.monotonic()
+        self.hybrid = hybrid
+        self.rrf_k = rrf_k
+        self.rerank_batch_size = rerank_batch_size
+        self.rerank_prune_margin = rerank_prune_margin
+        self.rerank_early_stop = rerank_early_stop
+        self.rerank_cache = ScoreCache(rerank_cache_size)
+        self.prompt_tokens = prompt_tokens
+        self.history_tokens = history_tokens
+        self._template_tokens = None
+        self.quantize = quantize
+        self.metrics = Metrics(metrics_window, trace_log)
+        if torch_threads:
+            pin_threads(torch_threads)
+        self._pipe = None
+        self._pipe_lock = Lock()
+        self.load_times = {}
+        
+        # Response cache: exact (and optionally semantic) reuse of recent answers
+        self.answer_cache = None
+        if answer_cache_size:
+            self.answer_cache = AnswerCache(answer_cache_size, answer_cache_ttl, semantic_cache_threshold)
+        
+        # Bounded generation: a burst of questions queues (or is rejected) instead of oversubscribing the CPU
+        self.generation_pool = GenerationPool(generation_workers, max_pending_generations)
+        self.generation_timeout = generation_timeout
+        
+        self._components = {}
+        self._loader = ThreadPoolExecutor(max_workers=4, thread_name_prefix="rag-load")
+        # Filled one by one: the index loader looks up the embedder's future while later ones are submitted
+        self._futures = {}
+        for name, loader in (
+            ("embeddings", self._load_embeddings),
+            ("vector_store", self._load_index),
+            ("tokenizer", self._load_tokenizer),
+            ("model", self._load_model),
+            ("reranker", self._load_reranker),
+        ):
+            self._futures[name] = self._loader.submit(self._timed, name, loader)
+        self._loader.shutdown(wait=not fast_start)
+        if not fast_start:
+            for name in self._futures:
+                self._get_component(name)
+
+    def _timed(self, name, loader):
+        start = time.perf_counter()
+        value = loader()
+        self.load_times[name] = time.perf_counter() - start
+        print(f"Loaded {name} in {self.load_times[name]:.1f}s")
+        return value
+
+    def _load_embeddings(self):
+        print(f"Loading embedding model: {self.model_name}...")
+        # Shared on-disk cache with indexing, so repeated queries skip the encoder
+        return cached_embeddings(self.model_name, quantize=self.quantize)
+
+    def _load_index(self):
+        path, version = resolve_index(self.vector_store_path)
+        print(f"Loading vector store from: {path}...")
+        embeddings = self.embeddings
+        # Columnar, memory-mapped docstore: no unpickling, pages shared between workers
+        vector_store = load_vector_store(path, embeddings, mmap=True)
+        self._apply_search_params(vector_store.index, **self._search_params)
+        return IndexSnapshot(
+            path, version or index_version(path), vector_store,
+            lexical_index=load_lexical_index(path) if self.hybrid else None,
+            chunk_tokens=load_chunk_tokens(path, GENERATOR_MODEL_ID),
+        )
+
+    def _current_index(self):
+        """The snapshot pinned by the running request, else the live one."""
+        pinned = _pinned_index.get()
+        if pinned is not None and pinned[0] is self:
+            return pinned[1]
+        return self.index
+
+    @contextmanager
+    def pin_index(self, snapshot=None):
+        """Serve the with block from one index snapshot, even if a new one is swapped in meanwhile.
+
+        ``snapshot`` (default: the live one) is pinned unless it was retired
+        with no requests left on it, in which case the live one is used.
+        """
+        with self._index_lock:
+            # acquire() and retire() decide under the snapshot's lock, so a swap
+            # can never drop the data of a snapshot this pins
+            if snapshot is None or not snapshot.acquire():
+                snapshot = self._current_index()
+                snapshot.acquire()
+        token = _pinned_index.set((self, snapshot))
+        try:
+            yield snapshot
+        finally:
+            _pinned_index.reset(token)
+            snapshot.release()
+
+    def reload_index(self):
+        """Load the current snapshot in the background and swap it in; returns a Future of it.
+
+        The models stay loaded. Requests already running finish on the old
+        snapshot, which is released after the last of them.
+        """
+        with self._index_lock:
+            if self._reloading is None or self._reloading.done():
+                if self._reloader is None:
+                    self._reloader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rag-reload")
+                self._reloading = self._reloader.submit(self._swap_index)
+            return self._reloading
+
+    def _swap_index(self):
+        start = time.perf_counter()
+        snapshot = self._load_index()
+        with self._index_lock:
+            old, self.index = self.index, snapshot
+        # Cached re-ranker scores are keyed by version; free the old ones
+        self.rerank_cache.clear()
+        old.retire()
+        self.load_times["index_reload"] = time.perf_counter() - start
+        print(f"Swapped in index {snapshot.version} ({self.load_times['index_reload']:.1f}s); "
+              f"{old.active} requests still on {old.version}")
+        return snapshot
+
+    def check_for_update(self, force=False):
+        """Reload the index if a newer snapshot was published.
+
+        Cheap enough to call per request: the store is checked at most every
+        ``refresh_interval`` seconds (None: only when forced). A plain store,
+        which indexing rewrites file by file, is only reloaded when forced,
+        since it may be caught half-written. Returns the reload's Future, or None.
+        """
+        now = time.monotonic()
+        if not force:
+            interval = self.refresh_interval
+            if interval is None or now - self._last_update_check < interval:
+                return None
+        self._last_update_check = now
+        if self._component_state("vector_store") != "ready":
+            return None
+        path, version = resolve_index(self.vector_store_path)
+        if version is None and not force:
+            return None
+        if (version or index_version(path)) == self.index.version:
+            return None
+        return self.reload_index()
+
+    def index_info(self):
+        """Version, path and in-flight requests of the live index snapshot."""
+        if self._component_state("vector_store") != "ready":
+            return {}
+        snapshot = self.index
+        return {"version": snapshot.version, "path": snapshot.path, "loaded_at": snapshot.loaded_at,
+                "active_requests": snapshot.active,
+                "reloading": self._reloading is not None and not self._reloading.done()}
+
+    def _load_tokenizer(self):
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(GENERATOR_MODEL_ID)
+
+    def _load_model(self):
+        from transformers import AutoModelForSeq2SeqLM
+        print(f"Loading local LLM: {GENERATOR_MODEL_ID}...")
+        model = AutoModelForSeq2SeqLM.from_pretrained(GENERATOR_MODEL_ID)
+        return quantize_int8(model) if self.quantize else model
+
+    def _load_reranker(self):
+        from sentence_transformers import CrossEncoder
+        print("Loading Cross-Encoder for re-ranking...")
+        reranker = CrossEncoder(RERANKER_MODEL_ID)
+        if self.quantize:
+            import torch
+            quantize_int8(reranker if isinstance(reranker, torch.nn.Module) else reranker.model)
+        return reranker
+
+    def _get_component(self, name):
+        if name not in self._components:
+            self._components[name] = self._futures[name].result()
+        return self._components[name]
+
+    def _component_state(self, name):
+        if name in self._components:
+            return "ready"
+        future = self._futures[name]
+        if not future.done():
+            return "loading"
+        return "failed" if future.exception() is not None else "ready"
+
+    def readiness(self):
+        """{group: "ready" | "loading" | "failed"} for the embedder, index, generator and re-ranker."""
+        status = {}
+        for group, names in self.READINESS_GROUPS.items():
+            states = [self._component_state(name) for name in names]
+            status[group] = ("failed" if "failed" in states
+                             else "loading" if "loading" in states else "ready")
+        return status
+
+    def is_ready(self, *groups):
+        """True when all given readiness groups (default: all) are loaded."""
+        status = self.readiness()
+        return all(status[g] == "ready" for g in (groups or status))
+
+    def rerank_stats(self):
+        """Cross-encoder pairs scored versus skipped (cached, pruned or early-stopped)."""
+        return self.rerank_cache.stats()
+
+    def latency_summary(self):
+        """p50/p95/p99 per pipeline stage over the recent window, plus TTFT and tokens/s."""
+        return self.metrics.summary()
+
+    def _stage(self, name):
+        """Time a pipeline stage."""
+        return self.metrics.stage(name)
+
+    def _trace(self, kind, **attrs):
+        """Trace a whole request; yields its Trace."""
+        return self.metrics.trace(kind, **attrs)
+
+    def embedding_cache_stats(self):
+        """Hit/miss counters of the embedding cache (empty while the embedder loads)."""
+        if self.readiness()["embeddings"] != "ready":
+            return {}
+        stats = getattr(self.embeddings, "stats", None)
+        return stats() if stats else {}
+
+    def health(self):
+        """Readiness, load times, cache/pool/re-ranker counters, latency and index info in one call."""
+        return {
+            "readiness": self.readiness(),
+            "load_times": self.load_times,
+            "embedding_cache": self.embedding_cache_stats(),
+            "generation_pool": self.generation_stats(),
+            "reranker": self.rerank_stats(),
+            "latency": self.latency_summary(),
+            "index": self.index_info(),
+        }
+
+    @property
+    def pipe(self):
+        """text2text-generation pipeline around the generator, built on first use."""
+        if self._pipe is None:
+            with self._pipe_lock:
+                if self._pipe is None:
+                    from transformers import pipeline
+                    self._pipe = pipeline(
+                        "text2text-generation", 
+                        model=self.model, 
+                        tokenizer=self.tokenizer,
+                        max_new_tokens=256, 
+                        device=-1 # CPU
+                    )
+        return self._pipe
+
+    def set_search_params(self, nprobe=None, ef_search=None):
+        """Tune ANN search: IVF lists probed (nprobe) and HNSW candidate list size (efSearch).
+
+        Parameters that do not apply to the loaded index type are ignored.
+        """
+        self._search_params = {"nprobe": nprobe, "ef_search": ef_search}
+        self._apply_search_params(self.vector_store.index, nprobe, ef_search)
+
+    @staticmethod
+    def _apply_search_params(index, nprobe=None, ef_search=None):
+        params = faiss.ParameterSpace()
+        base = unwrap_index(index)
+        if nprobe is not None and isinstance(base, faiss.IndexIVF):
+            params.set_index_parameter(index, "nprobe", int(nprobe))
+        if ef_search is not None and isinstance(base, faiss.IndexHNSW):
+            params.set_index_parameter(index, "efSearch", int(ef_search))
+
     def _get_variants(self, query):
         """Simple rule-based multi-query variation for recall boost."""
         variants = [query]
@@ -69,97 +440,371 @@ Helpful Response:"""
                 variants.extend(vals)
         return list(set(variants))
 
-    def _rerank_docs(self, query, docs, top_n=5):
-        """Use Cross-Encoder to re-rank retrieved documents."""
-        if not docs:
-            return []
-        
-        pairs = [[query, d.page_content] for d in docs]
-        scores = self.reranker.predict(pairs)
-        
-        # Sort documents by scores
-        ranked_docs = [d for _, d in sorted(zip(scores, docs), key=lambda x: x[0], reverse=True)]
-        return ranked_docs[:top_n]
+    def filter_options(self):
+        """{product: [sub_products]} available for filtered retrieval."""
+        with self.pin_index():
+            if "options" not in self._selectors:
+                docstore = self.vector_store.docstore
+                self._selectors["options"] = filter_options(docstore) if isinstance(docstore, ColumnarDocstore) else {}
+            return self._selectors["options"]
+
+    @staticmethod
+    def _filter_key(product=None, sub_product=None):
+        """Hashable form of a product/sub-product filter."""
+        as_key = lambda v: tuple(v) if isinstance(v, (list, tuple)) else v
+        return as_key(product), as_key(sub_product)
+
+    def _selector(self, product=None, sub_product=None):
+        """Cached (bitmap, matching rows) for a product/sub-product filter."""
+        key = self._filter_key(product, sub_product)
+        if key not in self._selectors:
+            docstore = self.vector_store.docstore
+            if not isinstance(docstore, ColumnarDocstore):
+                raise ValueError("Product filters need an index built with the columnar docstore; re-run indexing.")
+            self._selectors[key] = selector_bitmap(docstore, product, sub_product)
+        return self._selectors[key]
+
+    def _retrieve(self, question, k=20, product=None, sub_product=None):
+        """Multi-query retrieval: embed all variants in one batch, search them in one FAISS call.
+
+        With a product/sub-product filter only the matching slice of the
+        index is searched. Returns FAISS labels (docstore rows), best first.
+        """
+        return self._retrieve_many([(question, k, product, sub_product)])[0]
+
+    def _retrieve_many(self, requests, with_distances=False):
+        """Batched _retrieve over (question, k, product, sub_product) tuples.
+
+        The variants of all questions are embedded in one call, and
+        questions sharing a filter are searched with one FAISS call. When a
+        BM25 index is loaded, its hits for the question and its variants are
+        fused with the dense ones by reciprocal rank, keeping the top ``k``.
+
+        With ``with_distances`` each result is a (labels, {label: dense
+        distance}) pair, for pruning before re-ranking.
+        """
+        with self._stage("expansion"):
+            variants = [self._get_variants(question) for question, *_ in requests]
+        embed_batch = getattr(self.embeddings, "embed_queries", self.embeddings.embed_documents)
+        with self._stage("embedding"):
+            vectors = np.asarray(embed_batch([v for vs in variants for v in vs]), dtype=np.float32)
+        starts = np.cumsum([0] + [len(vs) for vs in variants])
+
+        groups = {}
+        for i, (_, _, product, sub_product) in enumerate(requests):
+            groups.setdefault(self._filter_key(product, sub_product), []).append(i)
+
+        results = [[] for _ in requests]
+        dense_distances = [{} for _ in requests]
+        for (product, sub_product), members in groups.items():
+            per_variant = {i: max(1, requests[i][1] // len(variants[i])) for i in members}
+            params = None
+            if product is not None or sub_product is not None:
+                bitmap, n_matching = self._selector(product, sub_product)
+                if n_matching == 0:
+                    continue
+                per_variant = {i: min(n, n_matching) for i, n in per_variant.items()}
+                params = filtered_search_params(self.vector_store.index, bitmap, len(self.vector_store.docstore))
+
+            rows = np.concatenate([np.arange(starts[i], starts[i + 1]) for i in members])
+            with self._stage("dense_search"):
+                distances, ids = self.vector_store.index.search(vectors[rows], max(per_variant.values()),
+                                                                params=params)
+
+            offset = 0
+            for i in members:
+                n_rows, n_hits = len(variants[i]), per_variant[i]
+                # De-duplicate hits across variants by vector id, keeping the best distance
+                best = {}
+                for row_distances, row_ids in zip(distances[offset:offset + n_rows, :n_hits],
+                                                  ids[offset:offset + n_rows, :n_hits]):
+                    for dist, vid in zip(row_distances, row_ids):
+                        if vid != -1 and (vid not in best or dist < best[vid]):
+                            best[vid] = dist
+                results[i] = [int(vid) for vid, _ in sorted(best.items(), key=lambda x: x[1])]
+                dense_distances[i] = {int(vid): float(dist) for vid, dist in best.items()}
+                offset += n_rows
+
+        lexical = self.lexical_index
+        if lexical is not None:
+            for i, (_, k, product, sub_product) in enumerate(requests):
+                mask = None
+                if product is not None or sub_product is not None:
+                    bitmap, n_matching = self._selector(product, sub_product)
+                    if n_matching == 0:
+                        continue
+                    mask = np.unpackbits(bitmap, bitorder="little").astype(bool)
+                with self._stage("lexical_search"):
+                    hits = lexical.search(" ".join(variants[i]), k, mask)
+                results[i] = reciprocal_rank_fusion([results[i], [int(h) for h in hits]],
+                                                    self.rrf_k, limit=k)
+        if with_distances:
+            return list(zip(results, dense_distances))
+        return results
+
+    def _text(self, label):
+        docstore = self.vector_store.docstore
+        if isinstance(docstore, ColumnarDocstore):
+            return docstore.text(label)
+        return self._document(label).page_content
+
+    def _document(self, label):
+        docstore = self.vector_store.docstore
+        if isinstance(docstore, ColumnarDocstore):
+            return docstore.document(label)
+        return docstore.search(self.vector_store.index_to_docstore_id[label])
+
+    def _rerank(self, query, labels, top_n=5, distances=None):
+        """Use Cross-Encoder to re-rank retrieved chunks; returns the top labels."""
+        return self._rerank_many([query], [labels], top_n, [distances])[0]
+
+    def _rerank_many(self, queries, label_lists, top_n=5, distances=None):
+        """Batched _rerank: the uncached (query, chunk) pairs of all queries go through one predict call.
+
+        ``distances`` holds each query's {label: dense distance} map, used to
+        prune candidates far below the best dense hit. With early stopping
+        there is one predict call per step instead.
+        """
+        cache = self.rerank_cache
+        # Labels are only meaningful within one index version
+        keys = [(self.index_version, query) for query in queries]
+        distances = distances or [None] * len(queries)
+        candidates = []
+        for labels, dists in zip(label_lists, distances):
+            kept = prune_candidates(labels, dists, top_n, self.rerank_prune_margin)
+            cache.count(pruned=len(labels) - len(kept))
+            candidates.append(kept)
+
+        scores = [cache.lookup(key, labels) for key, labels in zip(keys, candidates)]
+        pending = [[label for label in labels if label not in found] for labels, found in zip(candidates, scores)]
+        step = self.rerank_early_stop
+        while any(pending):
+            batch = [labels[:step] if step else labels for labels in pending]
+            pairs = [[query, self._text(label)] for query, labels in zip(queries, batch) for label in labels]
+            with self._stage("rerank"):
+                batch_scores = self.reranker.predict(pairs, batch_size=self.rerank_batch_size)
+
+            offset = 0
+            for i, labels in enumerate(batch):
+                new = [float(score) for score in batch_scores[offset:offset + len(labels)]]
+                offset += len(labels)
+                cache.store(keys[i], labels, new)
+                # top_n is settled once a step scores nothing above the current top_n-th score
+                bar = sorted(scores[i].values(), reverse=True)[top_n - 1] if len(scores[i]) >= top_n else None
+                scores[i].update(zip(labels, new))
+                pending[i] = pending[i][len(labels):]
+                if step and bar is not None and pending[i] and all(score <= bar for score in new):
+                    cache.count(early_stopped=len(pending[i]))
+                    pending[i] = []
+
+        # Ties keep retrieval order; early-stopped labels have no score and drop out
+        return [sorted((label for label in labels if label in found), key=lambda label: -found[label])[:top_n]
+                for labels, found in zip(candidates, scores)]
+
+    def _retrieve_and_rerank(self, question, k=20, product=None, sub_product=None):
+        """Retrieval + re-ranking; returns (labels, Documents) for the chunks that survive."""
+        labels, distances = self._retrieve_many([(question, k, product, sub_product)], with_distances=True)[0]
+        labels = self._rerank(question, labels, distances=distances)
+        return labels, [self._document(label) for label in labels]
+
+    def _build_prompt(self, question, history, docs, labels=None):
+        """Prompt for ``docs``, packed to the token budget; returns (prompt, docs used)."""
+        if self.prompt_tokens:
+            with self._stage("prompt"):
+                history, docs, snippets = self._pack(question, history, docs, labels)
+        else:
+            snippets = [d.page_content for d in docs]
+        context = "\n\n".join([f"Snippet {i+1}: {text}" for i, text in enumerate(snippets)])
+        return self.template.format(history=history, context=context, question=question), docs
+
+    def _count_tokens(self, text):
+        return len(self.tokenizer(text, add_special_tokens=False)["input_ids"])
 
-    def answer_question(self, question, history="", k=20):
+    def _pack(self, question, history, docs, labels=None):
+        """Fit question, recent history and chunks into ``prompt_tokens``.
+
+        Chunk sizes come from the index-time token counts when ``labels``
+        are known, so only the question and history are tokenized here. A
+        chunk that does not fit is skipped; with stored token ids the first
+        one that does not fit is cut to the remaining budget instead.
+        """
+        if self._template_tokens is None:
+            # Template text plus the end-of-sequence token
+            self._template_tokens = self._count_tokens(self.template.format(history="", context="", question="")) + 1
+        remaining = self.prompt_tokens - self._template_tokens - self._count_tokens(question)
+
+        # Most recent history lines first, up to the history budget
+        kept, used = [], 0
+        for line in reversed(history.splitlines()):
+            cost = self._count_tokens(line)
+            if used + cost > min(self.history_tokens, remaining):
+                break
+            kept.insert(0, line)
+            used += cost
+        history = "\n".join(kept) + ("\n" if kept else "")
+        remaining -= used
+
+        tokens = self.chunk_tokens
+        prefix_cost = self._count_tokens("Snippet 10:")
+        packed_docs, snippets, cut = [], [], False
+        for i, doc in enumerate(docs):
+            label = labels[i] if labels is not None else None
+            count = tokens.count(label) if tokens is not None and label is not None else None
+            if count is None:
+                count = self._count_tokens(doc.page_content)
+            cost = prefix_cost + count
+            if cost <= remaining:
+                packed_docs.append(doc)
+                snippets.append(doc.page_content)
+                remaining -= cost
+                continue
+            ids = tokens.ids(label) if tokens is not None and label is not None and not cut else None
+            if ids is not None and remaining - prefix_cost >= 32:
+                packed_docs.append(doc)
+                snippets.append(self.tokenizer.decode(ids[:remaining - prefix_cost].tolist()))
+                remaining = 0
+                cut = True
+        return history, packed_docs, snippets
+
+    def generation_stats(self):
+        """Queue depth, in-flight count and outcomes of the generation pool."""
+        return self.generation_pool.stats()
+
+    def _stopping_criteria(self, handle, clock=None):
+        from transformers import StoppingCriteriaList
+        return StoppingCriteriaList([StopOnHandle(handle)] + ([clock] if clock is not None else []))
+
+    def _record_generation(self, trace, clock, seconds):
+        """Record generation time, time to first token and decode rate for a traced request."""
+        self.metrics.observe("generation", seconds, trace=trace)
+        if clock.first is not None:
+            self.metrics.observe("ttft", clock.first - trace.start, trace=trace)
+        if clock.tokens_per_second() is not None:
+            self.metrics.observe_rate("tokens_per_second", clock.tokens_per_second(), trace=trace)
+
+    def _run_pipe(self, prompt, trace=None, handle=None, **kwargs):
+        """Run the generation pipeline on the pool and wait for its text.
+
+        Raises TimeoutError if the request expired before a worker picked it up.
+        """
+        handle = handle or GenerationHandle(self.generation_timeout)
+        clock = GenerationClock() if trace is not None else None
+        start = time.perf_counter()
+        self.generation_pool.submit(
+            lambda: self.pipe(prompt, stopping_criteria=self._stopping_criteria(handle, clock), **kwargs), handle)
+        response = handle.result()
+        if response is None:
+            raise TimeoutError(f"Generation did not start within {self.generation_timeout}s")
+        if trace is not None:
+            self._record_generation(trace, clock, time.perf_counter() - start)
+        return response[0]["generated_text"]
+
+    def generate(self, prompt, **kwargs):
+        """Plain text generation with the local LLM (e.g. session summaries)."""
+        return self._run_pipe(prompt, **kwargs)
+
+    def _cache_lookup(self, question, params):
+        """Return (cached answer or None, question embedding used for the semantic tier)."""
+        if self.answer_cache is None:
+            return None, None
+        self.answer_cache.check_version(self.index_version)
+        embedding = None
+        if self.answer_cache.semantic_threshold is not None:
+            embedding = self.embeddings.embed_query(question)
+        return self.answer_cache.get(question, params, embedding), embedding
+
+    def _cache_store(self, question, params, answer, embedding, version):
+        """Cache an answer built from index ``version`` (dropped if a newer index is live by now)."""
+        if self.answer_cache is not None:
+            self.answer_cache.put(question, params, answer, embedding, version)
+
+    @classmethod
+    def _cache_params(cls, history, k, product, sub_product):
+        product, sub_product = cls._filter_key(product, sub_product)
+        return {"history": history, "k": k, "product": product, "sub_product": sub_product}
+
+    def answer_question(self, question, history="", k=20, product=None, sub_product=None):
         """Advanced Hybrid RAG with Multi-Query Retrieval and Re-ranking."""
-        # 1. Multi-Query Retrieval
-        search_queries = self._get_variants(question)
-        all_docs = []
-        for q in search_queries:
-            all_docs.extend(self.vector_store.similarity_search(q, k=k//len(search_queries)))
-        
-        # De-duplicate docs by page_content
-        unique_docs = {d.page_content: d for d in all_docs}.values()
-        
-        # 2. Re-ranking
-        ranked_docs = self._rerank_docs(question, list(unique_docs))
-        
-        # 3. Generation
-        context = "\n\n".join([f"Snippet {i+1}: {d.page_content}" for i, d in enumerate(ranked_docs)])
-        prompt = self.template.format(history=history, context=context, question=question)
-        
-        response = self.pipe(
-            prompt, 
-            max_new_tokens=256,
-            min_new_tokens=20,
-            repetition_penalty=1.2,
-            do_sample=True,
-            temperature=0.7
-        )
-        
-        return {
-            "result": response[0]["generated_text"],
-            "source_documents": ranked_docs,
-            "prompt_used": prompt
-        }
+        with self._trace("answer") as trace:
+            params = self._cache_params(history, k, product, sub_product)
+            cached, embedding = self._cache_lookup(question, params)
+            trace.attrs["cached"] = cached is not None
+            if cached is not None:
+                return dict(cached)
+            
+            with self.pin_index() as snapshot:
+                # 1. Multi-Query Retrieval + 2. Re-ranking
+                labels, ranked_docs = self._retrieve_and_rerank(question, k, product, sub_product)
+                
+                # 3. Generation (only the chunks that fit the token budget are used and cited)
+                prompt, ranked_docs = self._build_prompt(question, history, ranked_docs, labels)
+            handle = GenerationHandle(self.generation_timeout)
+            answer = {
+                "result": self._run_pipe(prompt, trace=trace, handle=handle, **self.GENERATION_KWARGS),
+                "source_documents": ranked_docs,
+                "prompt_used": prompt
+            }
+            # An answer cut short by its deadline is returned but not cached
+            if not handle.should_stop():
+                self._cache_store(question, params, answer, embedding, snapshot.version)
+            return dict(answer)
 
-    def stream_answer(self, question, history="", k=20):
-        """Advanced Streaming RAG with Re-ranking."""
-        # 1. Retrieval
-        search_queries = self._get_variants(question)
-        all_docs = []
-        for q in search_queries:
-            all_docs.extend(self.vector_store.similarity_search(q, k=max(1, k//len(search_queries))))
-        
-        unique_docs = list({d.page_content: d for d in all_docs}.values())
-        
-        # 2. Re-ranking
-        ranked_docs = self._rerank_docs(question, unique_docs)
-        
-        # 3. Generation Setup
-        context = "\n\n".join([f"Snippet {i+1}: {d.page_content}" for i, d in enumerate(ranked_docs)])
-        prompt = self.template.format(history=history, context=context, question=question)
-        inputs = self.tokenizer(prompt, return_tensors="pt")
+    def stream_answer(self, question, history="", k=20, product=None, sub_product=None):
+        """Advanced Streaming RAG with Re-ranking.
+
+        Cached answers are replayed word by word through the same iterator interface.
+        The returned stream's cancel() stops generation early (abandoning the
+        iterator does too); PipelineBusy is raised if the generation queue is full.
+        The request is traced until the stream is read to the end, so its
+        trace includes time to first token and tokens per second.
+        """
+        trace, token = self.metrics.start_trace("stream")
+        try:
+            params = self._cache_params(history, k, product, sub_product)
+            cached, embedding = self._cache_lookup(question, params)
+            if cached is not None:
+                trace.attrs["cached"] = True
+                self.metrics.finish_trace(trace)
+                return ReplayStream(cached["result"]), cached["source_documents"]
+            
+            with self.pin_index() as snapshot:
+                # 1. Retrieval + 2. Re-ranking
+                labels, ranked_docs = self._retrieve_and_rerank(question, k, product, sub_product)
+                
+                # 3. Generation Setup
+                prompt, ranked_docs = self._build_prompt(question, history, ranked_docs, labels)
+            with self._stage("tokenize"):
+                inputs = self.tokenizer(prompt, return_tensors="pt", truncation=True, max_length=self.prompt_tokens)
+        finally:
+            self.metrics.end_trace(token)
         
+        from transformers import TextIteratorStreamer
         streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
         
-        generation_kwargs = dict(
-            **inputs, 
-            streamer=streamer, 
-            max_new_tokens=256,
-            min_new_tokens=20,
-            repetition_penalty=1.2,
-            do_sample=True,
-            temperature=0.7
-        )
-        thread = Thread(target=self.model.generate, kwargs=generation_kwargs)
-        thread.start()
+        handle = GenerationHandle(self.generation_timeout)
+        clock = GenerationClock()
+        generation_kwargs = dict(**inputs, streamer=streamer, stopping_criteria=self._stopping_criteria(handle, clock),
+                                 **self.GENERATION_KWARGS)
+        generation_start = time.perf_counter()
+        # If the request is skipped or fails, end() unblocks the consumer
+        self.generation_pool.submit(lambda: self.model.generate(**generation_kwargs), handle,
+                                    on_abort=streamer.end)
         
-        return streamer, ranked_docs
+        # Cache the answer once the consumer has read it to the end (and it was not cut short)
+        def record(text):
+            trace.attrs["cached"] = False
+            self._record_generation(trace, clock, time.perf_counter() - generation_start)
+            self.metrics.finish_trace(trace)
+            if not handle.should_stop():
+                self._cache_store(question, params, {
+                    "result": text, "source_documents": ranked_docs, "prompt_used": prompt
+                }, embedding, snapshot.version)
+        return RecordingStream(streamer, record, handle), ranked_docs
 
 def run_evaluation(rag, report_path="reports/task3_evaluation.md"):
-    eval_questions = [
-        "What are the common issues reported for Credit cards?",
-        "How do customers describe problems with money transfers?",
-        "Are there complaints about savings account interest rates?",
-        "What are the main sub-products in the Personal Loan category?",
-        "Does the data contain any Buy Now Pay Later (BNPL) complaints?"
-    ]
-    
     print("\n--- RESULTS ---")
     results = []
-    for q in eval_questions:
+    for q in EVAL_QUESTIONS:
         try:
             print(f"Querying: {q}")
             res = rag.answer_question(q)
@@ -0,0 +1,83 @@
+import threading
+from collections import OrderedDict
+
+
+class ScoreCache:
+    """Bounded LRU of cross-encoder scores keyed by (query, docstore row).
+
+    Rows are only meaningful within one index version, so callers include
+    the version in ``query`` and the pipeline clears the cache when it swaps
+    in a new snapshot. Also keeps
+    the reranker's counters: pairs scored, served from cache, pruned by
+    dense distance and skipped by early stopping.
+    """
+
+    def __init__(self, max_entries=50_000):
+        self.max_entries = max_entries
+        self._scores = OrderedDict()
+        self._lock = threading.Lock()
+        self.scored = 0
+        self.cached = 0
+        self.pruned = 0
+        self.early_stopped = 0
+
+    def lookup(self, query, labels):
+        """{label: score} for the labels already scored against ``query``."""
+        found = {}
+        with self._lock:
+            for label in labels:
+                key = (query, label)
+                if key in self._scores:
+                    self._scores.move_to_end(key)
+                    found[label] = self._scores[key]
+            self.cached += len(found)
+        return found
+
+    def store(self, query, labels, scores):
+        with self._lock:
+            for label, score in zip(labels, scores):
+                self._scores[(query, label)] = score
+                self._scores.move_to_end((query, label))
+            while len(self._scores) > self.max_entries:
+                self._scores.popitem(last=False)
+            self.scored += len(labels)
+
+    def count(self, pruned=0, early_stopped=0):
+        with self._lock:
+            self.pruned += pruned
+            self.early_stopped += early_stopped
+
+    def clear(self):
+        with self._lock:
+            self._scores.clear()
+
+    def stats(self):
+        """Pairs sent to the cross-encoder versus pairs it was spared."""
+        with self._lock:
+            skipped = self.cached + self.pruned + self.early_stopped
+            total = self.scored + skipped
+            return {
+                "scored": self.scored,
+                "cached": self.cached,
+                "pruned": self.pruned,
+                "early_stopped": self.early_stopped,
+                "skipped": skipped,
+                "skip_rate": skipped / total if total else 0.0,
+            }
+
+
+def prune_candidates(labels, distances, keep, margin):
+    """Drop candidates whose dense similarity is more than ``margin`` below the best hit.
+
+    ``distances`` maps labels to squared L2 distances between unit-norm
+    embeddings (cosine similarity = 1 - d / 2); labels without one, such as
+    lexical-only hits, are kept. The first ``keep`` labels always survive.
+    """
+    if margin is None or not distances:
+        return list(labels)
+    known = [distances[label] for label in labels if label in distances]
+    if not known:
+        return list(labels)
+    best = 1 - min(known) / 2
+    return [label for i, label in enumerate(labels)
+            if i < keep or label not in distances or best - (1 - distances[label] / 2) <= margin]
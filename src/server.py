@@ -0,0 +1,411 @@
+import json
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+from transformers import StoppingCriteriaList
+from transformers.generation.streamers import BaseStreamer
+
+try:
+    from .rag_pipeline import RAGPipeline
+    from .answer_cache import ReplayStream
+    from .generation_pool import PipelineBusy, GenerationHandle, BatchHandle, StopOnHandle
+except ImportError:
+    from rag_pipeline import RAGPipeline
+    from answer_cache import ReplayStream
+    from generation_pool import PipelineBusy, GenerationHandle, BatchHandle, StopOnHandle
+
+
+class Overloaded(Exception):
+    """A stage queue is full; the client should back off and retry."""
+
+
+class MicroBatcher:
+    """Coalesce concurrent submissions into batched calls of ``fn``.
+
+    Items wait at most ``window`` seconds for up to ``max_batch - 1`` others
+    before ``fn(list_of_items)`` runs on ``executor``; it must return one
+    result per item. The queue holds at most ``max_queue`` waiting items,
+    beyond which submit() raises Overloaded instead of queueing without bound.
+    """
+
+    def __init__(self, fn, max_batch=8, window=0.01, max_queue=64, executor=None):
+        self.fn = fn
+        self.max_batch = max_batch
+        self.window = window
+        self.max_queue = max_queue
+        self.executor = executor or ThreadPoolExecutor(max_workers=1)
+        self.batches = 0
+        self.items = 0
+        self._queue = None
+        self._worker = None
+
+    def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+
+    @property
+    def depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def submit(self, item):
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((item, future))
+        except asyncio.QueueFull:
+            raise Overloaded(f"queue full ({self.max_queue} waiting)")
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            items = [item for item, _ in batch]
+            self.batches += 1
+            self.items += len(items)
+            try:
+                results = await loop.run_in_executor(self.executor, self.fn, items)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for (_, future), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+
+
+class BatchTextStreamer(BaseStreamer):
+    """Streamer for batched generate(): decodes each row and reports new text per row.
+
+    ``callbacks[i]`` (or None) receives row ``i``'s text increments, cut at
+    word boundaries like TextIteratorStreamer. It is called from the
+    generation thread.
+    """
+
+    def __init__(self, tokenizer, callbacks):
+        self.tokenizer = tokenizer
+        self.callbacks = callbacks
+        self._tokens = [[] for _ in callbacks]
+        self._emitted = [""] * len(callbacks)
+        self._done = [False] * len(callbacks)
+        self._started = False
+
+    def put(self, value):
+        # The first call carries the decoder start tokens (the "prompt")
+        if not self._started:
+            self._started = True
+            return
+        if value.dim() > 1:
+            value = value[:, -1]
+        for i, token in enumerate(value.tolist()):
+            if self._done[i]:
+                continue
+            if token == self.tokenizer.eos_token_id:
+                self._done[i] = True
+                self._flush(i, final=True)
+                continue
+            self._tokens[i].append(token)
+            self._flush(i)
+
+    def end(self):
+        for i in range(len(self.callbacks)):
+            if not self._done[i]:
+                self._done[i] = True
+                self._flush(i, final=True)
+
+    def _flush(self, i, final=False):
+        text = self.tokenizer.decode(self._tokens[i], skip_special_tokens=True)
+        if not final:
+            text = text[:text.rfind(" ") + 1]
+        if len(text) > len(self._emitted[i]) and text.startswith(self._emitted[i]):
+            delta = text[len(self._emitted[i]):]
+            self._emitted[i] = text
+            if self.callbacks[i] is not None:
+                self.callbacks[i](delta)
+
+
+def serialize_docs(docs):
+    sources = []
+    for d in docs:
+        source = {"complaint_id": d.metadata.get("complaint_id", "N/A"),
+                  "product": d.metadata.get("product"),
+                  "sub_product": d.metadata.get("sub_product"),
+                  "content": d.page_content}
+        # Chunks collapsed from near-duplicates at index time cite all their complaints
+        if d.metadata.get("source_ids"):
+            source["source_ids"] = d.metadata["source_ids"]
+        sources.append(source)
+    return sources
+
+
+class RAGServer:
+    """asyncio serving layer that batches requests across concurrent users.
+
+    Two micro-batched stages: retrieval (one embedding pass and FAISS search
+    plus one cross-encoder predict for the whole batch) and generation (one
+    padded generate() call, streamed back per request). The stages run on
+    separate threads, so one batch can retrieve while another generates.
+    Generation batches run on the pipeline's GenerationPool, whose counters
+    count each batch as one generation.
+    """
+
+    def __init__(self, rag, max_batch=8, window_ms=10, max_queue=64):
+        self.rag = rag
+        self.retrieval = MicroBatcher(self._retrieve_batch, max_batch, window_ms / 1000, max_queue)
+        self.generation = MicroBatcher(self._generate_batch, max_batch, window_ms / 1000, max_queue)
+
+    def _retrieve_batch(self, requests):
+        # Each request stays on the index snapshot it started on, even across a hot swap.
+        # Prompts are packed here too: that tokenizes, which must not block the event loop
+        groups = {}
+        for i, r in enumerate(requests):
+            groups.setdefault(id(r.get("index")), []).append(i)
+        results = [None] * len(requests)
+        for members in groups.values():
+            batch = [requests[i] for i in members]
+            with self.rag.pin_index(batch[0].get("index")) as snapshot:
+                labels, distances = zip(*self.rag._retrieve_many(
+                    [(r["question"], r["k"], r["product"], r["sub_product"]) for r in batch], with_distances=True))
+                ranked = self.rag._rerank_many([r["question"] for r in batch], labels, distances=distances)
+                for i, row in zip(members, ranked):
+                    r = requests[i]
+                    prompt, docs = self.rag._build_prompt(r["question"], r["history"],
+                                                          [self.rag._document(label) for label in row], row)
+                    results[i] = (prompt, docs, snapshot.version)
+        return results
+
+    def _generate_batch(self, items):
+        # Requests cancelled or past their deadline while queued are skipped (None);
+        # the others each stop on their own handle
+        live = [i for i, (_, _, handle) in enumerate(items) if not handle.should_stop()]
+        results = [None] * len(items)
+        if not live:
+            return results
+        tokenizer, model = self.rag.tokenizer, self.rag.model
+        inputs = tokenizer([items[i][0] for i in live], return_tensors="pt", padding=True)
+        streamer = BatchTextStreamer(tokenizer, [items[i][1] for i in live])
+        handles = [items[i][2] for i in live]
+        stop = StoppingCriteriaList([StopOnHandle(*handles)])
+        # One pool job per batch: it shares the pool's workers, queue bound and counters with
+        # every other generation, and is skipped if all its requests stop while it waits
+        batch = self.rag.generation_pool.submit(
+            lambda: model.generate(**inputs, streamer=streamer, stopping_criteria=stop, **self.rag.GENERATION_KWARGS),
+            BatchHandle(handles), on_abort=streamer.end)
+        outputs = batch.result()
+        if outputs is None:
+            return results
+        for i, text in zip(live, tokenizer.batch_decode(outputs, skip_special_tokens=True)):
+            results[i] = text
+        return results
+
+    @staticmethod
+    def _request(payload):
+        if not payload.get("question"):
+            raise web.HTTPBadRequest(text="'question' is required")
+        return {
+            "question": payload["question"],
+            "history": payload.get("history", ""),
+            "k": int(payload.get("k", 20)),
+            "product": payload.get("product"),
+            "sub_product": payload.get("sub_product"),
+        }
+
+    async def answer(self, request, on_sources=None, on_text=None, handle=None):
+        """Run one request through the cache and the batched stages.
+
+        ``handle`` (a GenerationHandle) carries the generation deadline and lets
+        the caller cancel it; raises TimeoutError if it stopped before generating.
+        """
+        rag = self.rag
+        handle = handle or GenerationHandle(rag.generation_timeout)
+        loop = asyncio.get_running_loop()
+        params = rag._cache_params(request["history"], request["k"], request["product"], request["sub_product"])
+        cached, embedding = await loop.run_in_executor(None, rag._cache_lookup, request["question"], params)
+        if cached is not None:
+            if on_sources:
+                on_sources(cached["source_documents"])
+            if on_text:
+                for piece in ReplayStream(cached["result"]):
+                    on_text(piece)
+            return {**cached, "cached": True}
+
+        # Checking the manifest and waiting for the first index load happen off the event loop
+        await loop.run_in_executor(None, rag.check_for_update)
+        index = await loop.run_in_executor(None, rag._current_index)
+        prompt, docs, version = await self.retrieval.submit({**request, "index": index})
+        if on_sources:
+            on_sources(docs)
+        text = await self.generation.submit((prompt, on_text, handle))
+        if text is None:
+            raise TimeoutError(f"Generation did not start within {rag.generation_timeout}s")
+        answer = {"result": text, "source_documents": docs, "prompt_used": prompt}
+        # Answers cut short by a cancel or the deadline are not cached
+        if not handle.should_stop():
+            rag._cache_store(request["question"], params, answer, embedding, version)
+        return {**answer, "cached": False}
+
+    # --- HTTP handlers ---
+
+    async def handle_answer(self, http_request):
+        request = self._request(await http_request.json())
+        handle = GenerationHandle(self.rag.generation_timeout)
+        try:
+            answer = await self.answer(request, handle=handle)
+        except (Overloaded, PipelineBusy) as e:
+            raise web.HTTPServiceUnavailable(text=str(e), headers={"Retry-After": "1"})
+        except TimeoutError as e:
+            raise web.HTTPGatewayTimeout(text=str(e))
+        except asyncio.CancelledError:
+            # The client went away: stop its generation
+            handle.cancel()
+            raise
+        return web.json_response({"result": answer["result"], "cached": answer["cached"],
+                                  "sources": serialize_docs(answer["source_documents"])})
+
+    async def handle_stream(self, http_request):
+        """Server-sent events: one "sources" event, then "token" events, then "done"."""
+        request = self._request(await http_request.json())
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+        handle = GenerationHandle(self.rag.generation_timeout)
+        task = asyncio.create_task(self.answer(
+            request,
+            on_sources=lambda docs: events.put_nowait(("sources", serialize_docs(docs))),
+            on_text=lambda text: loop.call_soon_threadsafe(events.put_nowait, ("token", text)),
+            handle=handle,
+        ))
+        task.add_done_callback(lambda _: loop.call_soon_threadsafe(events.put_nowait, None))
+
+        try:
+            first = await events.get()
+            if first is None:
+                # Failed before anything was produced: report it as a plain HTTP error
+                try:
+                    task.result()
+                except (Overloaded, PipelineBusy) as e:
+                    raise web.HTTPServiceUnavailable(text=str(e), headers={"Retry-After": "1"})
+                except TimeoutError as e:
+                    raise web.HTTPGatewayTimeout(text=str(e))
+
+            response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+            await response.prepare(http_request)
+            event = first
+            while event is not None:
+                name, data = event
+                await response.write(f"event: {name}\ndata: {json.dumps(data)}\n\n".encode("utf-8"))
+                event = await events.get()
+            if task.exception() is not None:
+                await response.write(f"event: error\ndata: {json.dumps(str(task.exception()))}\n\n".encode("utf-8"))
+            else:
+                await response.write(f"event: done\ndata: {json.dumps({'cached': task.result()['cached']})}\n\n".encode("utf-8"))
+            await response.write_eof()
+            return response
+        finally:
+            if not task.done():
+                # The client went away (or the handler was cancelled): stop its generation
+                handle.cancel()
+                task.cancel()
+            elif not task.cancelled():
+                task.exception()
+
+    async def handle_generate(self, http_request):
+        payload = await http_request.json()
+        if not payload.get("prompt"):
+            raise web.HTTPBadRequest(text="'prompt' is required")
+        kwargs = {"max_new_tokens": int(payload.get("max_new_tokens", 150))}
+        loop = asyncio.get_running_loop()
+        # Share the generation thread so free-form prompts don't oversubscribe the CPU
+        try:
+            text = await loop.run_in_executor(self.generation.executor,
+                                              lambda: self.rag.generate(payload["prompt"], **kwargs))
+        except PipelineBusy as e:
+            raise web.HTTPServiceUnavailable(text=str(e), headers={"Retry-After": "1"})
+        return web.json_response({"result": text})
+
+    async def handle_health(self, http_request):
+        return web.json_response({
+            **self.rag.health(),
+            "queues": {
+                "retrieval": {"depth": self.retrieval.depth, "batches": self.retrieval.batches,
+                              "items": self.retrieval.items},
+                "generation": {"depth": self.generation.depth, "batches": self.generation.batches,
+                               "items": self.generation.items},
+            },
+        })
+
+    async def handle_metrics(self, http_request):
+        """Stage latency histograms as Prometheus text, or JSON lines with ?format=jsonl."""
+        if http_request.query.get("format") == "jsonl":
+            return web.Response(text=self.rag.metrics.to_json_lines(), content_type="application/x-ndjson")
+        return web.Response(text=self.rag.metrics.to_prometheus(), content_type="text/plain")
+
+    async def handle_reload(self, http_request):
+        """Swap in the store's current index snapshot now; answers once it is serving."""
+        future = self.rag.check_for_update(force=True)
+        if future is not None:
+            await asyncio.wrap_future(future)
+        return web.json_response(self.rag.index_info())
+
+    async def handle_filters(self, http_request):
+        loop = asyncio.get_running_loop()
+        return web.json_response(await loop.run_in_executor(None, self.rag.filter_options))
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post("/answer", self.handle_answer)
+        app.router.add_post("/stream", self.handle_stream)
+        app.router.add_post("/generate", self.handle_generate)
+        app.router.add_get("/health", self.handle_health)
+        app.router.add_get("/filters", self.handle_filters)
+        app.router.add_get("/metrics", self.handle_metrics)
+        app.router.add_post("/reload", self.handle_reload)
+
+        async def on_startup(_):
+            self.retrieval.start()
+            self.generation.start()
+
+        async def on_cleanup(_):
+            await self.retrieval.stop()
+            await self.generation.stop()
+
+        app.on_startup.append(on_startup)
+        app.on_cleanup.append(on_cleanup)
+        return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batched HTTP/SSE server for the RAG pipeline.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--store", default="vector_store/faiss_index")
+    parser.add_argument("--max-batch", type=int, default=8)
+    parser.add_argument("--window-ms", type=float, default=10)
+    parser.add_argument("--max-queue", type=int, default=64)
+    parser.add_argument("--quantize", action="store_true", help="Run the models int8-quantized.")
+    parser.add_argument("--threads", type=int, default=None, help="Pin torch to this many threads.")
+    args = parser.parse_args()
+
+    rag = RAGPipeline(args.store, fast_start=True, quantize=args.quantize, torch_threads=args.threads)
+    server = RAGServer(rag, args.max_batch, args.window_ms, args.max_queue)
+    # Handlers are cancelled when their client disconnects, which cancels its generation
+    web.run_app(server.app(), host=args.host, port=args.port, handler_cancellation=True)
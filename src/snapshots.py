@@ -0,0 +1,148 @@
+import os
+import re
+import json
+import time
+import shutil
+import threading
+from datetime import datetime, timezone
+
+try:
+    from .docstore import _replace_file
+except ImportError:
+    from docstore import _replace_file
+
+SNAPSHOTS_MANIFEST = "snapshots.json"
+_VERSION_RE = re.compile(r"^\d{8}T\d{12}Z$")
+
+
+def read_snapshots(root):
+    """The snapshot manifest of ``root`` ({"current", "snapshots": [...]}), or None for a plain store."""
+    manifest_path = os.path.join(root, SNAPSHOTS_MANIFEST)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def resolve_index(path):
+    """(store directory, snapshot version) to load for ``path``.
+
+    A snapshot root resolves to its current snapshot; any other directory is
+    a store itself and has no snapshot version (None).
+    """
+    manifest = read_snapshots(path)
+    if manifest is None or manifest.get("current") is None:
+        return path, None
+    return os.path.join(path, manifest["current"]), manifest["current"]
+
+
+def prepare_snapshot(root, copy_current=False):
+    """Create a new, unpublished snapshot directory under ``root`` and return its path.
+
+    With ``copy_current`` it starts as a copy of the current snapshot (or of
+    a plain store at ``root``), for incremental updates. Otherwise an
+    unpublished snapshot left with shard checkpoints by an interrupted full
+    build is reused, so the build resumes.
+    """
+    source, _ = resolve_index(root)
+    if not copy_current and os.path.isdir(root):
+        published = {s["version"] for s in (read_snapshots(root) or {"snapshots": []})["snapshots"]}
+        for name in sorted(os.listdir(root), reverse=True):
+            if _VERSION_RE.match(name) and name not in published and os.path.isdir(os.path.join(root, name, "shards")):
+                return os.path.join(root, name)
+
+    path = os.path.join(root, datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ"))
+    if copy_current and os.path.exists(os.path.join(source, "index.faiss")):
+        # Snapshot directories of a plain store root are not part of the store
+        def ignore(directory, names):
+            if directory != source:
+                return []
+            return [n for n in names if _VERSION_RE.match(n) or n == SNAPSHOTS_MANIFEST]
+        shutil.copytree(source, path, ignore=ignore)
+    else:
+        os.makedirs(path)
+    return path
+
+
+def publish_snapshot(root, path, keep=3):
+    """Make the snapshot at ``path`` current, atomically, and delete all but the ``keep`` newest.
+
+    Running pipelines pick it up with RAGPipeline.check_for_update(). The
+    snapshot being replaced is always kept, even beyond ``keep``, since
+    running pipelines serve from it until they swap; it is pruned by a
+    later publish.
+    """
+    version = os.path.basename(os.path.normpath(path))
+    manifest = read_snapshots(root) or {"snapshots": []}
+    previous = manifest.get("current")
+    snapshots = [s for s in manifest["snapshots"] if s["version"] != version]
+    snapshots.append({"version": version, "published": time.time()})
+    newest = {s["version"] for s in (snapshots[-keep:] if keep else snapshots)}
+    kept = [s for s in snapshots if s["version"] in newest or s["version"] == previous]
+    pruned = [s for s in snapshots if s not in kept]
+    manifest = {"current": version, "snapshots": kept}
+
+    def write(tmp_path):
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+    _replace_file(os.path.join(root, SNAPSHOTS_MANIFEST), write)
+    # Pruned only once the manifest no longer points at them
+    for old in pruned:
+        shutil.rmtree(os.path.join(root, old["version"]), ignore_errors=True)
+    return manifest
+
+
+class IndexSnapshot:
+    """One loaded version of the index: vectors and docstore, BM25, token counts and filter bitmaps.
+
+    Requests pin the snapshot they started on (RAGPipeline.pin_index), so a
+    hot swap never changes the index under them. Once retired, a snapshot
+    drops its memory-mapped data as soon as the last pinned request is done.
+    """
+
+    def __init__(self, path=None, version=None, vector_store=None, lexical_index=None, chunk_tokens=None):
+        self.path = path
+        self.version = version
+        self.vector_store = vector_store
+        self.lexical_index = lexical_index
+        self.chunk_tokens = chunk_tokens
+        self.selectors = {}
+        self.loaded_at = time.time()
+        self._active = 0
+        self._retired = False
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        return self._active
+
+    @property
+    def released(self):
+        return self._retired and self.vector_store is None
+
+    def acquire(self):
+        """Pin for one more request; False if it was retired with no requests left (its data is gone)."""
+        with self._lock:
+            if self._retired and self._active == 0:
+                return False
+            self._active += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._active -= 1
+            drop = self._retired and self._active == 0
+        if drop:
+            self._drop()
+
+    def retire(self):
+        """Mark as replaced; its data is dropped now or when the last request releases it."""
+        with self._lock:
+            self._retired = True
+            drop = self._active == 0
+        if drop:
+            self._drop()
+
+    def _drop(self):
+        self.vector_store = self.lexical_index = self.chunk_tokens = None
+        self.selectors = {}
@@ -0,0 +1,48 @@
+from src.answer_cache import AnswerCache, ReplayStream, RecordingStream
+
+class FakeClock:
+    now = 0.0
+
+    def __call__(self):
+        return self.now
+
+PARAMS = {"history": "", "k": 20, "product": None, "sub_product": None}
+
+def test_exact_hit_ttl_and_lru_eviction():
+    clock = FakeClock()
+    cache = AnswerCache(max_entries=2, ttl=10, clock=clock)
+    cache.put("Common credit card issues?", PARAMS, {"result": "a"})
+    cache.put("BNPL complaints", PARAMS, {"result": "b"})
+
+    assert cache.get("  common CREDIT card issues ", PARAMS) == {"result": "a"}
+    assert cache.get("common credit card issues", {**PARAMS, "k": 5}) is None
+
+    cache.put("zelle fraud", PARAMS, {"result": "c"})
+    assert cache.get("bnpl complaints", PARAMS) is None  # least recently used
+
+    clock.now = 11
+    assert cache.get("zelle fraud", PARAMS) is None
+
+def test_semantic_tier_and_version_invalidation():
+    cache = AnswerCache(semantic_threshold=0.9)
+    cache.check_version("v1")
+    cache.put("common credit card issues", PARAMS, {"result": "a"}, embedding=[1.0, 0.0])
+
+    assert cache.get("typical credit card problems", PARAMS, embedding=[0.99, 0.1]) == {"result": "a"}
+    assert cache.get("savings interest", PARAMS, embedding=[0.0, 1.0]) is None
+
+    cache.check_version("v2")
+    assert cache.get("common credit card issues", PARAMS) is None
+    assert cache.stats()["semantic_hits"] == 1
+
+    # An answer built from v1 that finishes after the swap to v2 is not stored under v2
+    cache.put("common credit card issues", PARAMS, {"result": "stale"}, version="v1")
+    assert cache.get("common credit card issues", PARAMS) is None
+    cache.put("common credit card issues", PARAMS, {"result": "fresh"}, version="v2")
+    assert cache.get("common credit card issues", PARAMS) == {"result": "fresh"}
+
+def test_replay_and_recording_streams():
+    recorded = []
+    assert "".join(RecordingStream(iter(["Late ", "fees ", "dominate."]), recorded.append)) == "Late fees dominate."
+    assert recorded == ["Late fees dominate."]
+    assert "".join(ReplayStream("Late fees  dominate.")) == "Late fees  dominate."
@@ -0,0 +1,23 @@
+import copy
+from src.benchmark import synthetic_complaints, run_benchmarks, compare
+from src.preprocessing import filter_data
+
+def test_synthetic_corpus_is_deterministic_and_cfpb_shaped():
+    df = synthetic_complaints(500, seed=1)
+    assert df.equals(synthetic_complaints(500, seed=1))
+    filtered = filter_data(df)
+    # Mortgage rows and empty narratives are filtered out
+    assert 0 < len(filtered) < len(df)
+    assert "Mortgage" not in set(filtered["Product"])
+
+def test_benchmark_report_and_regression_gate(tmp_path):
+    report = run_benchmarks(scales=[300], prefer_real=False, workdir=str(tmp_path))
+    stages = report["results"]["300"]
+    assert set(stages) == {"filter_data", "clean_text", "create_chunks", "build_vector_store", "retrieval", "rerank"}
+    assert compare(report, report) == []
+
+    baseline = copy.deepcopy(report)
+    baseline["results"]["300"]["retrieval"]["p50_ms"] /= 2
+    baseline["results"]["300"]["filter_data"]["rows_per_s"] *= 2
+    regressed = {(stage, metric) for _, stage, metric, _, _ in compare(report, baseline, threshold=0.2)}
+    assert regressed == {("retrieval", "p50_ms"), ("filter_data", "rows_per_s")}
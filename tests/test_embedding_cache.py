@@ -0,0 +1,56 @@
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from src.embedding_cache import CachedEmbeddings
+
+class CountingEmbedding(DeterministicFakeEmbedding):
+    calls: int = 0
+
+    def embed_documents(self, texts):
+        self.calls += len(texts)
+        return super().embed_documents(texts)
+
+def test_cache_hits_memory_then_disk(tmp_path):
+    base = CountingEmbedding(size=8)
+    cache = CachedEmbeddings(base, "fake-model", cache_dir=str(tmp_path), lru_size=2)
+
+    first = cache.embed_documents(["a", "b", "a"])
+    assert base.calls == 2
+    assert cache.embed_documents(["a"]) == [first[0]]
+    assert cache.stats()["misses"] == 2
+
+    reopened = CachedEmbeddings(base, "fake-model", cache_dir=str(tmp_path))
+    assert reopened.embed_documents(["b", "a"]) == [first[1], first[0]]
+    assert base.calls == 2
+    assert reopened.stats()["disk_hits"] == 2
+
+def test_torn_append_is_truncated_and_rows_follow_the_file(tmp_path):
+    base = CountingEmbedding(size=8)
+    cache = CachedEmbeddings(base, "fake-model", cache_dir=str(tmp_path))
+    first = cache.embed_documents(["a", "b"])
+
+    # Interrupted append: a vector without its key, plus half a key
+    with open(cache._vectors_path, "ab") as f:
+        f.write(b"\0" * 4 * 8)
+    with open(cache._keys_path, "ab") as f:
+        f.write(b"\1" * 7)
+
+    reopened = CachedEmbeddings(base, "fake-model", cache_dir=str(tmp_path))
+    other = CachedEmbeddings(base, "fake-model", cache_dir=str(tmp_path))
+    # Two writers sharing the cache: each numbers its rows from the file
+    c = reopened.embed_documents(["c"])[0]
+    d = other.embed_documents(["d"])[0]
+
+    final = CachedEmbeddings(base, "fake-model", cache_dir=str(tmp_path))
+    assert final.embed_documents(["a", "b", "c", "d"]) == first + [c, d]
+    assert final.stats()["disk_hits"] == 4 and final.stats()["cached_vectors"] == 4
+
+def test_read_only_cache_leaves_storing_to_the_owner(tmp_path):
+    base = CountingEmbedding(size=8)
+    worker = CachedEmbeddings(base, "fake-model", cache_dir=str(tmp_path), read_only=True)
+    vectors = worker.embed_documents(["a", "b"])
+    assert CachedEmbeddings(base, "fake-model", cache_dir=str(tmp_path)).stats()["cached_vectors"] == 0
+
+    owner = CachedEmbeddings(None, "fake-model", cache_dir=str(tmp_path))
+    owner.store_documents(["a", "b", "a"], vectors + [vectors[0]])
+    reader = CachedEmbeddings(base, "fake-model", cache_dir=str(tmp_path), read_only=True)
+    assert reader.embed_documents(["b", "a"]) == [vectors[1], vectors[0]]
+    assert base.calls == 2 and reader.stats()["cached_vectors"] == 2
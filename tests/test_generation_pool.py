@@ -0,0 +1,61 @@
+import threading
+import pytest
+import torch
+from src.generation_pool import GenerationPool, GenerationHandle, BatchHandle, StopOnHandle, PipelineBusy
+from src.answer_cache import RecordingStream
+
+def test_pool_bounds_queue_and_skips_cancelled_requests():
+    pool = GenerationPool(workers=1, max_pending=1)
+    release = threading.Event()
+    running = pool.submit(lambda: release.wait(5) and "first", GenerationHandle())
+    while pool.stats()["in_flight"] == 0:
+        pass
+
+    aborted = []
+    queued = pool.submit(lambda: "never runs", GenerationHandle(), on_abort=lambda: aborted.append(True))
+    with pytest.raises(PipelineBusy):
+        pool.submit(lambda: "rejected", GenerationHandle())
+
+    queued.cancel()
+    release.set()
+    assert running.result(5) == "first"
+    assert queued.result(5) is None and aborted == [True]
+    assert pool.stats() == {"workers": 1, "queued": 0, "in_flight": 0, "completed": 1,
+                            "cancelled": 1, "expired": 0, "failed": 0, "rejected": 1}
+
+    def fail():
+        raise RuntimeError("out of memory")
+    with pytest.raises(RuntimeError):
+        pool.submit(fail, GenerationHandle()).result(5)
+    assert pool.stats()["failed"] == 1 and pool.stats()["completed"] == 1
+
+def test_stop_criterion_follows_handle_and_abandoned_stream_cancels():
+    handle = GenerationHandle(timeout=60)
+    stop = StopOnHandle(handle)
+    assert not stop(torch.zeros((2, 3), dtype=torch.long), None).any()
+
+    recorded = []
+    stream = RecordingStream(iter(["a ", "b ", "c"]), recorded.append, handle)
+    pieces = iter(stream)
+    next(pieces)
+    pieces.close()
+
+    assert handle.cancelled and recorded == []
+    assert stop(torch.zeros((2, 3), dtype=torch.long), None).all()
+    assert GenerationHandle(timeout=1e-9).expired
+
+def test_stop_criterion_stops_each_prompt_on_its_own_handle():
+    live, cancelled = GenerationHandle(), GenerationHandle()
+    cancelled.cancel()
+    # Two prompts with two sampled rows each
+    assert StopOnHandle(live, cancelled)(torch.zeros((4, 3), dtype=torch.long), None).tolist() == [
+        False, False, True, True]
+
+def test_batch_handle_stops_once_every_request_has():
+    first, second = GenerationHandle(), GenerationHandle(timeout=1e-9)
+    batch = BatchHandle([first, second])
+    assert not batch.should_stop()
+    first.cancel()
+    assert batch.should_stop() and batch.expired and not batch.cancelled
+    batch.cancel()
+    assert second.cancelled and batch.cancelled
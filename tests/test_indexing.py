@@ -0,0 +1,261 @@
+import faiss
+import numpy as np
+import pandas as pd
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from src.analytics import index_statistics
+from src.indexing import (create_chunks, build_vector_store, content_hashes, write_manifest, update_vector_store,
+                          make_faiss_index, load_lexical_index, write_lexical_index, build_vector_store_sharded,
+                          load_and_sample, ProductReservoirs)
+
+def _frame(narratives):
+    return pd.DataFrame({
+        'Complaint ID': list(range(1, len(narratives) + 1)),
+        'Product': ['Credit card'] * len(narratives),
+        'Sub-product': ['General-purpose card'] * len(narratives),
+        'cleaned_narrative': narratives
+    })
+
+def test_incremental_update_only_touches_delta(tmp_path):
+    store = str(tmp_path / "faiss_index")
+    embeddings = DeterministicFakeEmbedding(size=16)
+    df = _frame(["late fee charged twice", "card closed without notice", "interest rate raised"])
+    docs = create_chunks(df)
+    build_vector_store(docs, store, embeddings)
+    write_manifest(store, content_hashes(df), docs)
+
+    updated = _frame(["late fee charged twice", "card closed and balance sent to collections",
+                      "interest rate raised", "zelle transfer never arrived"])
+    store_after = update_vector_store(updated, store, prune_missing=True, embeddings=embeddings)
+
+    live_rows = faiss.vector_to_array(store_after.index.id_map)
+    contents = sorted(store_after.docstore.text(row) for row in live_rows)
+    assert contents == sorted(updated['cleaned_narrative'])
+    assert store_after.index.ntotal == 4
+    # Superseded chunks remain as tombstones in the docstore but not in the index
+    assert len(store_after.docstore) == 5
+    assert update_vector_store(updated, store, embeddings=embeddings) is None
+
+def test_update_keeps_rows_of_other_non_numeric_ids_and_compacts_tombstones(tmp_path):
+    store = str(tmp_path / "faiss_index")
+    embeddings = DeterministicFakeEmbedding(size=16)
+    df = _frame(["late fee charged twice", "card closed without notice", "interest rate raised"])
+    df['Complaint ID'] = ["A-1", "A-2", "3"]
+    docs = create_chunks(df)
+    build_vector_store(docs, store, embeddings)
+    write_manifest(store, content_hashes(df), docs)
+
+    # "A-1" and "A-2" both map to the missing id; changing one must not drop the other
+    df.loc[0, 'cleaned_narrative'] = "late fee refunded"
+    after = update_vector_store(df, store, embeddings=embeddings, compact_ratio=None)
+    live = {after.docstore.text(row) for row in faiss.vector_to_array(after.index.id_map)}
+    assert {"card closed without notice", "interest rate raised", "late fee refunded"} <= live
+
+    store = str(tmp_path / "compacted")
+    df = _frame(["late fee charged twice", "card closed without notice", "interest rate raised"])
+    docs = create_chunks(df)
+    build_vector_store(docs, store, embeddings)
+    write_manifest(store, content_hashes(df), docs)
+    compacted = update_vector_store(_frame(["late fee charged twice", "card reopened", "interest rate lowered"]),
+                                    store, embeddings=embeddings)
+    # Superseded rows are gone and the remaining rows renumbered without re-embedding
+    assert len(compacted.docstore) == compacted.index.ntotal
+    assert sorted(faiss.vector_to_array(compacted.index.id_map)) == list(range(compacted.index.ntotal))
+    hit = compacted.similarity_search("interest rate lowered", k=1)[0]
+    assert hit.page_content == "interest rate lowered" and hit.metadata["complaint_id"] == "3"
+    lexical = load_lexical_index(store)
+    assert [compacted.docstore.text(row) for row in lexical.search("reopened", k=5)] == ["card reopened"]
+
+def test_ann_index_types_build_and_search():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(500, 16)).astype('float32')
+    for index_type, storage in [("flat", "fp16"), ("ivf", "int8"), ("hnsw", "fp32"), ("ivfpq", "fp32")]:
+        index = make_faiss_index(vectors, index_type, storage)
+        _, ids = index.search(vectors[:5], 1)
+        assert index.ntotal == 500
+        assert ids.shape == (5, 1)
+
+def test_columnar_docstore_round_trip(tmp_path):
+    df = _frame(["late fee charged twice", "card closed without notice"])
+    df.loc[1, 'Sub-product'] = 'Store credit card'
+    docs = create_chunks(df)
+    store = build_vector_store(docs, str(tmp_path / "faiss_index"), DeterministicFakeEmbedding(size=16))
+
+    assert not (tmp_path / "faiss_index" / "index.pkl").exists()
+    assert [store.docstore.document(i) for i in range(2)] == docs
+    assert store.similarity_search("card closed without notice", k=1)[0].metadata["complaint_id"] == "2"
+
+def test_bm25_index_matches_exact_terms_and_follows_updates(tmp_path):
+    store = str(tmp_path / "faiss_index")
+    embeddings = DeterministicFakeEmbedding(size=16)
+    df = _frame(["zelle payment sent to wrong person", "overdraft fee charged", "overdraft fee and late fee"])
+    docs = create_chunks(df)
+    build_vector_store(docs, store, embeddings)
+    write_manifest(store, content_hashes(df), docs)
+
+    lexical = load_lexical_index(store)
+    assert list(lexical.search("Zelle", k=5)) == [0]
+    # Both fee rows match; the one repeating "fee" in a similar length ranks first
+    assert list(lexical.search("late fee", k=5)) == [2, 1]
+
+    update_vector_store(_frame(["card closed", "overdraft fee charged", "overdraft fee and late fee"]),
+                        store, embeddings=embeddings)
+    lexical = load_lexical_index(store)
+    # The superseded zelle chunk is a tombstone and no longer matches
+    assert list(lexical.search("zelle", k=5)) == []
+    assert list(lexical.search("card closed", k=5)) == [3]
+    # Only the new row was tokenized, into its own segment; scores match a full rebuild
+    assert len(lexical.segments) == 2
+    write_lexical_index(store, [1, 2, 3])
+    rebuilt = load_lexical_index(store)
+    assert len(rebuilt.segments) == 1
+    for query in ("card closed", "late fee", "zelle overdraft"):
+        assert np.allclose(lexical.scores(query), rebuilt.scores(query))
+
+class CountingEmbedding(DeterministicFakeEmbedding):
+    fail_on: str = ""
+    calls: int = 0
+
+    def embed_documents(self, texts):
+        if self.fail_on and self.fail_on in texts:
+            raise RuntimeError("embedder crashed")
+        self.calls += 1
+        return super().embed_documents(texts)
+
+def test_iter_chunks_matches_splitter_for_long_and_short_narratives():
+    df = _frame(["short one", "  padded  ", " ".join(["word"] * 300), ""])
+    docs = create_chunks(df)
+    assert [d.page_content for d in docs[:2]] == ["short one", "padded"]
+    assert {d.metadata["complaint_id"] for d in docs} == {"1", "2", "3"}
+    assert all(len(d.page_content) <= 500 for d in docs) and len(docs) > 3
+
+def test_streaming_sample_is_stratified_reproducible_and_keeps_rare_products(tmp_path):
+    products = ['Credit card'] * 600 + ['Savings account'] * 300 + ['Money transfers'] * 99 + ['Payday loan']
+    df = pd.DataFrame({'Complaint ID': range(len(products)), 'Product': products, 'cleaned_narrative': 'text'})
+    df.to_csv(tmp_path / "complaints.csv", index=False)
+    df.to_parquet(tmp_path / "complaints.parquet")
+
+    sample = load_and_sample(str(tmp_path / "complaints.csv"), sample_size=100, chunksize=64)
+    counts = sample['Product'].value_counts()
+    assert len(sample) == 100 and counts['Payday loan'] == 1
+    assert 58 <= counts['Credit card'] <= 60 and counts['Savings account'] == 30
+    assert sample['Complaint ID'].is_unique
+
+    again = load_and_sample(str(tmp_path / "complaints.parquet"), sample_size=100, chunksize=64)
+    assert again['Complaint ID'].tolist() == sample['Complaint ID'].tolist()
+    other = load_and_sample(str(tmp_path / "complaints.csv"), sample_size=100, seed=7, chunksize=64)
+    assert set(other['Complaint ID']) != set(sample['Complaint ID'])
+
+    capped = load_and_sample(str(tmp_path / "complaints.csv"), sample_size=100, quota="capped", chunksize=64)
+    assert capped['Product'].value_counts().to_dict() == {
+        'Credit card': 25, 'Savings account': 25, 'Money transfers': 25, 'Payday loan': 1}
+
+def test_capped_reservoirs_stay_bounded_by_the_sample_size():
+    reservoirs = ProductReservoirs(sample_size=40, quota="capped", seed=1)
+    rng = np.random.default_rng(0)
+    for start in range(0, 5000, 250):
+        products = rng.choice(["Credit card", "Savings account", "Money transfers", f"Loan {start // 1000}"], 250)
+        reservoirs.update(pd.DataFrame({'Complaint ID': range(start, start + 250), 'Product': products}))
+        # At most the cap per product seen so far, never the rows streamed
+        assert len(reservoirs) <= 40 + len(reservoirs.counts)
+    assert reservoirs.sample()['Product'].value_counts().max() == 5
+
+def test_near_duplicate_chunks_are_indexed_once_with_all_sources(tmp_path):
+    template = ("I was charged an overdraft fee of $35 on my checking account even though the deposit "
+                "had posted the day before. I called customer service three times and was told the fee "
+                "would be reversed within five business days but it never was. {}")
+    df = _frame([template.format("Please help."), template.format("Please refund it."),
+                 "my card was declined at the store", template.format("Please help.")])
+    df.loc[3, 'Product'] = 'Checking or savings account'
+
+    store = str(tmp_path / "faiss_index")
+    embeddings = CountingEmbedding(size=16)
+    vector_store = build_vector_store_sharded(df, store, embeddings, shard_size=2, workers=0)
+    docstore = vector_store.docstore
+    # Near-identical complaints 1 and 2 share one vector; 4 is the same text under another product
+    assert vector_store.index.ntotal == 3
+    assert docstore.metadata(0)["source_ids"] == ["1", "2"]
+    assert "source_ids" not in docstore.metadata(1) and docstore.metadata(2)["complaint_id"] == "4"
+    assert update_vector_store(df, store, embeddings=embeddings) is None
+    stats = index_statistics(store)
+    assert (stats["chunks"], stats["complaints"], stats["collapsed_duplicates"]) == (3, 3, 1)
+
+    flat = build_vector_store(create_chunks(df), str(tmp_path / "flat"), embeddings)
+    assert [flat.docstore.metadata(i) for i in range(3)] == [docstore.metadata(i) for i in range(3)]
+    assert build_vector_store(create_chunks(df), str(tmp_path / "all"), embeddings,
+                              dedup_threshold=None).index.ntotal == 4
+
+def test_incremental_update_rechunks_complaints_collapsed_into_a_stale_chunk(tmp_path):
+    template = ("I was charged an overdraft fee of $35 on my checking account even though the deposit "
+                "had posted the day before. I called customer service three times and was told the fee "
+                "would be reversed within five business days but it never was. {}")
+    embeddings = DeterministicFakeEmbedding(size=16)
+
+    def build(name):
+        df = _frame([template.format("Please help."), template.format("Please refund it."), "card declined"])
+        vector_store = build_vector_store(create_chunks(df), str(tmp_path / name), embeddings)
+        indexed = [vector_store.docstore.document(row) for row in range(len(vector_store.docstore))]
+        write_manifest(str(tmp_path / name), content_hashes(df), indexed)
+        assert indexed[0].metadata["source_ids"] == ["1", "2"]
+        return df, str(tmp_path / name)
+
+    def live(vector_store):
+        rows = faiss.vector_to_array(vector_store.index.id_map)
+        return {vector_store.docstore.text(r): vector_store.docstore.metadata(r) for r in rows}
+
+    # Editing the representative brings back the complaint it had absorbed, under its own id
+    df, store = build("representative")
+    df.loc[0, 'cleaned_narrative'] = "my card was closed"
+    after = live(update_vector_store(df, store, embeddings=embeddings, compact_ratio=None))
+    assert after[template.format("Please refund it.")] == {
+        "complaint_id": "2", "product": "Credit card", "sub_product": "General-purpose card"}
+    assert after["my card was closed"]["complaint_id"] == "1" and len(after) == 3
+    assert update_vector_store(df, store, embeddings=embeddings) is None
+
+    # Editing an absorbed complaint drops it from its representative's sources
+    df, store = build("absorbed")
+    df.loc[1, 'cleaned_narrative'] = "wire transfer never arrived"
+    after = live(update_vector_store(df, store, embeddings=embeddings, compact_ratio=None))
+    assert "source_ids" not in after[template.format("Please help.")]
+    assert after["wire transfer never arrived"]["complaint_id"] == "2" and len(after) == 3
+
+def test_sharded_build_resumes_after_interruption(tmp_path):
+    store = str(tmp_path / "faiss_index")
+    df = _frame([f"complaint number {i} about fees" for i in range(10)])
+    crashing = CountingEmbedding(size=16, fail_on="complaint number 7 about fees")
+    try:
+        build_vector_store_sharded(df, store, crashing, shard_size=3, workers=0)
+    except RuntimeError:
+        pass
+    # Shards 0 and 1 finished before the crash in shard 2; shard 1's marker was torn by it
+    assert crashing.calls == 2
+    (tmp_path / "faiss_index" / "shards" / "shard_00001" / "done.json").write_text('{"finger')
+
+    embeddings = CountingEmbedding(size=16)
+    vector_store = build_vector_store_sharded(df, store, embeddings, shard_size=3, workers=0)
+    assert embeddings.calls == 3
+    assert vector_store.index.ntotal == 10
+    assert [vector_store.docstore.text(i) for i in range(10)] == list(df['cleaned_narrative'])
+    assert not (tmp_path / "faiss_index" / "shards").exists()
+    assert update_vector_store(df, store, embeddings=embeddings) is None
+
+def test_sharded_build_redoes_shards_whose_metadata_changed(tmp_path):
+    store = str(tmp_path / "faiss_index")
+    df = _frame([f"complaint number {i} about fees" for i in range(6)])
+    try:
+        build_vector_store_sharded(df, store, CountingEmbedding(size=16, fail_on="complaint number 4 about fees"),
+                                   shard_size=2, workers=0)
+    except RuntimeError:
+        pass
+
+    # Only the product of a complaint in a finished shard changes upstream
+    df.loc[0, 'Product'] = 'Mortgage'
+    vector_store = build_vector_store_sharded(df, store, CountingEmbedding(size=16), shard_size=2, workers=0)
+    assert vector_store.docstore.metadata(0)["product"] == "Mortgage"
+    assert vector_store.docstore.metadata(1)["product"] == "Credit card"
+
+def test_sharded_build_on_process_pool_matches_single_process(tmp_path):
+    df = _frame([f"complaint number {i} about fees" for i in range(10)])
+    embeddings = DeterministicFakeEmbedding(size=16)
+    inline = build_vector_store_sharded(df, str(tmp_path / "a"), embeddings, shard_size=4, workers=0)
+    pooled = build_vector_store_sharded(df, str(tmp_path / "b"), embeddings, shard_size=4, workers=2)
+    assert np.array_equal(inline.index.reconstruct_n(0, 10), pooled.index.reconstruct_n(0, 10))
@@ -0,0 +1,36 @@
+import json
+from src.metrics import Metrics
+
+def test_traces_attribute_stages_and_export():
+    metrics = Metrics(window=10)
+    with metrics.trace("answer", cached=False) as trace:
+        with metrics.stage("rerank"):
+            pass
+        metrics.observe("rerank", 0.2)
+    metrics.observe("dense_search", 0.003)
+    metrics.observe_rate("tokens_per_second", 12.0)
+
+    assert set(trace.stages) == {"rerank", "answer_total"}
+    assert trace.stages["rerank"] >= 0.2
+    summary = metrics.summary()
+    assert summary["rerank"]["count"] == 2
+    assert summary["tokens_per_second"]["p50"] == 12.0
+
+    prom = metrics.to_prometheus()
+    assert 'rag_stage_seconds_bucket{stage="dense_search",le="0.005"} 1' in prom
+    assert 'rag_stage_seconds_count{stage="rerank"} 2' in prom
+    lines = [json.loads(line) for line in metrics.to_json_lines().splitlines()]
+    assert {line["name"] for line in lines} == {"answer_total", "dense_search", "rerank", "tokens_per_second"}
+
+def test_rolling_window_and_trace_log(tmp_path):
+    log = tmp_path / "traces.jsonl"
+    metrics = Metrics(window=3, trace_log=str(log))
+    for seconds in (10.0, 0.1, 0.1, 0.1):
+        metrics.observe("generation", seconds)
+    # The 10s outlier has left the window
+    assert metrics.summary()["generation"]["p99_ms"] < 200
+
+    with metrics.trace("stream"):
+        metrics.observe("prompt", 0.01)
+    record = json.loads(log.read_text())
+    assert record["kind"] == "stream" and record["stages"]["prompt"] == 0.01
@@ -1,4 +1,6 @@
-from src.preprocessing import clean_text
+import pandas as pd
+from src.preprocessing import clean_text, clean_texts, preprocess_pipeline, preprocess_pipeline_streaming
+from src.analytics import load_analytics, read_columns, aggregate_file, AGGREGATE_COLUMNS
 
 def test_clean_text_lowercasing():
     assert clean_text("HELLO") == "hello"
@@ -11,3 +13,52 @@ def test_clean_text_special_chars():
 
 def test_clean_text_whitespace():
     assert clean_text("  hello    world  ") == "hello world"
+
+def test_clean_texts_matches_clean_text():
+    texts = ["Dear CFPB, my card was charged $35!!", None, "  To whom it may concern:\tfees  ", "café ®"] * 50
+    expected = [clean_text(t) for t in texts]
+    assert clean_texts(texts, n_jobs=1) == expected
+    assert clean_texts(texts, n_jobs=2, batch_size=16) == expected
+
+def _write_raw_csv(path):
+    pd.DataFrame({
+        'Date received': ['2023-01-01', '2023-01-02', '2023-02-01', '2023-02-03', '2023-03-05'],
+        'Product': ['Credit card', 'Mortgage', 'Bank account or service', 'Payday loan', 'Credit card'],
+        'Sub-product': ['General-purpose card', None, 'Checking account', None, 'Store card'],
+        'Issue': ['Fees', 'Escrow', 'Overdraft', 'Charged fees', 'Billing'],
+        'Consumer complaint narrative': ['Dear CFPB, FEES!!', 'escrow', None, '   ', 'Card was charged twice.'],
+        'Company': ['A', 'B', 'C', 'D', 'E'],
+        'Complaint ID': [1, 2, 3, 4, 5]
+    }).to_csv(path, index=False)
+
+def test_streaming_pipeline_matches_in_memory(tmp_path):
+    raw = tmp_path / "complaints.csv"
+    _write_raw_csv(raw)
+
+    expected = preprocess_pipeline(str(raw), str(tmp_path / "filtered.csv"))
+    counts = preprocess_pipeline_streaming(str(raw), str(tmp_path / "filtered.parquet"), chunksize=2)
+    streamed = pd.read_parquet(tmp_path / "filtered.parquet")
+
+    assert counts == {"total_complaints": 5, "complaints_with_narrative": 4, "filtered_complaints": 2}
+    assert streamed['Complaint ID'].tolist() == expected['Complaint ID'].astype(str).tolist()
+    assert streamed['cleaned_narrative'].tolist() == expected['cleaned_narrative'].tolist()
+
+def test_pipelines_write_analytics_sidecar(tmp_path):
+    raw = tmp_path / "complaints.csv"
+    _write_raw_csv(raw)
+
+    preprocess_pipeline(str(raw), str(tmp_path / "filtered.csv"))
+    in_memory = load_analytics(str(tmp_path / "analytics.json"))["corpus"]
+    preprocess_pipeline_streaming(str(raw), str(tmp_path / "filtered.parquet"), chunksize=2)
+    streamed = load_analytics(str(tmp_path / "analytics.json"))["corpus"]
+
+    assert streamed["by_product"] == in_memory["by_product"] == {"Credit card": 2}
+    assert streamed["by_month"] == {"2023-01": 1, "2023-03": 1}
+    assert streamed["by_sub_product"] == {"Credit card": {"General-purpose card": 1, "Store card": 1}}
+    assert (streamed["raw_total"], streamed["raw_with_narrative"]) == (5, 4)
+    # The ad-hoc path reads only the aggregate columns and agrees with the sidecar
+    assert list(read_columns(str(tmp_path / "filtered.parquet")).columns) == AGGREGATE_COLUMNS
+    assert aggregate_file(str(tmp_path / "filtered.parquet"), chunksize=1).to_dict()["by_month"] == streamed["by_month"]
+    # Arrow files without a Sub-product column are read like Parquet ones
+    pd.read_parquet(tmp_path / "filtered.parquet").drop(columns="Sub-product").to_feather(tmp_path / "filtered.arrow")
+    assert list(read_columns(str(tmp_path / "filtered.arrow")).columns) == ["Product", "Date received"]
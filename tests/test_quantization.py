@@ -0,0 +1,18 @@
+import torch
+from src.quantization import quantize_int8, _token_f1
+
+def test_quantize_int8_replaces_linear_layers_and_keeps_outputs_close():
+    torch.manual_seed(0)
+    model = torch.nn.Sequential(torch.nn.Linear(32, 64), torch.nn.ReLU(), torch.nn.Linear(64, 8))
+    x = torch.randn(4, 32)
+    expected = model(x).detach()
+
+    quantized = quantize_int8(model)
+    assert quantized is model
+    assert not any(type(m) is torch.nn.Linear for m in model.modules())
+    assert torch.allclose(model(x), expected, atol=0.05)
+
+def test_token_f1():
+    assert _token_f1("late fees charged", "late fees charged") == 1.0
+    assert _token_f1("late fees", "no match") == 0.0
+    assert 0 < _token_f1("late fees charged twice", "late fees") < 1
@@ -0,0 +1,232 @@
+import os
+import threading
+import pandas as pd
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from src.indexing import create_chunks, build_vector_store
+from src.rag_pipeline import RAGPipeline
+from src.snapshots import IndexSnapshot, prepare_snapshot, publish_snapshot
+
+class StubPipeline(RAGPipeline):
+    """RAGPipeline with a fake embedder and no models, over a store built by the test."""
+
+    def _load_embeddings(self):
+        return DeterministicFakeEmbedding(size=16)
+
+    def _load_tokenizer(self):
+        return None
+
+    _load_model = _load_reranker = _load_tokenizer
+
+def _pipeline(tmp_path, narratives, products=None, **kwargs):
+    df = pd.DataFrame({
+        'Complaint ID': list(range(1, len(narratives) + 1)),
+        'Product': products or ['Buy Now, Pay Later (BNPL)'] * len(narratives),
+        'Sub-product': ['N/A'] * len(narratives),
+        'cleaned_narrative': narratives
+    })
+    store = str(tmp_path / "faiss_index")
+    build_vector_store(create_chunks(df), store, DeterministicFakeEmbedding(size=16))
+    return StubPipeline(store, **{"hybrid": False, **kwargs})
+
+def test_retrieve_batches_variants_and_dedups_by_vector_id(tmp_path):
+    narratives = ["installments", "point of sale financing", "bnpl fees", "late payment", "same text", "same text"]
+    rag = _pipeline(tmp_path, narratives)
+
+    docs = [rag._document(label) for label in rag._retrieve("bnpl", k=24)]
+    ids = [d.metadata["complaint_id"] for d in docs]
+
+    assert len(ids) == len(set(ids))
+    # Each variant's exact match is found; identical texts were indexed once, citing both complaints
+    assert {"installments", "point of sale financing"} <= {d.page_content for d in docs}
+    same = [d for d in docs if d.page_content == "same text"]
+    assert len(same) == 1 and same[0].metadata["source_ids"] == ["5", "6"]
+
+def test_retrieve_with_product_filter_only_searches_that_slice(tmp_path):
+    rag = _pipeline(tmp_path, ["late fee", "late fee again", "card declined", "wire never arrived"],
+                    products=["Buy Now, Pay Later (BNPL)", "Buy Now, Pay Later (BNPL)", "Credit card", "Money transfers"])
+
+    labels = rag._retrieve("late fee", k=10, product="Credit card")
+    assert [rag._document(l).metadata["complaint_id"] for l in labels] == ["3"]
+    assert rag._retrieve("late fee", k=10, product="Mortgage") == []
+    assert list(rag.filter_options()) == ["Buy Now, Pay Later (BNPL)", "Credit card", "Money transfers"]
+
+def test_hybrid_retrieval_fuses_exact_term_hits(tmp_path):
+    narratives = ["payment app froze", "zelle transfer to scammer was not refunded"] + [f"note {i}" for i in range(30)]
+    rag = _pipeline(tmp_path, narratives, hybrid=True, rrf_k=60)
+    assert rag.lexical_index is not None
+
+    labels = rag._retrieve("zelle refund", k=4)
+    assert len(labels) <= 4
+    assert 1 in labels
+    assert rag._retrieve("zelle refund", k=4, product="Credit card") == []
+
+def test_rerank_caches_prunes_and_stops_early(tmp_path):
+    rag = _pipeline(tmp_path, [f"chunk {i}" for i in range(10)],
+                    rerank_batch_size=16, rerank_prune_margin=0.25, rerank_early_stop=2)
+    calls = []
+
+    class StubReranker:
+        def predict(self, pairs, batch_size=32):
+            calls.append((len(pairs), batch_size))
+            return [10 - int(text.split()[1]) for _, text in pairs]
+
+    rag.reranker = StubReranker()
+    labels = list(range(10))
+    # Unit-norm squared distances: labels 6-9 are more than 0.25 cosine below the best hit
+    distances = {label: 0.1 * label for label in labels}
+
+    assert rag._rerank("q", labels, top_n=2, distances=distances) == [0, 1]
+    assert calls == [(2, 16), (2, 16)]
+    assert rag.rerank_stats()["pruned"] == 4 and rag.rerank_stats()["early_stopped"] == 2
+
+    rag.rerank_early_stop = None
+    assert rag._rerank("q", labels[:5], top_n=2) == [0, 1]
+    # Four pairs come from the cache; only chunk 4 is scored
+    assert calls[-1] == (1, 16)
+    assert rag.rerank_stats()["cached"] == 4 and rag.rerank_stats()["scored"] == 5
+
+class WordTokenizer:
+    """One token per whitespace-separated word; ids index a growing vocabulary."""
+
+    def __init__(self):
+        self.vocab = []
+
+    def __len__(self):
+        return 1000
+
+    def _encode(self, text):
+        for word in text.split():
+            if word not in self.vocab:
+                self.vocab.append(word)
+        return [self.vocab.index(word) for word in text.split()]
+
+    def __call__(self, text, add_special_tokens=True):
+        if isinstance(text, list):
+            return {"input_ids": [self._encode(t) for t in text]}
+        return {"input_ids": self._encode(text)}
+
+    def decode(self, ids):
+        return " ".join(self.vocab[i] for i in ids)
+
+def test_prompt_packing_uses_precomputed_token_counts(tmp_path):
+    tokenizer = WordTokenizer()
+    narratives = [" ".join(["fee"] * 40), " ".join(["card"] * 200), " ".join(["wire"] * 60)]
+    df = pd.DataFrame({'Complaint ID': [1, 2, 3], 'Product': ['Credit card'] * 3,
+                       'Sub-product': ['N/A'] * 3, 'cleaned_narrative': narratives})
+    docs = create_chunks(df, chunk_size=2000)
+    store = str(tmp_path / "faiss_index")
+    build_vector_store(docs, store, DeterministicFakeEmbedding(size=16), tokenizer=tokenizer, token_ids=True)
+
+    class TokenizerPipeline(StubPipeline):
+        def _load_tokenizer(self):
+            return tokenizer
+
+    rag = TokenizerPipeline(store, prompt_tokens=300, history_tokens=5)
+    assert [rag.chunk_tokens.count(i) for i in range(3)] == [40, 200, 60]
+
+    history = "Human: old question\nAssistant: old answer\nHuman: recent one\n"
+    prompt, used = rag._build_prompt("why the fee?", history, docs, labels=[0, 1, 2])
+    # The 200-token chunk is cut to the remaining budget; history keeps only its latest line
+    assert [d.metadata["complaint_id"] for d in used] == ["1", "2"]
+    assert "old answer" not in prompt and "recent one" in prompt
+    assert len(tokenizer(prompt)["input_ids"]) <= 300
+
+    # Without token ids the oversized chunk is skipped and the next one fills in
+
+    rag.chunk_tokens.has_ids = False
+    _, used = rag._build_prompt("why the fee?", history, docs, labels=[0, 1, 2])
+    assert [d.metadata["complaint_id"] for d in used] == ["1", "3"]
+
+def test_fast_start_loads_components_in_background(tmp_path):
+    release_generator = threading.Event()
+
+    class LoadingPipeline(RAGPipeline):
+        def _load_embeddings(self):
+            return DeterministicFakeEmbedding(size=16)
+        def _load_index(self):
+            return IndexSnapshot(vector_store="index")
+        def _load_tokenizer(self):
+            return lambda text, **kwargs: {"input_ids": text.split()}
+        def _load_model(self):
+            release_generator.wait(5)
+            return "model"
+        def _load_reranker(self):
+            raise OSError("no network")
+
+    rag = LoadingPipeline(str(tmp_path / "missing"), fast_start=True)
+    assert rag.vector_store == "index"
+    assert rag.readiness()["generator"] == "loading"
+
+    release_generator.set()
+    assert rag.model == "model"
+    assert rag.readiness() == {"embeddings": "ready", "vector_store": "ready",
+                               "generator": "ready", "reranker": "failed"}
+    assert set(rag.load_times) == {"embeddings", "vector_store", "tokenizer", "model"}
+
+    # The answer path formats the prompt template and runs the generator
+    rag._pipe = lambda prompt, **kwargs: [{"generated_text": "answer"}]
+    rag._retrieve_and_rerank = lambda *args: ([], [])
+    assert rag.answer_question("late fee?")["result"] == "answer"
+
+    # An answer whose generation was stopped (deadline or cancel) is returned but not cached
+    def stopped_pipe(prompt, stopping_criteria, **kwargs):
+        stopping_criteria[0].handles[0].cancel()
+        return [{"generated_text": "cut short"}]
+    rag._pipe = stopped_pipe
+    assert rag.answer_question("wire fee?")["result"] == "cut short"
+    rag._pipe = lambda prompt, **kwargs: [{"generated_text": "full answer"}]
+    assert rag.answer_question("wire fee?")["result"] == "full answer"
+
+def test_hot_swap_serves_pinned_requests_from_the_old_snapshot(tmp_path):
+    root = str(tmp_path / "faiss_index")
+    embeddings = DeterministicFakeEmbedding(size=16)
+
+    def publish(narratives, keep=3):
+        df = pd.DataFrame({'Complaint ID': range(1, len(narratives) + 1), 'Product': 'Credit card',
+                           'Sub-product': 'N/A', 'cleaned_narrative': narratives})
+        path = prepare_snapshot(root)
+        build_vector_store(create_chunks(df), path, embeddings)
+        publish_snapshot(root, path, keep=keep)
+        return os.path.basename(path)
+
+    first = publish(["late fee", "card declined"])
+    rag = StubPipeline(root, answer_cache_size=0)
+    assert rag.index_version == first and rag.check_for_update(force=True) is None
+
+    with rag.pin_index() as old:
+        second = publish(["late fee", "card declined", "wire never arrived"], keep=1)
+        new = rag.check_for_update(force=True).result()
+        # This request keeps the index it started on; everyone else sees the new one
+        assert rag.vector_store.index.ntotal == 2 and rag.index_version == first
+        assert rag.index is new and new.vector_store.index.ntotal == 3
+        assert not old.released
+    assert old.released and rag.index_version == second
+    # The snapshot a publish replaces outlives ``keep`` until the next publish
+    assert os.path.exists(os.path.join(root, first))
+    assert "wire never arrived" in {rag._text(label) for label in rag._retrieve("wire", k=3)}
+
+    # A request that read the live snapshot just before a swap pins it while the swap retires it:
+    # it must get a snapshot whose data is still there, never one that is being dropped
+    stale, pinned = rag.index, []
+    drop = stale._drop
+    def racing_drop():
+        with rag.pin_index(stale) as snapshot:
+            pinned.append((snapshot, snapshot.vector_store))
+        drop()
+    stale._drop = racing_drop
+    publish(["late fee", "card declined", "wire never arrived", "loan denied"], keep=1)
+    rag.check_for_update(force=True).result()
+    assert not os.path.exists(os.path.join(root, first)) and os.path.exists(os.path.join(root, second))
+    assert pinned[0][0] is rag.index and pinned[0][1] is not None
+
+    # A plain store is never reloaded behind the reader's back, only on request
+    plain = str(tmp_path / "plain")
+    build_vector_store(create_chunks(pd.DataFrame({'Complaint ID': [1], 'Product': 'Credit card',
+                                                   'Sub-product': 'N/A', 'cleaned_narrative': ["late fee"]})),
+                       plain, embeddings)
+    rag = StubPipeline(plain, answer_cache_size=0, refresh_interval=None)
+    loaded = rag.index_version
+    os.utime(os.path.join(plain, "index.faiss"), ns=(0, 0))
+    assert rag.check_for_update() is None and rag.index_version == loaded
+    rag.check_for_update(force=True).result()
+    assert rag.index_version not in (None, loaded)
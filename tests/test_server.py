@@ -0,0 +1,220 @@
+import time
+import asyncio
+import json
+
+import pytest
+import requests
+import torch
+from aiohttp.test_utils import TestClient, TestServer
+from langchain_core.documents import Document
+
+from src.rag_pipeline import RAGPipeline
+from src.snapshots import IndexSnapshot
+from src.server import MicroBatcher, Overloaded, BatchTextStreamer, RAGServer
+from src.client import RemoteRAG, RemoteStream, _sse_events
+from src.generation_pool import PipelineBusy, GenerationHandle, GenerationPool
+
+def test_micro_batcher_coalesces_and_applies_backpressure():
+    async def scenario():
+        batches = []
+        batcher = MicroBatcher(lambda items: batches.append(items) or [i * 2 for i in items],
+                               max_batch=8, window=0.05, max_queue=4)
+        batcher.start()
+        results = await asyncio.gather(*(batcher.submit(i) for i in range(4)))
+        overflow = await asyncio.gather(*(batcher.submit(i) for i in range(6)), return_exceptions=True)
+        await batcher.stop()
+        return results, batches, overflow
+
+    results, batches, overflow = asyncio.run(scenario())
+    assert results == [0, 2, 4, 6]
+    assert batches[0] == [0, 1, 2, 3]
+    assert sum(isinstance(r, Overloaded) for r in overflow) == 2
+
+class CharTokenizer:
+    eos_token_id = 1
+
+    def decode(self, ids, skip_special_tokens=True):
+        return "".join(chr(i) for i in ids)
+
+def test_batch_streamer_splits_rows_at_word_boundaries():
+    received = [[], []]
+    streamer = BatchTextStreamer(CharTokenizer(), [received[0].append, received[1].append])
+    streamer.put(torch.zeros((2, 1), dtype=torch.long))
+    for a, b in zip("hi there", "ok!" + "\x01" * 5):
+        streamer.put(torch.tensor([ord(a), ord(b) if b != "\x01" else 1]))
+    streamer.end()
+    assert received[0] == ["hi ", "there"]
+    assert received[1] == ["ok!"]
+
+class StubPipeline(RAGPipeline):
+    def _load_embeddings(self):
+        return None
+
+    def _load_index(self):
+        return IndexSnapshot()
+
+    _load_tokenizer = _load_model = _load_reranker = _load_embeddings
+
+class StubServer(RAGServer):
+    def _retrieve_batch(self, requests):
+        return [(f"prompt about {r['question']}",
+                 [Document(page_content=f"about {r['question']}", metadata={"complaint_id": "7"})], None)
+                for r in requests]
+
+    def _generate_batch(self, items):
+        for _, on_text, _ in items:
+            if on_text:
+                on_text("Late ")
+                on_text("fees.")
+        return ["Late fees."] * len(items)
+
+def test_stream_endpoint_emits_sources_tokens_and_done():
+    async def scenario():
+        rag = StubPipeline(prompt_tokens=None, refresh_interval=None)
+        client = TestClient(TestServer(StubServer(rag).app()))
+        await client.start_server()
+        response = await client.post("/stream", json={"question": "fees"})
+        body = await response.text()
+        answer = await (await client.post("/answer", json={"question": "fees"})).json()
+        await client.close()
+        return body, answer
+
+    body, answer = asyncio.run(scenario())
+    events = [(block.split("\n")[0][7:], json.loads(block.split("\n")[1][6:]))
+              for block in body.strip().split("\n\n")]
+    assert events[0] == ("sources", [{"complaint_id": "7", "product": None, "sub_product": None,
+                                      "content": "about fees"}])
+    assert [data for name, data in events if name == "token"] == ["Late ", "fees."]
+    assert events[-1] == ("done", {"cached": False})
+    assert answer["result"] == "Late fees."
+
+class BusyRAG:
+    def generate(self, prompt, **kwargs):
+        raise PipelineBusy("8 generations already queued")
+
+def test_generate_endpoint_rejects_missing_prompt_and_reports_busy_as_503():
+    async def scenario():
+        client = TestClient(TestServer(RAGServer(BusyRAG()).app()))
+        await client.start_server()
+        missing = await client.post("/generate", json={})
+        busy = await client.post("/generate", json={"prompt": "Summarize"})
+        await client.close()
+        return missing.status, busy.status, busy.headers.get("Retry-After")
+
+    assert asyncio.run(scenario()) == (400, 503, "1")
+
+def test_client_maps_service_unavailable_to_pipeline_busy():
+    response = requests.Response()
+    response.status_code, response._content = 503, b"queue full"
+    with pytest.raises(PipelineBusy, match="queue full"):
+        RemoteRAG._check(response)
+
+class BatchTokenizer(CharTokenizer):
+    def __call__(self, prompts, **kwargs):
+        return {"input_ids": torch.zeros((len(prompts), 2), dtype=torch.long)}
+
+    def batch_decode(self, outputs, skip_special_tokens=True):
+        return ["done"] * len(outputs)
+
+class RecordingModel:
+    def generate(self, input_ids, streamer, stopping_criteria, **kwargs):
+        self.stopped = stopping_criteria[0](input_ids, None).tolist()
+        return input_ids
+
+def test_generate_batch_skips_stopped_requests_and_stops_rows_on_their_handles():
+    rag = BusyRAG()
+    rag.tokenizer, rag.model, rag.GENERATION_KWARGS = BatchTokenizer(), RecordingModel(), {}
+    rag.generation_pool = GenerationPool()
+    skipped, running = GenerationHandle(), GenerationHandle()
+    skipped.cancel()
+    results = RAGServer(rag)._generate_batch([("a", None, skipped), ("b", None, running)])
+    assert results == [None, "done"]
+    assert rag.model.stopped == [False]
+    running.cancel()
+    assert RAGServer(rag)._generate_batch([("b", None, running)]) == [None]
+    # Server batches show up in the pool's counters like any other generation
+    assert rag.generation_pool.stats()["completed"] == 1
+
+class FakeResponse:
+    closed = False
+
+    def iter_lines(self, decode_unicode=True):
+        yield from ["event: token", "data: \"Late \"", "", "event: token", "data: \"fees.\"", ""]
+
+    def close(self):
+        self.closed = True
+
+def test_remote_stream_closes_the_response_when_cancelled_or_abandoned():
+    response = FakeResponse()
+    stream = RemoteStream(response, _sse_events(response))
+    pieces = iter(stream)
+    assert next(pieces) == "Late "
+    pieces.close()
+    assert response.closed
+
+    response = FakeResponse()
+    RemoteStream(response, _sse_events(response)).cancel()
+    assert response.closed
+
+class RetrievalPipeline(StubPipeline):
+    def _retrieve_many(self, requests, with_distances=False):
+        return [([3], {3: 0.0}) for _ in requests]
+
+    def _rerank_many(self, questions, labels, distances=None):
+        return [list(row) for row in labels]
+
+    def _document(self, label):
+        return Document(page_content=f"chunk {label}", metadata={"complaint_id": str(label)})
+
+def test_retrieval_stage_builds_prompts_under_the_pinned_snapshot():
+    rag = RetrievalPipeline(prompt_tokens=None, refresh_interval=None)
+    request = {"question": "fees?", "history": "", "k": 5, "product": None, "sub_product": None, "index": rag.index}
+    [(prompt, docs, version)] = RAGServer(rag)._retrieve_batch([request])
+    assert "Snippet 1: chunk 3" in prompt and "fees?" in prompt
+    assert [d.metadata["complaint_id"] for d in docs] == ["3"]
+
+class HangingServer(StubServer):
+    retrieval_delay = 0.0
+    generated = None
+
+    def _retrieve_batch(self, requests):
+        time.sleep(self.retrieval_delay)
+        return super()._retrieve_batch(requests)
+
+    def _generate_batch(self, items):
+        self.generated = []
+        for _, on_text, handle in items:
+            on_text("Late ")
+            # Runs until the request is cancelled (or the test gives up)
+            for _ in range(500):
+                if handle.should_stop():
+                    break
+                time.sleep(0.01)
+        self.generated = [handle.cancelled for _, _, handle in items]
+        return [None] * len(items)
+
+def test_stream_disconnect_cancels_the_generation():
+    async def scenario(retrieval_delay):
+        server = HangingServer(StubPipeline(prompt_tokens=None, refresh_interval=None))
+        server.retrieval_delay = retrieval_delay
+        client = TestClient(TestServer(server.app(), handler_cancellation=True))
+        await client.start_server()
+        request = asyncio.create_task(client.post("/stream", json={"question": "fees"}))
+        if retrieval_delay:
+            # Gone before the first event
+            await asyncio.sleep(retrieval_delay / 2)
+            request.cancel()
+        else:
+            response = await request
+            await response.content.readuntil(b"event: token")
+            response.close()
+        for _ in range(100):
+            if server.generated:
+                break
+            await asyncio.sleep(0.01)
+        await client.close()
+        return server.generated
+
+    assert asyncio.run(scenario(0.0)) == [True]
+    # The answer task is cancelled with the handler, so generation never starts
+    assert asyncio.run(scenario(0.3)) is None